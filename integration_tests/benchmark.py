@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+"""
+End-to-end throughput benchmark of SourceYahooAds.read() against the local mock Yahoo Ads API.
+
+Every run gets a fresh mock server process and a fresh connector process, so the synthetic report generation
+does not compete with the connector for the GIL and the peak RSS is that of a single sync.
+
+    python -m integration_tests.benchmark --rows 1000,100000,1000000 --option YSS --days 7
+
+Each run prints one JSON line with records/s, time to first record, peak RSS and the request count per endpoint.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import time
+from datetime import datetime, timedelta
+from typing import Any, List, Mapping
+from unittest import mock
+
+import requests
+from airbyte_cdk.entrypoint import AirbyteEntrypoint
+from airbyte_cdk.models import (ConfiguredAirbyteCatalog, ConfiguredAirbyteStream,
+                                DestinationSyncMode, SyncMode, Type)
+from source_yahoo_ads.api import YahooAds
+from source_yahoo_ads.source import (DESIRED_STREAMS, STREAM_CLASSES,
+                                     SourceYahooAds)
+
+from .mock_server import STATS_PATH, MockYahooAdsServer, use_mock_server
+
+
+def make_config(option: str, days: int, **overrides: Any) -> Mapping[str, Any]:
+    end_date = datetime.strptime(YahooAds.get_report_end_date(), "%Y%m%d")
+    return {
+        "client_id": "benchmark",
+        "client_secret": "benchmark",
+        "refresh_token": "benchmark",
+        "start_date": (end_date - timedelta(days=days - 1)).strftime("%Y%m%d"),
+        "sync_option": {"option": option, "yss_account_id": "1000", "ydn_account_id": "2000"},
+        # Every run starts without the learned preparation times of earlier runs
+        "report_prepare_time_history_path": None,
+        **overrides,
+    }
+
+
+def make_catalog(option: str) -> ConfiguredAirbyteCatalog:
+    streams = [STREAM_CLASSES[(item["ads_type"], item["stream"])]() for item in DESIRED_STREAMS[option]]
+    return ConfiguredAirbyteCatalog(streams=[
+        ConfiguredAirbyteStream(
+            stream=stream.as_airbyte_stream(),
+            sync_mode=SyncMode.full_refresh,
+            destination_sync_mode=DestinationSyncMode.overwrite,
+        )
+        for stream in streams
+    ])
+
+
+def run_read(base_url: str, config: Mapping[str, Any], catalog: ConfiguredAirbyteCatalog,
+             report_prepare_time: float = None) -> Mapping[str, Any]:
+    logger = logging.getLogger("airbyte")
+    records = 0
+    time_to_first_record = None
+    with use_mock_server(base_url), \
+            mock.patch.object(YahooAds, "REPORT_PREPARE_TIME", report_prepare_time or YahooAds.REPORT_PREPARE_TIME):
+        started_at = time.perf_counter()
+        for message in SourceYahooAds().read(logger, config, catalog, state=[]):
+            # Serialize like the entrypoint does before printing, it is a large part of the cost per record
+            AirbyteEntrypoint.airbyte_message_to_string(message)
+            if message.type == Type.RECORD:
+                if time_to_first_record is None:
+                    time_to_first_record = time.perf_counter() - started_at
+                records += 1
+        elapsed = time.perf_counter() - started_at
+    return {
+        "records": records,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 1) if elapsed else None,
+        "time_to_first_record": None if time_to_first_record is None else round(time_to_first_record, 3),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _serve(server_kwargs: Mapping[str, Any], base_urls: multiprocessing.Queue, stop: multiprocessing.Event) -> None:
+    with MockYahooAdsServer(**server_kwargs) as server:
+        base_urls.put(server.base_url)
+        stop.wait()
+
+
+def _read(base_url: str, config: Mapping[str, Any], option: str, report_prepare_time: float, results: multiprocessing.Queue) -> None:
+    results.put(run_read(base_url, config, make_catalog(option), report_prepare_time))
+
+
+def benchmark(rows_per_report: int, option: str = "YSS", days: int = 7, prepare_delay: float = 0, latency: float = 0,
+              report_prepare_time: float = None, **config_overrides: Any) -> Mapping[str, Any]:
+    server_kwargs = {"rows_per_report": rows_per_report, "prepare_delay": prepare_delay, "latency": latency}
+    base_urls, results, stop = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve, args=(server_kwargs, base_urls, stop), daemon=True)
+    server.start()
+    try:
+        base_url = base_urls.get(timeout=30)
+        config = make_config(option, days, **config_overrides)
+        reader = multiprocessing.Process(target=_read, args=(base_url, config, option, report_prepare_time, results))
+        reader.start()
+        result = results.get()
+        reader.join()
+        request_counts = requests.get(f"{base_url}{STATS_PATH}").json()["request_counts"]
+    finally:
+        stop.set()
+        server.join(timeout=5)
+    return {"rows_per_report": rows_per_report, "option": option, "days": days, **result, "request_counts": request_counts}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark SourceYahooAds.read() against the local mock Yahoo Ads API")
+    parser.add_argument("--rows", default="1000,100000", help="comma separated rows per report, e.g. 1000,1000000,10000000")
+    parser.add_argument("--option", default="YSS", choices=sorted(DESIRED_STREAMS))
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--prepare-delay", type=float, default=0, help="seconds until the mock reports are COMPLETED")
+    parser.add_argument("--latency", type=float, default=0, help="seconds the mock adds to every response")
+    parser.add_argument("--report-prepare-time", type=float, default=None, help="override YahooAds.REPORT_PREPARE_TIME")
+    parser.add_argument("--config", default=None, help="JSON object merged into the connector config")
+    args = parser.parse_args()
+
+    config_overrides = json.loads(args.config) if args.config else {}
+    rows: List[int] = [int(value) for value in args.rows.split(",")]
+    for rows_per_report in rows:
+        result = benchmark(
+            rows_per_report,
+            option=args.option,
+            days=args.days,
+            prepare_delay=args.prepare_delay,
+            latency=args.latency,
+            report_prepare_time=args.report_prepare_time,
+            **config_overrides,
+        )
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
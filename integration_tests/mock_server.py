@@ -0,0 +1,414 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+"""
+Local stand-in for the Yahoo Ads API, used to exercise and benchmark the connector without spending real quota.
+
+It serves the OAuth token endpoint and ReportDefinitionService add/get/download/remove of both the search (YSS)
+and the display (YDN) API. Report jobs become COMPLETED after a configurable preparation delay, and downloads
+stream a synthetic CSV with the Japanese headers of the requested fields.
+
+    python -m integration_tests.mock_server --port 8080 --rows-per-report 1000000 --prepare-delay 10
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import random
+import threading
+import time
+import zipfile
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator, List, Mapping, Optional
+from unittest import mock
+
+from source_yahoo_ads import api
+from source_yahoo_ads.streams import YahooDisplayAdsStream, YahooSearchAdsStream
+
+ACCESS_TOKEN = "mock-access-token"
+SEARCH_PATH = "/search/api/v10/ReportDefinitionService/"
+DISPLAY_PATH = "/display/api/v10/ReportDefinitionService/"
+TOKEN_PATH = "/oauth/v1/token"
+STATS_PATH = "/__stats"
+
+DEVICES = ("PC", "スマートフォン", "タブレット")
+# Size of the pools the synthetic names and metrics are drawn from
+VALUE_POOL_SIZE = 101
+
+
+def _api_names(ads_type: str) -> Mapping[str, str]:
+    # request_name -> Japanese CSV header of every field the connector can ask for
+    streams = api.YAHOO_ADS_SEARCH if ads_type == "YSS" else api.YAHOO_ADS_DISPLAY
+    api_names = {
+        field["request_name"]: field["api_name"]
+        for name, fields in streams.items() if name != "BASE_URL"
+        for field in fields
+    }
+    api_names.update({field["request_name"]: field["api_name"] for field in api.TIME_UNIT_FIELDS.values()})
+    return api_names
+
+
+def _value_pool(request_name: str, api_name: str, rng: random.Random) -> List[str]:
+    if request_name.endswith("_NAME") or request_name in ("KEYWORD", "SEARCHKEYWORD"):
+        return [f"{api_name}{index}" for index in range(VALUE_POOL_SIZE)]
+    if request_name.endswith("_RATE"):
+        # Yahoo writes '--' when a rate can't be computed
+        return ["--"] + [f"{rng.uniform(0, 100):.2f}" for _ in range(VALUE_POOL_SIZE - 1)]
+    if request_name.startswith("AVG_"):
+        return [f"{rng.uniform(1, 500):.1f}" for _ in range(VALUE_POOL_SIZE)]
+    return [str(rng.randint(0, 100000)) for _ in range(VALUE_POOL_SIZE)]
+
+
+class SyntheticReport:
+    """
+    Deterministic report rows of the requested fields, spread evenly over the days of the date range.
+    Every (day, device, id) combination is unique, so primary keys stay unique as well.
+    """
+
+    def __init__(self, ads_type: str, account_id: str, fields: List[str], start_date: str, end_date: str, rows: int) -> None:
+        self.rows = rows
+        self.compress_type = "NONE"
+        api_names = _api_names(ads_type)
+        self.header = [api_names.get(field, field) for field in fields]
+        start = datetime.strptime(start_date, "%Y%m%d")
+        day_count = (datetime.strptime(end_date, "%Y%m%d") - start).days + 1
+        days = [start + timedelta(days=offset) for offset in range(max(day_count, 1))]
+        # Weekly and monthly reports have one set of rows per week or month instead of per day
+        if "WEEK" in fields:
+            periods = [(day - timedelta(days=day.weekday())).strftime("%Y-%m-%d") for day in days]
+        elif "MONTH" in fields:
+            periods = [day.strftime("%Y-%m") for day in days]
+        else:
+            periods = [day.strftime("%Y-%m-%d") for day in days]
+        self.days = list(dict.fromkeys(periods))
+        self.rows_per_day = max(-(-rows // len(self.days)), 1)
+        self.devices = DEVICES if "DEVICE" in fields else ("",)
+        rng = random.Random(f"{ads_type}{account_id}{fields}")
+        self.columns = [self._column(field, api_name, account_id, rng) for field, api_name in zip(fields, self.header)]
+
+    @staticmethod
+    def _column(request_name: str, api_name: str, account_id: str, rng: random.Random) -> Callable[[int, str, int], str]:
+        # (row, day, entity) -> cell
+        if request_name == "ACCOUNT_ID":
+            return lambda row, day, entity: account_id
+        if request_name in ("DAY", "WEEK", "MONTH"):
+            return lambda row, day, entity: day
+        if request_name == "DEVICE":
+            return lambda row, day, entity: DEVICES[row % len(DEVICES)]
+        if request_name == "CAMPAIGN_ID":
+            return lambda row, day, entity: str(entity // 100 + 1)
+        if request_name == "ADGROUP_ID":
+            return lambda row, day, entity: str(entity // 10 + 1)
+        if request_name.endswith("_ID"):
+            return lambda row, day, entity: str(entity + 1)
+        pool = _value_pool(request_name, api_name, rng)
+        return lambda row, day, entity: pool[row % VALUE_POOL_SIZE]
+
+    def lines(self) -> Iterator[str]:
+        yield ",".join(self.header) + "\n"
+        for row in range(self.rows):
+            day = self.days[row // self.rows_per_day]
+            entity = (row % self.rows_per_day) // len(self.devices)
+            yield ",".join([column(row, day, entity) for column in self.columns]) + "\n"
+
+
+class MockYahooAdsApi:
+    """
+    State of the mock API: report jobs, their synthetic reports and the number of requests per endpoint.
+    """
+
+    def __init__(
+        self,
+        rows_per_report: int = 1000,
+        prepare_delay: float = 0,
+        latency: float = 0,
+        download_chunk_rows: int = 1000,
+        gzip: bool = True,
+    ) -> None:
+        self.rows_per_report = rows_per_report
+        # Seconds from add until the job is COMPLETED
+        self.prepare_delay = prepare_delay
+        # Seconds added to every response
+        self.latency = latency
+        self.download_chunk_rows = download_chunk_rows
+        # Use gzip transfer encoding when the client accepts it
+        self.gzip = gzip
+        self.request_counts = Counter()
+        self.jobs = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self.request_counts[endpoint] += 1
+
+    def add(self, ads_type: str, body: Mapping[str, Any]) -> Mapping[str, Any]:
+        values = []
+        for operand in body["operand"]:
+            with self._lock:
+                report_job_id = next(self._job_ids)
+                self.jobs[report_job_id] = {
+                    "ads_type": ads_type,
+                    "account_id": str(body["accountId"]),
+                    "fields": operand["fields"],
+                    "start_date": operand["dateRange"]["startDate"],
+                    "end_date": operand["dateRange"]["endDate"],
+                    "compress_type": operand.get("reportCompressType", "NONE"),
+                    "report_name": operand.get("reportName"),
+                    "request_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "added_at": time.monotonic(),
+                }
+            values.append({
+                "operationSucceeded": True,
+                "reportDefinition": {**operand, "reportJobId": report_job_id, "reportJobStatus": "WAIT"},
+            })
+        return {"rval": {"values": values}}
+
+    def status(self, report_job_id: int) -> str:
+        job = self.jobs.get(report_job_id)
+        if job is None:
+            return "UNKNOWN"
+        return "COMPLETED" if time.monotonic() - job["added_at"] >= self.prepare_delay else "IN_PROGRESS"
+
+    def get(self, body: Mapping[str, Any]) -> Mapping[str, Any]:
+        if "reportJobIds" not in body:
+            return self.list(body)
+        values = []
+        for report_job_id in body.get("reportJobIds", []):
+            status = self.status(int(report_job_id))
+            if status == "UNKNOWN":
+                values.append({"operationSucceeded": False, "errors": [{"code": "0001", "message": "Not found"}]})
+            else:
+                values.append({
+                    "operationSucceeded": True,
+                    "reportDefinition": {"reportJobId": int(report_job_id), "reportJobStatus": status},
+                })
+        return {"rval": {"values": values}}
+
+    def list(self, body: Mapping[str, Any]) -> Mapping[str, Any]:
+        # Every report definition of the account, one page of numberResults from the 1-based startIndex
+        with self._lock:
+            jobs = [(report_job_id, job) for report_job_id, job in self.jobs.items() if job["account_id"] == str(body["accountId"])]
+        start_index = body.get("startIndex", 1) - 1
+        values = [
+            {
+                "operationSucceeded": True,
+                "reportDefinition": {
+                    "reportJobId": report_job_id,
+                    "reportName": job["report_name"],
+                    "reportJobStatus": self.status(report_job_id),
+                    "requestTime": job["request_time"],
+                },
+            }
+            for report_job_id, job in jobs[start_index:start_index + body.get("numberResults", 500)]
+        ]
+        return {"rval": {"totalNumEntries": len(jobs), "values": values}}
+
+    def remove(self, body: Mapping[str, Any]) -> Mapping[str, Any]:
+        values = []
+        for operand in body["operand"]:
+            with self._lock:
+                removed = self.jobs.pop(int(operand["reportJobId"]), None)
+            values.append({"operationSucceeded": removed is not None, "reportDefinition": {"reportJobId": operand["reportJobId"]}})
+        return {"rval": {"values": values}}
+
+    def report(self, body: Mapping[str, Any]) -> Optional[SyntheticReport]:
+        job = self.jobs.get(int(body["reportJobId"]))
+        if job is None or self.status(int(body["reportJobId"])) != "COMPLETED":
+            return None
+        report = SyntheticReport(job["ads_type"], job["account_id"], job["fields"], job["start_date"], job["end_date"], self.rows_per_report)
+        report.compress_type = job["compress_type"]
+        return report
+
+
+class MockYahooAdsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock_api: MockYahooAdsApi = None
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Keep the connector output readable
+        pass
+
+    def _send_json(self, body: Any, status: int = 200) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def do_GET(self) -> None:
+        if self.path == STATS_PATH:
+            self._send_json({"request_counts": dict(self.mock_api.request_counts), "jobs": len(self.mock_api.jobs)})
+        else:
+            self._send_json([{"errorCode": "NOT_FOUND"}], status=404)
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        if self.mock_api.latency:
+            time.sleep(self.mock_api.latency)
+        if self.path == TOKEN_PATH:
+            self.mock_api.count("token")
+            self._send_json({"access_token": ACCESS_TOKEN, "token_type": "Bearer", "expires_in": 3600})
+            return
+        if self.path.startswith(SEARCH_PATH):
+            ads_type, operation = "YSS", self.path[len(SEARCH_PATH):]
+        elif self.path.startswith(DISPLAY_PATH):
+            ads_type, operation = "YDN", self.path[len(DISPLAY_PATH):]
+        else:
+            self._send_json([{"errorCode": "NOT_FOUND"}], status=404)
+            return
+        self.mock_api.count(operation)
+        if self.headers.get("Authorization") != f"Bearer {ACCESS_TOKEN}":
+            self._send_json([{"errorCode": "INVALID_TOKEN", "message": "Invalid access token"}], status=401)
+            return
+        request = json.loads(body or b"{}")
+        if operation == "add":
+            self._send_json(self.mock_api.add(ads_type, request))
+        elif operation == "get":
+            self._send_json(self.mock_api.get(request))
+        elif operation == "remove":
+            self._send_json(self.mock_api.remove(request))
+        elif operation == "download":
+            self._send_report(self.mock_api.report(request))
+        else:
+            self._send_json([{"errorCode": "NOT_FOUND"}], status=404)
+
+    def _send_report(self, report: Optional[SyntheticReport]) -> None:
+        if report is None:
+            self._send_json([{"errorCode": "REPORT_NOT_READY", "message": "Report is not ready"}], status=400)
+            return
+        use_gzip = self.mock_api.gzip and "gzip" in self.headers.get("Accept-Encoding", "")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip" if report.compress_type == "ZIP" else "text/csv; charset=utf-8")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        writer = _ChunkWriter(self._write_chunk, zlib.compressobj(wbits=31) if use_gzip else None)
+        if report.compress_type == "ZIP":
+            # zipfile streams to an unseekable file by writing a data descriptor after the member
+            with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                with archive.open("report.csv", "w", force_zip64=True) as member:
+                    self._write_lines(report, member.write)
+        else:
+            self._write_lines(report, writer.write)
+        writer.close()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_lines(self, report: SyntheticReport, write: Callable[[bytes], Any]) -> None:
+        lines = report.lines()
+        while True:
+            chunk = "".join(itertools.islice(lines, self.mock_api.download_chunk_rows))
+            if not chunk:
+                break
+            write(chunk.encode("utf-8"))
+
+
+class _ChunkWriter:
+    # Unseekable file object writing HTTP chunks, gzip-compressed when a compressor is given
+    def __init__(self, write_chunk: Callable[[bytes], None], compressor: Any = None) -> None:
+        self.write_chunk = write_chunk
+        self.compressor = compressor
+        self.position = 0
+
+    def write(self, data: bytes) -> int:
+        size = len(data)
+        self.position += size
+        if self.compressor:
+            data = self.compressor.compress(data)
+        if data:
+            self.write_chunk(data)
+        return size
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.compressor:
+            data = self.compressor.flush()
+            self.compressor = None
+            if data:
+                self.write_chunk(data)
+
+
+class MockYahooAdsServer:
+    """
+    Runs MockYahooAdsApi on a local port in a background thread.
+    """
+
+    def __init__(self, port: int = 0, **api_kwargs: Any) -> None:
+        self.mock_api = MockYahooAdsApi(**api_kwargs)
+        handler = type("BoundMockYahooAdsRequestHandler", (MockYahooAdsRequestHandler,), {"mock_api": self.mock_api})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockYahooAdsServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockYahooAdsServer":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+
+@contextlib.contextmanager
+def use_mock_server(base_url: str) -> Iterator[None]:
+    # Point the connector at the mock server instead of the real Yahoo Ads API
+    search_url = f"{base_url}{SEARCH_PATH}"
+    display_url = f"{base_url}{DISPLAY_PATH}"
+    with mock.patch.object(api, "YAHOO_ADS_OAUTH_URL", f"{base_url}{TOKEN_PATH}"), \
+            mock.patch.dict(api.YAHOO_ADS_SEARCH, {"BASE_URL": search_url}), \
+            mock.patch.dict(api.YAHOO_ADS_DISPLAY, {"BASE_URL": display_url}), \
+            mock.patch.object(YahooSearchAdsStream, "url_base", search_url), \
+            mock.patch.object(YahooDisplayAdsStream, "url_base", display_url):
+        yield
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Yahoo Ads API")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rows-per-report", type=int, default=1000)
+    parser.add_argument("--prepare-delay", type=float, default=0, help="seconds until a report job is COMPLETED")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    args = parser.parse_args()
+    server = MockYahooAdsServer(
+        port=args.port, rows_per_report=args.rows_per_report, prepare_delay=args.prepare_delay, latency=args.latency)
+    print(f"Serving the mock Yahoo Ads API on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
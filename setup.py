@@ -9,6 +9,11 @@ MAIN_REQUIREMENTS = [
     "airbyte-cdk~=0.2",
 ]
 
+# Needed by the async engine only, see source_yahoo_ads/async_api.py
+ASYNC_REQUIREMENTS = [
+    "httpx>=0.23",
+]
+
 TEST_REQUIREMENTS = [
     "pytest~=6.2",
     "pytest-mock~=3.6.1",
@@ -25,5 +30,6 @@ setup(
     package_data={"": ["*.json", "*.yaml", "schemas/*.json", "schemas/shared/*.json"]},
     extras_require={
         "tests": TEST_REQUIREMENTS,
+        "async": ASYNC_REQUIREMENTS,
     },
 )
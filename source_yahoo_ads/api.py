@@ -1,10 +1,10 @@
-# import concurrent.futures
+import concurrent.futures
 import json
 import logging
-import time
 import uuid
-from datetime import datetime, timedelta
-from typing import Any, List, Mapping, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import (Any, Collection, Iterable, List, Mapping, MutableMapping,
+                    Optional, Tuple)
 
 import requests  # type: ignore[import]
 from airbyte_cdk.models import ConfiguredAirbyteCatalog
@@ -12,8 +12,17 @@ from requests import adapters as request_adapters
 # type: ignore[import]
 from requests.exceptions import HTTPError, RequestException
 
+from .auth import YahooAdsTokenManager
 from .exceptions import TypeYahooAdsException
-from .rate_limiting import default_backoff_handler
+from .metrics import SyncMetrics, stream_name
+from .polling import (DEFAULT_PREPARE_TIME_HISTORY_PATH, PollPolicy,
+                      PrepareTimeHistory, ReportJobPrefetcher)
+from .rate_limiting import (YahooAdsRateLimiter, default_backoff_handler,
+                            is_request_limit_exceeded)
+from .report_cache import DEFAULT_ATTRIBUTION_DAYS, ReportCache
+from .utils import ACCOUNT_ID_COLUMN, DAY_COLUMN, DEVICE_COLUMN
+
+YAHOO_ADS_OAUTH_URL = "https://biz-oauth.yahoo.co.jp/oauth/v1/token"
 
 YAHOO_ADS_DISPLAY = {
     'BASE_URL': "https://ads-display.yahooapis.jp/api/v10/ReportDefinitionService/",
@@ -98,11 +107,35 @@ YAHOO_ADS_SEARCH = {
 
 # https://github.com/yahoojp-marketing/ads-search-api-python-samples/blob/master/report_sample.py#L68
 
+# Replace the DAY field of a stream when its rows are aggregated by week or month
+TIME_UNIT_FIELDS = {
+    'DAY': {'request_name': "DAY", 'api_name': "日"},
+    'WEEK': {'request_name': "WEEK", 'api_name': "週"},
+    'MONTH': {'request_name': "MONTH", 'api_name': "月"},
+}
+
 
 class YahooAds:
   logger = logging.getLogger("airbyte")
   parallel_tasks_size = 100
   REPORT_PREPARE_TIME = 5
+  REPORT_POLL_MAX_INTERVAL = 15
+  REPORT_POLL_JITTER = 0.1
+  REPORT_POLL_TIMEOUT = 3600
+  MAX_CONCURRENT_REPORT_JOBS = 4
+  # How often a request waits out REQUEST_LIMIT_EXCEEDED before giving up
+  REQUEST_LIMIT_RETRIES = 5
+  REPORT_COMPRESSION = 'NONE'
+  PREFETCH_REPORTS = 2
+  # Report jobs removed with one ReportDefinitionService/remove request
+  REMOVE_BATCH_SIZE = 100
+  # Report definitions listed per ReportDefinitionService/get request by the stale report sweeper
+  REPORT_LIST_PAGE_SIZE = 500
+  REPORT_NAME_PREFIX = 'YahooReport_'
+  # Besides ISO 8601, which may carry a UTC offset
+  REPORT_REQUEST_TIME_FORMATS = ('%Y/%m/%d %H:%M:%S', '%Y%m%d%H%M%S')
+  # The Yahoo API writes times without an offset in Japan Standard Time
+  YAHOO_ADS_TIMEZONE = timezone(timedelta(hours=9), 'JST')
 
   def __init__(
       self,
@@ -111,6 +144,19 @@ class YahooAds:
       client_secret: str = None,
       sync_option: dict[str, str] = None,
       start_date: str = None,
+      max_concurrent_report_jobs: int = None,
+      report_poll_max_interval: float = None,
+      report_poll_jitter: float = None,
+      report_poll_timeout: float = None,
+      report_prepare_time_history_path: str = DEFAULT_PREPARE_TIME_HISTORY_PATH,
+      token_cache_path: str = None,
+      requests_per_second: float = None,
+      endpoint_requests_per_second: Mapping[str, float] = None,
+      report_compression: str = None,
+      prefetch_reports: int = None,
+      report_cache_path: str = None,
+      report_cache_attribution_days: int = None,
+      async_engine: bool = False,
       **kwargs: Any,
   ) -> None:
     self.refresh_token = refresh_token
@@ -119,8 +165,49 @@ class YahooAds:
     # self.sync_option = sync_option
     self.yss_account_id = sync_option.get('yss_account_id', None)
     self.ydn_account_id = sync_option.get('ydn_account_id', None)
+    # Every account synced per ads type, the single account id first
+    self.account_ids = {
+        'YSS': self._merge_account_ids(self.yss_account_id, sync_option.get('yss_account_ids')),
+        'YDN': self._merge_account_ids(self.ydn_account_id, sync_option.get('ydn_account_ids')),
+    }
     self.start_date = start_date
     self.access_token = None
+    # Shared with the stream authenticator so every request uses a fresh token
+    self.token_manager = YahooAdsTokenManager(
+        fetch_token=self._request_access_token,
+        client_id=client_id,
+        refresh_token=refresh_token,
+        cache_path=token_cache_path,
+    )
+    # Never run more report jobs at once than the connection pool can serve
+    self.max_concurrent_report_jobs = min(
+        max_concurrent_report_jobs or self.MAX_CONCURRENT_REPORT_JOBS, self.parallel_tasks_size)
+    self.poll_policy = PollPolicy(
+        initial_interval=self.REPORT_PREPARE_TIME,
+        max_interval=report_poll_max_interval or self.REPORT_POLL_MAX_INTERVAL,
+        jitter=self.REPORT_POLL_JITTER if report_poll_jitter is None else report_poll_jitter,
+        timeout=report_poll_timeout or self.REPORT_POLL_TIMEOUT,
+    )
+    # Learn the usual preparation time of each stream and account from earlier runs
+    self.prepare_time_history = PrepareTimeHistory(report_prepare_time_history_path)
+    # Completed reports kept ready ahead of the stream that is downloading
+    self.prefetch_reports = self.PREFETCH_REPORTS if prefetch_reports is None else prefetch_reports
+    # Shared with the streams so report jobs and downloads draw from the same request budget
+    self.rate_limiter = YahooAdsRateLimiter(requests_per_second, endpoint_requests_per_second)
+    # 'ZIP' asks Yahoo for compressed reports, the streams inflate them while downloading
+    self.report_compression = report_compression or self.REPORT_COMPRESSION
+    # Per-phase timings and volumes of this sync, shared with the streams
+    self.metrics = SyncMetrics()
+    # Rows of finalized days kept on disk, so only the recent days are requested again
+    self.report_cache = ReportCache(
+        report_cache_path,
+        DEFAULT_ATTRIBUTION_DAYS if report_cache_attribution_days is None else report_cache_attribution_days,
+        self.get_report_end_date(),
+    ) if report_cache_path else None
+
+    # Prepare the report jobs on an asyncio event loop instead of a thread per request, see async_api
+    self.async_engine = async_engine
+    self._async_runner = None
 
     self.session = requests.Session()
     # Change the connection pool size. Default value is not enough for parallel tasks
@@ -128,29 +215,74 @@ class YahooAds:
         pool_connections=self.parallel_tasks_size, pool_maxsize=self.parallel_tasks_size)
     self.session.mount("https://", adapter)
 
+  @staticmethod
+  def _merge_account_ids(account_id: Optional[str], account_ids: Optional[List[str]]) -> List[str]:
+    merged = []
+    for item in [account_id, *(account_ids or [])]:
+      if item and str(item) not in merged:
+        merged.append(str(item))
+    return merged
+
+  def get_account_ids(self, ads_type: str) -> List[str]:
+    return self.account_ids.get(ads_type, [])
+
+  def _get_default_account_id(self, ads_type: str) -> str:
+    return self.yss_account_id if ads_type == "YSS" else self.ydn_account_id
+
   def login(self):
-    login_url = f"https://biz-oauth.yahoo.co.jp/oauth/v1/token"
+    # Reuses the cached token while it is valid, otherwise refreshes it
+    self.access_token = self.token_manager.get_access_token()
+
+  def _request_access_token(self) -> Mapping[str, Any]:
+    login_url = YAHOO_ADS_OAUTH_URL
     login_body = {
         "grant_type": "refresh_token",
         "client_id": self.client_id,
         "client_secret": self.client_secret,
         "refresh_token": self.refresh_token,
     }
-    resp = self._make_request(http_method="POST",
-                              url=login_url,
-                              body=login_body,
-                              headers={
-                                  "Content-Type": "application/x-www-form-urlencoded"
-                              }
-                              )
-
-    auth = resp.json()
-    self.access_token = auth["access_token"]
-
-  def add_report(self, ads_type: str, stream: str, start_date: str) -> dict[str, str]:
-    end_date = (datetime.today() + timedelta(hours=9) +
-                timedelta(days=-1)).strftime('%Y%m%d')
-    account_id = self.yss_account_id if ads_type == "YSS" else self.ydn_account_id
+    with self.metrics.timer('login'):
+      resp = self._make_request(http_method="POST",
+                                url=login_url,
+                                body=login_body,
+                                headers={
+                                    "Content-Type": "application/x-www-form-urlencoded"
+                                }
+                                )
+
+    return resp.json()
+
+  @staticmethod
+  def get_report_end_date() -> str:
+    # Yesterday in JST, the latest day Yahoo can report on
+    return (datetime.today() + timedelta(hours=9) +
+            timedelta(days=-1)).strftime('%Y%m%d')
+
+  def create_report(self, ads_type: str, stream: str, start_date: str, end_date: str = None, account_id: str = None,
+                    fields: List[str] = None) -> dict[str, str]:
+    end_date = end_date or self.get_report_end_date()
+    account_id = account_id or self._get_default_account_id(ads_type)
+    add_config = self._get_add_report_config(ads_type, stream, start_date, end_date, account_id, fields)
+    headers = self._get_standard_headers()
+
+    with self.metrics.timer('add_report', stream_name(ads_type, stream)):
+      add_report_resp = self._make_request(
+          http_method='POST',
+          url=self._get_report_service_url(ads_type, 'add'),
+          body=json.dumps(add_config),
+          headers=headers).json()
+    return self._to_report_job(add_report_resp, ads_type, stream, start_date, end_date, account_id)
+
+  @staticmethod
+  def _get_report_service_url(ads_type: str, operation: str) -> str:
+    if ads_type == 'YDN':
+      return f"{YAHOO_ADS_DISPLAY['BASE_URL']}{operation}"
+    elif ads_type == 'YSS':
+      return f"{YAHOO_ADS_SEARCH['BASE_URL']}{operation}"
+    raise TypeYahooAdsException(f"Unknown ads type {ads_type}")
+
+  def _get_add_report_config(self, ads_type: str, stream: str, start_date: str, end_date: str, account_id: str,
+                             fields: List[str] = None) -> Mapping[str, Any]:
     add_config = {
         "accountId": account_id,
         "operand": [
@@ -159,83 +291,88 @@ class YahooAds:
                     "startDate": start_date,
                     "endDate": end_date
                 },
-                "fields": self._extract_report_fields(ads_type, stream),
+                "fields": fields or self._extract_report_fields(ads_type, stream),
                 "reportDateRangeType": "CUSTOM_DATE",
                 "reportDownloadEncode": "UTF8",
                 "reportDownloadFormat": "CSV",
                 "reportLanguage": "JA",
-                "reportName": f"YahooReport_{ads_type}_{stream}_{end_date}_{uuid.uuid4()}",
+                "reportName": f"{self.REPORT_NAME_PREFIX}{ads_type}_{stream}_{end_date}_{uuid.uuid4()}",
                 "reportSkipReportSummary": "TRUE"
             }
         ]
     }
-
-    if ads_type == 'YDN':
-      add_url = f"{YAHOO_ADS_DISPLAY['BASE_URL']}add"
-      get_url = f"{YAHOO_ADS_DISPLAY['BASE_URL']}get"
-
-    elif ads_type == 'YSS':
-      add_url = f"{YAHOO_ADS_SEARCH['BASE_URL']}add"
-      get_url = f"{YAHOO_ADS_SEARCH['BASE_URL']}get"
+    if self.report_compression != 'NONE':
+      add_config["operand"][0]["reportCompressType"] = self.report_compression
+    if ads_type == 'YSS':
       add_config["operand"][0]["reportType"] = stream if stream == "KEYWORDS" else "AD"
+    return add_config
 
-    headers = self._get_standard_headers()
-
-    add_report_resp = self._make_request(
-        http_method='POST',
-        url=add_url,
-        body=json.dumps(add_config),
-        headers=headers).json()
-
+  @staticmethod
+  def _to_report_job(add_report_resp: Mapping[str, Any], ads_type: str, stream: str, start_date: str, end_date: str,
+                     account_id: str) -> dict[str, str]:
     if not add_report_resp['rval']['values'][0]['operationSucceeded']:
       error = add_report_resp['rval']['values'][0]['errors']
       raise Exception(f'InvalidEnumError: {json.dumps(error)}')
 
-    get_config = {
-        "accountId": account_id,
-        "reportJobIds": [
-            str(add_report_resp['rval']['values'][0]
-                ['reportDefinition']['reportJobId'])
-        ]
-    }
-
-    sleep_duration = self.REPORT_PREPARE_TIME
-    while True:
-      get_report_resp = self._make_request(
-          http_method='POST',
-          url=get_url,
-          body=json.dumps(get_config),
-          headers=headers).json()
-      report_job_status = str(
-          get_report_resp['rval']['values'][0]['reportDefinition']['reportJobStatus'])
-
-      # Break the loop after finishing create the report regardless of completed or failed
-      # WAIT -- Please wait for report request to complete.
-      # COMPLETED -- Report request completed successfully.
-      # IN_PROGRESS -- Report is in creating process.
-      # FAILED -- Report request failed.
-      # UNKNOWN -- Unknown Value
-      if report_job_status not in ['WAIT', 'IN_PROGRESS']:
-        break
-      time.sleep(sleep_duration)
-      # Double the prepare time for the next iteration to reduce hit to Yahoo server
-      sleep_duration *= 2
-
+    report_definition = add_report_resp['rval']['values'][0]['reportDefinition']
     return {
         'ads_type': ads_type,
         'stream': stream,
         'account_id': account_id,
-        'report_job_id': str(get_report_resp['rval']['values'][0]['reportDefinition']['reportJobId']),
-        'report_job_status': str(get_report_resp['rval']['values'][0]['reportDefinition']['reportJobStatus']),
+        'report_job_id': str(report_definition['reportJobId']),
+        'report_job_status': str(report_definition.get('reportJobStatus', 'WAIT')),
+        'start_date': start_date,
+        'end_date': end_date,
     }
 
-  def remove_report(self, ads_type: str, report_job_id: str) -> bool:
-    if ads_type == 'YDN':
-      remove_url = f"{YAHOO_ADS_DISPLAY['BASE_URL']}remove"
-    elif ads_type == 'YSS':
-      remove_url = f"{YAHOO_ADS_SEARCH['BASE_URL']}remove"
+  def get_reports(self, ads_type: str, account_id: str, report_job_ids: List[str]) -> List[dict[str, Any]]:
+    get_config = {
+        "accountId": account_id,
+        "reportJobIds": [str(report_job_id) for report_job_id in report_job_ids]
+    }
+    headers = self._get_standard_headers()
+
+    get_report_resp = self._make_request(
+        http_method='POST',
+        url=self._get_report_service_url(ads_type, 'get'),
+        body=json.dumps(get_config),
+        headers=headers).json()
+    return self._to_report_definitions(get_report_resp)
+
+  @staticmethod
+  def _to_report_definitions(get_report_resp: Mapping[str, Any]) -> List[dict[str, Any]]:
+    return [value['reportDefinition'] for value in get_report_resp['rval']['values']
+            if value.get('operationSucceeded') and value.get('reportDefinition')]
+
+  def prefetch_report_jobs(self, report_requests: List[dict[str, str]]) -> ReportJobPrefetcher:
+    # Return right away and create and poll the report jobs in the background in the order of report_requests,
+    # so the first report can be downloaded while the later ones are preparing.
+    if self.async_engine:
+      return self.get_async_runner().prefetch_report_jobs(report_requests)
+    return ReportJobPrefetcher(
+        self,
+        report_requests,
+        max_concurrent_report_jobs=self.max_concurrent_report_jobs,
+        max_ready_reports=self.prefetch_reports,
+        poll_policy=self.poll_policy,
+        prepare_time_history=self.prepare_time_history,
+        metrics=self.metrics,
+    ).start()
+
+  def get_async_runner(self) -> "AsyncYahooAdsRunner":
+    if self._async_runner is None:
+      from .async_api import AsyncYahooAdsRunner
+      self._async_runner = AsyncYahooAdsRunner(self)
+    return self._async_runner
+
+  def close(self) -> None:
+    if self._async_runner is not None:
+      self._async_runner.close()
+      self._async_runner = None
+
+  def remove_report(self, ads_type: str, report_job_id: str, account_id: str = None, stream: str = None) -> bool:
     remove_config = {
-        "accountId": self.yss_account_id if ads_type == "YSS" else self.ydn_account_id,
+        "accountId": account_id or self._get_default_account_id(ads_type),
         "operand": [
             {
                 "reportJobId": report_job_id
@@ -244,16 +381,128 @@ class YahooAds:
     }
     headers = self._get_standard_headers()
 
-    resp = self._make_request(
-        http_method='POST',
-        url=remove_url,
-        body=json.dumps(remove_config),
-        headers=headers).json()
+    with self.metrics.timer('remove_report', stream_name(ads_type, stream) if stream else ''):
+      resp = self._make_request(
+          http_method='POST',
+          url=self._get_report_service_url(ads_type, 'remove'),
+          body=json.dumps(remove_config),
+          headers=headers).json()
+    return self._check_remove_report_response(resp)
+
+  @staticmethod
+  def _check_remove_report_response(resp: Mapping[str, Any]) -> bool:
     if not resp['rval']['values'][0]['operationSucceeded']:
       error = resp['rval']['values'][0]['errors']
       raise Exception(f'InvalidEnumError: {json.dumps(error)}')
     return resp['rval']['values'][0]['operationSucceeded']
 
+  def remove_reports(self, report_jobs: Iterable[Mapping[str, Any]]) -> int:
+    # Remove report jobs of any status with one request per account and REMOVE_BATCH_SIZE jobs,
+    # the batches side by side. Returns the number of removed jobs.
+    # Cleanup must not fail a sync, jobs that could not be removed are logged and left to the stale report sweeper.
+    report_job_ids: MutableMapping[Tuple[str, str], List[str]] = {}
+    for report_job in report_jobs:
+      if report_job.get('report_job_id') is not None:
+        report_job_ids.setdefault((report_job['ads_type'], str(report_job['account_id'])), []).append(
+            report_job['report_job_id'])
+    batches = [
+        (ads_type, account_id, job_ids[index:index + self.REMOVE_BATCH_SIZE])
+        for (ads_type, account_id), job_ids in report_job_ids.items()
+        for index in range(0, len(job_ids), self.REMOVE_BATCH_SIZE)
+    ]
+    if not batches:
+      return 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(batches), self.max_concurrent_report_jobs)) as executor:
+      return sum(executor.map(lambda batch: self._remove_report_batch(*batch), batches))
+
+  def _remove_report_batch(self, ads_type: str, account_id: str, report_job_ids: List[str]) -> int:
+    remove_config = {
+        "accountId": account_id,
+        "operand": [{"reportJobId": report_job_id} for report_job_id in report_job_ids]
+    }
+    try:
+      with self.metrics.timer('remove_reports', ads_type.lower()):
+        resp = self._make_request(
+            http_method='POST',
+            url=self._get_report_service_url(ads_type, 'remove'),
+            body=json.dumps(remove_config),
+            headers=self._get_standard_headers()).json()
+    except RequestException as err:
+      self.logger.warning(f"Could not remove {len(report_job_ids)} reports of {ads_type} account {account_id}: {err}")
+      return 0
+    removed_report_count = 0
+    for report_job_id, value in zip(report_job_ids, resp['rval']['values'] or []):
+      if value.get('operationSucceeded'):
+        removed_report_count += 1
+      else:
+        self.logger.warning(
+            f"Could not remove report {report_job_id} of {ads_type} account {account_id}: {json.dumps(value.get('errors'))}")
+    self.metrics.add('removed_reports', removed_report_count, ads_type.lower())
+    return removed_report_count
+
+  def list_report_definitions(self, ads_type: str, account_id: str) -> List[dict[str, Any]]:
+    # Every report definition of the account, REPORT_LIST_PAGE_SIZE per request
+    report_definitions = []
+    start_index = 1
+    while True:
+      resp = self._make_request(
+          http_method='POST',
+          url=self._get_report_service_url(ads_type, 'get'),
+          body=json.dumps({"accountId": account_id, "startIndex": start_index, "numberResults": self.REPORT_LIST_PAGE_SIZE}),
+          headers=self._get_standard_headers()).json()
+      report_definitions.extend(self._to_report_definitions(resp))
+      total_num_entries = resp['rval'].get('totalNumEntries')
+      start_index += self.REPORT_LIST_PAGE_SIZE
+      if len(resp['rval']['values'] or []) < self.REPORT_LIST_PAGE_SIZE or (
+              total_num_entries is not None and start_index > total_num_entries):
+        return report_definitions
+
+  def sweep_stale_reports(self, ads_type: str, account_id: str, older_than_hours: float,
+                          keep_report_job_ids: Collection[str] = ()) -> int:
+    # Remove the reports of this connector (see REPORT_NAME_PREFIX) requested more than older_than_hours ago,
+    # e.g. left behind by crashed syncs. Reports of running syncs are younger and reports without
+    # a readable request time are kept. Returns the number of removed reports.
+    requested_before = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    keep_report_job_ids = {str(report_job_id) for report_job_id in keep_report_job_ids}
+    try:
+      report_definitions = self.list_report_definitions(ads_type, account_id)
+    except RequestException as err:
+      self.logger.warning(f"Could not list the reports of {ads_type} account {account_id}: {err}")
+      return 0
+    stale_report_jobs = []
+    for report_definition in report_definitions:
+      requested_at = self._get_report_request_time(report_definition)
+      if (str(report_definition.get('reportName') or '').startswith(self.REPORT_NAME_PREFIX)
+              and str(report_definition['reportJobId']) not in keep_report_job_ids
+              and requested_at is not None and requested_at < requested_before):
+        stale_report_jobs.append(
+            {'ads_type': ads_type, 'account_id': account_id, 'report_job_id': report_definition['reportJobId']})
+    if not stale_report_jobs:
+      return 0
+    removed_report_count = self.remove_reports(stale_report_jobs)
+    self.logger.info(
+        f"Removed {removed_report_count}/{len(stale_report_jobs)} stale reports of {ads_type} account {account_id}")
+    return removed_report_count
+
+  @classmethod
+  def _get_report_request_time(cls, report_definition: Mapping[str, Any]) -> Optional[datetime]:
+    # A timezone-aware requestTime, None if it can't be read
+    request_time = str(report_definition.get('requestTime') or '')
+    try:
+      requested_at = datetime.fromisoformat(request_time.replace('Z', '+00:00'))
+    except ValueError:
+      requested_at = None
+    for request_time_format in cls.REPORT_REQUEST_TIME_FORMATS:
+      if requested_at is not None:
+        break
+      try:
+        requested_at = datetime.strptime(request_time, request_time_format)
+      except ValueError:
+        continue
+    if requested_at is not None and requested_at.tzinfo is None:
+      requested_at = requested_at.replace(tzinfo=cls.YAHOO_ADS_TIMEZONE)
+    return requested_at
+
   @default_backoff_handler(max_tries=5, factor=5)
   def _make_request(
       self,
@@ -264,17 +513,30 @@ class YahooAds:
       stream: bool = False,
       params: dict = None
   ) -> requests.models.Response:
-    try:
-      if http_method == "GET":
-        resp = self.session.get(
-            url, headers=headers, stream=stream, params=params)
-      elif http_method == "POST":
-        resp = self.session.post(url, headers=headers, data=body)
-      resp.raise_for_status()
-    except HTTPError as err:
-      self.logger.warn(f"http error body: {err.response.text}")
-      raise
-    return resp
+    limit_retries = 0
+    while True:
+      self.rate_limiter.acquire(url)
+      try:
+        if http_method == "GET":
+          resp = self.session.get(
+              url, headers=headers, stream=stream, params=params)
+        elif http_method == "POST":
+          resp = self.session.post(url, headers=headers, data=body)
+        resp.raise_for_status()
+      except HTTPError as err:
+        if is_request_limit_exceeded(err.response) and limit_retries < self.REQUEST_LIMIT_RETRIES:
+          # Slow down and wait until the quota window resets instead of failing the sync
+          limit_retries += 1
+          wait = self.rate_limiter.on_limit_exceeded(url, err.response)
+          self.logger.warning(f"Request limit exceeded for {url}, retrying in {wait:.0f} seconds")
+          continue
+        self.logger.warn(f"http error body: {err.response.text}")
+        raise
+      self.rate_limiter.on_success(url)
+      return resp
+
+  def get_report_cache_partition(self, ads_type: str, stream: str, account_id: str, fields: List[str] = None) -> str:
+    return ReportCache.partition(ads_type, stream, account_id, fields or self._extract_report_fields(ads_type, stream))
 
   def _extract_report_fields(self, ads_type: str, stream: str):
     if ads_type == 'YDN':
@@ -282,8 +544,31 @@ class YahooAds:
     elif ads_type == 'YSS':
       return [item['request_name'] for item in YAHOO_ADS_SEARCH[stream]]
 
+  @staticmethod
+  def get_report_field_mapping(ads_type: str, stream: str, time_unit: str = 'DAY',
+                               include_device: bool = True) -> List[Mapping[str, str]]:
+    # The fields of the stream at the given granularity, Yahoo sums the metrics over the dropped dimensions
+    fields = []
+    for item in (YAHOO_ADS_DISPLAY[stream] if ads_type == 'YDN' else YAHOO_ADS_SEARCH[stream]):
+      if item['api_name'] == DAY_COLUMN:
+        fields.append(TIME_UNIT_FIELDS[time_unit])
+      elif item['api_name'] != DEVICE_COLUMN or include_device:
+        fields.append(item)
+    return fields
+
+  def get_report_fields(self, ads_type: str, stream: str, selected_columns: Optional[Collection[str]] = None,
+                        required_columns: Collection[str] = (), time_unit: str = 'DAY',
+                        include_device: bool = True) -> List[str]:
+    # The report fields of the selected columns (api names) in the order of the field mapping,
+    # every field when nothing is selected. The account id, primary key and cursor columns are always requested.
+    fields = self.get_report_field_mapping(ads_type, stream, time_unit, include_device)
+    if selected_columns is None:
+      return [item['request_name'] for item in fields]
+    columns = {ACCOUNT_ID_COLUMN, *selected_columns, *required_columns}
+    return [item['request_name'] for item in fields if item['api_name'] in columns]
+
   def _get_standard_headers(self) -> Mapping[str, str]:
     return {
         "Content-Type": "application/json",
-        "Authorization": "Bearer {}".format(self.access_token)
+        "Authorization": "Bearer {}".format(self.token_manager.get_access_token())
     }
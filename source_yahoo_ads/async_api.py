@@ -0,0 +1,377 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import asyncio
+import concurrent.futures
+import logging
+import tempfile
+import threading
+import time
+from typing import (IO, Any, Awaitable, Callable, Iterable, Iterator, List,
+                    Mapping, MutableMapping, Optional, Set)
+
+from . import api
+from .exceptions import YahooAdsException
+from .metrics import stream_name
+from .polling import PENDING_REPORT_JOB_STATUSES, ReportJobPoller
+from .rate_limiting import is_request_limit_exceeded
+from .utils import DOWNLOAD_CHUNK_SIZE, read_report_file
+
+try:
+  import httpx
+except ImportError:  # installed with the 'async' extra
+  httpx = None
+
+
+class AsyncYahooAds:
+  """
+  asyncio counterpart of YahooAds for login, add, poll, download and remove of report jobs.
+  It shares the configuration, token, rate limiter, poll policy and metrics of a YahooAds client,
+  but every wait is an asyncio.sleep(), so hundreds of report jobs can be in flight on one event loop
+  without a thread per job. All pending jobs of an account are still polled with one get request.
+  """
+  logger = logging.getLogger("airbyte")
+  # Transient errors (connection errors, 429 and 5xx) are retried like default_backoff_handler does
+  MAX_TRIES = 5
+  BACKOFF_FACTOR = 5
+  REQUEST_TIMEOUT = 300
+
+  def __init__(self, yahoo_ads: "api.YahooAds", client: Optional["httpx.AsyncClient"] = None) -> None:
+    if httpx is None:
+      raise YahooAdsException("The async engine needs httpx, install source-yahoo-ads[async]")
+    self.yahoo_ads = yahoo_ads
+    self.metrics = yahoo_ads.metrics
+    self.rate_limiter = yahoo_ads.rate_limiter
+    self.client = client or httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=yahoo_ads.parallel_tasks_size),
+        timeout=httpx.Timeout(self.REQUEST_TIMEOUT),
+    )
+    self.poller = ReportJobPoller(yahoo_ads, yahoo_ads.poll_policy, yahoo_ads.prepare_time_history, self.metrics)
+    # Every report job created on this engine, so the caller can remove them
+    self.created_report_jobs: List[dict[str, str]] = []
+    self._job_slots = asyncio.Semaphore(yahoo_ads.max_concurrent_report_jobs)
+    self._login_lock = asyncio.Lock()
+    # report_job_id -> future resolved once the job is no longer pending
+    self._waiters: MutableMapping[str, asyncio.Future] = {}
+    self._tracked = asyncio.Event()
+    self._poll_task: Optional[asyncio.Task] = None
+    # add requests in flight, they finish even if the coroutine waiting for them is cancelled
+    self._adding: Set[asyncio.Task] = set()
+
+  async def close(self) -> None:
+    if self._poll_task:
+      self._poll_task.cancel()
+    await self.wait_for_adds()
+    await self.client.aclose()
+    self.yahoo_ads.prepare_time_history.save()
+
+  async def _request(self, url: str, json: Mapping[str, Any] = None, data: Mapping[str, Any] = None,
+                     headers: Mapping[str, str] = None) -> "httpx.Response":
+    tries = limit_retries = 0
+    while True:
+      await asyncio.sleep(self.rate_limiter.reserve(url))
+      tries += 1
+      try:
+        response = await self.client.post(url, json=json, data=data, headers=headers)
+      except httpx.TransportError as err:
+        if tries >= self.MAX_TRIES:
+          raise
+        await self._backoff(tries, err)
+        continue
+      if is_request_limit_exceeded(response) and limit_retries < self.yahoo_ads.REQUEST_LIMIT_RETRIES:
+        # The limiter pauses the endpoint, the next reserve() waits out the quota window
+        limit_retries += 1
+        wait = self.rate_limiter.on_limit_exceeded(url, response)
+        self.logger.warning(f"Request limit exceeded for {url}, retrying in {wait:.0f} seconds")
+        continue
+      if (response.status_code == 429 or response.status_code >= 500) and tries < self.MAX_TRIES:
+        await self._backoff(tries, f"HTTP {response.status_code}")
+        continue
+      if response.is_error:
+        self.logger.warning(f"http error body: {response.text}")
+      response.raise_for_status()
+      self.rate_limiter.on_success(url)
+      return response
+
+  async def _backoff(self, tries: int, reason: Any) -> None:
+    wait = self.BACKOFF_FACTOR * 2 ** (tries - 1)
+    self.logger.info(f"Caught retryable error {reason} after {tries} tries. Waiting {wait} seconds then retrying...")
+    await asyncio.sleep(wait)
+
+  async def login(self) -> str:
+    access_token = self.yahoo_ads.token_manager.get_valid_access_token()
+    if access_token:
+      return access_token
+    async with self._login_lock:
+      # Another coroutine may have refreshed the token meanwhile
+      access_token = self.yahoo_ads.token_manager.get_valid_access_token()
+      if access_token:
+        return access_token
+      with self.metrics.timer('login'):
+        response = await self._request(
+            api.YAHOO_ADS_OAUTH_URL,
+            data={
+                "grant_type": "refresh_token",
+                "client_id": self.yahoo_ads.client_id,
+                "client_secret": self.yahoo_ads.client_secret,
+                "refresh_token": self.yahoo_ads.refresh_token,
+            },
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+      access_token = self.yahoo_ads.token_manager.set_token(response.json())
+      self.yahoo_ads.access_token = access_token
+      return access_token
+
+  async def _get_standard_headers(self) -> Mapping[str, str]:
+    return {"Content-Type": "application/json", "Authorization": f"Bearer {await self.login()}"}
+
+  async def create_report(self, ads_type: str, stream: str, start_date: str, end_date: str = None,
+                          account_id: str = None, fields: List[str] = None) -> dict[str, str]:
+    end_date = end_date or self.yahoo_ads.get_report_end_date()
+    account_id = account_id or self.yahoo_ads._get_default_account_id(ads_type)
+    add_config = self.yahoo_ads._get_add_report_config(ads_type, stream, start_date, end_date, account_id, fields)
+    with self.metrics.timer('add_report', stream_name(ads_type, stream)):
+      response = await self._request(
+          self.yahoo_ads._get_report_service_url(ads_type, 'add'), json=add_config, headers=await self._get_standard_headers())
+    report_job = self.yahoo_ads._to_report_job(response.json(), ads_type, stream, start_date, end_date, account_id)
+    self.created_report_jobs.append(report_job)
+    return report_job
+
+  async def get_reports(self, ads_type: str, account_id: str, report_job_ids: List[str]) -> List[dict[str, Any]]:
+    response = await self._request(
+        self.yahoo_ads._get_report_service_url(ads_type, 'get'),
+        json={"accountId": account_id, "reportJobIds": [str(report_job_id) for report_job_id in report_job_ids]},
+        headers=await self._get_standard_headers())
+    return self.yahoo_ads._to_report_definitions(response.json())
+
+  async def remove_report(self, ads_type: str, report_job_id: str, account_id: str = None, stream: str = None) -> bool:
+    with self.metrics.timer('remove_report', stream_name(ads_type, stream) if stream else ''):
+      response = await self._request(
+          self.yahoo_ads._get_report_service_url(ads_type, 'remove'),
+          json={
+              "accountId": account_id or self.yahoo_ads._get_default_account_id(ads_type),
+              "operand": [{"reportJobId": report_job_id}],
+          },
+          headers=await self._get_standard_headers())
+    return self.yahoo_ads._check_remove_report_response(response.json())
+
+  async def wait_for_report(self, report_job: dict[str, str]) -> dict[str, str]:
+    # Resolves once the job is COMPLETED or FAILED, its 'report_job_status' is updated in place
+    waiter = asyncio.get_running_loop().create_future()
+    self._waiters[report_job['report_job_id']] = waiter
+    self.poller.track(report_job)
+    self._tracked.set()
+    if self._poll_task is None or self._poll_task.done():
+      self._poll_task = asyncio.create_task(self._poll())
+    return await waiter
+
+  async def prepare_report(self, report_request: Mapping[str, str]) -> dict[str, str]:
+    # Create a report job and wait until it is prepared, at most max_concurrent_report_jobs at once
+    if report_request.get('report_job_id') is not None:
+      # Created by an earlier attempt of this sync and still on Yahoo's side, see resume_report_jobs
+      report_job = dict(report_request)
+      self.created_report_jobs.append(report_job)
+      if report_job['report_job_status'] not in PENDING_REPORT_JOB_STATUSES:
+        return report_job
+      async with self._job_slots:
+        return await self.wait_for_report(report_job)
+    async with self._job_slots:
+      # Once the add request is sent Yahoo may create the job, so the request always finishes
+      # and the job lands in created_report_jobs, where cleanup finds it
+      add_task = asyncio.ensure_future(self.create_report(
+          ads_type=report_request['ads_type'],
+          stream=report_request['stream'],
+          start_date=report_request['start_date'],
+          end_date=report_request.get('end_date'),
+          account_id=report_request.get('account_id'),
+          fields=report_request.get('fields'),
+      ))
+      self._adding.add(add_task)
+      add_task.add_done_callback(self._adding.discard)
+      report_job = await asyncio.shield(add_task)
+      report_job.update({key: value for key, value in report_request.items() if key not in report_job})
+      return await self.wait_for_report(report_job)
+
+  async def wait_for_adds(self) -> None:
+    if self._adding:
+      await asyncio.gather(*self._adding, return_exceptions=True)
+
+  async def _poll(self) -> None:
+    # One task polls the jobs of every account, waking up early when a job with an earlier first poll is tracked
+    try:
+      while self.poller.pending_count:
+        delay = self.poller.seconds_until_next_poll()
+        if delay > 0:
+          self._tracked.clear()
+          waiting_since = time.monotonic()
+          try:
+            await asyncio.wait_for(self._tracked.wait(), delay)
+          except asyncio.TimeoutError:
+            pass
+          self.metrics.add('poll_wait_seconds', time.monotonic() - waiting_since)
+          continue
+        due_polls = self.poller.due_polls()
+        responses = await asyncio.gather(
+            *(self.get_reports(ads_type, account_id, report_job_ids) for ads_type, account_id, report_job_ids in due_polls))
+        for (ads_type, account_id, _), report_definitions in zip(due_polls, responses):
+          for report_job in self.poller.apply_report_definitions(ads_type, account_id, report_definitions):
+            waiter = self._waiters.pop(report_job['report_job_id'], None)
+            if waiter and not waiter.done():
+              waiter.set_result(report_job)
+    except Exception as err:
+      # e.g. ReportPreparationTimeout, every job still waiting fails with it
+      for waiter in self._waiters.values():
+        if not waiter.done():
+          waiter.set_exception(err)
+      self._waiters.clear()
+      self.poller.pending_jobs.clear()
+      self.poller.schedules.clear()
+
+  async def download_report(self, report_job: Mapping[str, str], report_file: IO[bytes]) -> int:
+    # Write the report body to report_file as it arrives, gzip transfer encoding is undone by httpx
+    url = self.yahoo_ads._get_report_service_url(report_job['ads_type'], 'download')
+    metric_stream = stream_name(report_job['ads_type'], report_job['stream'])
+    await asyncio.sleep(self.rate_limiter.reserve(url))
+    size = 0
+    with self.metrics.timer('download_request', metric_stream):
+      request = self.client.build_request(
+          'POST', url, json={"accountId": report_job['account_id'], "reportJobId": report_job['report_job_id']},
+          headers=await self._get_standard_headers())
+      response = await self.client.send(request, stream=True)
+    try:
+      if response.is_error:
+        await response.aread()
+        self.logger.warning(f"http error body: {response.text}")
+      response.raise_for_status()
+      async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+        report_file.write(chunk)
+        size += len(chunk)
+    finally:
+      await response.aclose()
+    self.rate_limiter.on_success(url)
+    self.metrics.add('download_bytes', size, metric_stream, report_job['report_job_id'])
+    return size
+
+
+class AsyncYahooAdsRunner:
+  """
+  Synchronous facade over AsyncYahooAds, so SourceYahooAds can drive it.
+  The event loop runs on its own thread and every call blocks until its coroutine is done.
+  """
+
+  def __init__(self, yahoo_ads: "api.YahooAds") -> None:
+    self.loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(target=self.loop.run_forever, name='yahoo-ads-event-loop', daemon=True)
+    self._thread.start()
+    self.engine: AsyncYahooAds = self._run(self._create_engine(yahoo_ads))
+
+  @staticmethod
+  async def _create_engine(yahoo_ads: "api.YahooAds") -> AsyncYahooAds:
+    # The engine's asyncio primitives and client belong to the loop they are created on
+    return AsyncYahooAds(yahoo_ads)
+
+  def _submit(self, coroutine: Awaitable[Any]) -> concurrent.futures.Future:
+    return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+  def _run(self, coroutine: Awaitable[Any]) -> Any:
+    return self._submit(coroutine).result()
+
+  def close(self) -> None:
+    if not self.loop.is_running():
+      return
+    self._run(self.engine.close())
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self._thread.join()
+    self.loop.close()
+
+  def login(self) -> str:
+    return self._run(self.engine.login())
+
+  def create_report(self, ads_type: str, stream: str, start_date: str, end_date: str = None,
+                    account_id: str = None, fields: List[str] = None) -> dict[str, str]:
+    return self._run(self.engine.create_report(ads_type, stream, start_date, end_date, account_id, fields))
+
+  def get_reports(self, ads_type: str, account_id: str, report_job_ids: List[str]) -> List[dict[str, Any]]:
+    return self._run(self.engine.get_reports(ads_type, account_id, report_job_ids))
+
+  def remove_report(self, ads_type: str, report_job_id: str, account_id: str = None, stream: str = None) -> bool:
+    return self._run(self.engine.remove_report(ads_type, report_job_id, account_id, stream))
+
+  def download_report_rows(self, report_job: Mapping[str, str],
+                           converters: Optional[Mapping[str, Callable[[str], Any]]] = None) -> Iterator[Mapping[str, Any]]:
+    # Download on the event loop into an anonymous temporary file, then parse it on the calling thread
+    with tempfile.TemporaryFile(prefix='yahoo_ads_report_') as report_file:
+      self._run(self.engine.download_report(report_job, report_file))
+      yield from read_report_file(report_file, converters)
+
+  def prefetch_report_jobs(self, report_requests: List[dict[str, str]]) -> "AsyncReportJobs":
+    return AsyncReportJobs(self, report_requests)
+
+
+class AsyncReportJobs:
+  """
+  The report jobs of a sync prepared side by side on the event loop, with the interface of ReportJobPrefetcher.
+  Like there, at most max_concurrent_report_jobs + prefetch_reports jobs are created but not taken by a reader yet.
+  """
+
+  def __init__(self, runner: AsyncYahooAdsRunner, report_requests: Iterable[Mapping[str, str]]) -> None:
+    self.runner = runner
+    self.metrics = runner.engine.metrics
+    self.report_requests = list(report_requests)
+    self.read_position = 0
+    yahoo_ads = runner.engine.yahoo_ads
+    self._slots = runner._run(self._create_slots(yahoo_ads.max_concurrent_report_jobs + yahoo_ads.prefetch_reports))
+    # Indices holding a slot, only touched on the event loop
+    self._holding: Set[int] = set()
+    self.futures = [runner._submit(self._prepare(index)) for index in range(len(self.report_requests))]
+
+  @staticmethod
+  async def _create_slots(size: int) -> asyncio.Semaphore:
+    return asyncio.Semaphore(max(size, 1))
+
+  async def _prepare(self, index: int) -> dict[str, str]:
+    # The semaphore wakes its waiters in order, so the jobs are created in the order of report_requests
+    await self._slots.acquire()
+    self._holding.add(index)
+    try:
+      return await self.runner.engine.prepare_report(self.report_requests[index])
+    except BaseException:
+      self._release_slot(index)
+      raise
+
+  def _release_slot(self, index: int) -> None:
+    if index in self._holding:
+      self._holding.discard(index)
+      self._slots.release()
+
+  @property
+  def created_report_jobs(self) -> List[dict[str, str]]:
+    return list(self.runner.engine.created_report_jobs)
+
+  def get(self, index: int) -> dict[str, str]:
+    waiting_since = time.monotonic()
+    # Readers go through the reports in order, a report they skipped will never be read
+    self.release(range(self.read_position, index))
+    self.read_position = max(self.read_position, index + 1)
+    try:
+      report_job = self.futures[index].result()
+    finally:
+      # A free slot for the next report job
+      self.runner.loop.call_soon_threadsafe(self._release_slot, index)
+    self.metrics.add('report_wait_seconds', time.monotonic() - waiting_since,
+                     stream_name(report_job['ads_type'], report_job['stream']), report_job['report_job_id'])
+    return report_job
+
+  def release(self, indices: Iterable[int]) -> None:
+    # Jobs not created yet are never created, created ones are still removed by the caller
+    for index in indices:
+      self.futures[index].cancel()
+      self.runner.loop.call_soon_threadsafe(self._release_slot, index)
+
+  def close(self) -> None:
+    for future in self.futures:
+      future.cancel()
+    # add requests already sent finish, so the caller collects every created job
+    self.runner._run(self.runner.engine.wait_for_adds())
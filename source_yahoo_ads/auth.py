@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Mapping, Optional
+
+from airbyte_cdk.sources.streams.http.auth import TokenAuthenticator
+
+
+class YahooAdsTokenManager:
+  """
+  Caches the OAuth access token with its expiry and refreshes it shortly before it expires.
+  The token can also be cached on disk so short-lived check/discover/read invocations reuse it.
+  """
+  logger = logging.getLogger("airbyte")
+  # Yahoo access tokens live for an hour
+  DEFAULT_EXPIRES_IN = 3600
+  # Refresh this many seconds before the token actually expires
+  REFRESH_MARGIN = 300
+
+  def __init__(
+      self,
+      fetch_token: Callable[[], Mapping[str, Any]],
+      client_id: str = None,
+      refresh_token: str = None,
+      cache_path: Optional[str] = None,
+  ) -> None:
+    self.fetch_token = fetch_token
+    self.cache_path = cache_path
+    # Never write the refresh token itself to the cache file
+    self.cache_key = hashlib.sha256(f"{client_id}:{refresh_token}".encode('utf-8')).hexdigest()
+    self.access_token = None
+    self.expires_at = 0.0
+    self.refresh_count = 0
+    self._lock = threading.Lock()
+
+  def get_access_token(self) -> str:
+    with self._lock:
+      if not self._is_valid(self.expires_at):
+        self._load_cached_token()
+      if not self._is_valid(self.expires_at):
+        self._refresh()
+      return self.access_token
+
+  def get_valid_access_token(self) -> Optional[str]:
+    # The current or cached token if it is still valid, without refreshing it
+    with self._lock:
+      if not self._is_valid(self.expires_at):
+        self._load_cached_token()
+      return self.access_token if self._is_valid(self.expires_at) else None
+
+  def set_token(self, auth: Mapping[str, Any]) -> str:
+    # For clients that fetch the token themselves, e.g. the async engine
+    with self._lock:
+      self._store(auth)
+      return self.access_token
+
+  def invalidate(self) -> None:
+    with self._lock:
+      self.access_token = None
+      self.expires_at = 0.0
+
+  def _is_valid(self, expires_at: float) -> bool:
+    return self.access_token is not None and expires_at - self.REFRESH_MARGIN > time.time()
+
+  def _refresh(self) -> None:
+    self._store(self.fetch_token())
+
+  def _store(self, auth: Mapping[str, Any]) -> None:
+    self.refresh_count += 1
+    self.access_token = auth["access_token"]
+    self.expires_at = time.time() + float(auth.get("expires_in") or self.DEFAULT_EXPIRES_IN)
+    self._save_cached_token()
+
+  def _load_cached_token(self) -> None:
+    if not self.cache_path or not os.path.exists(self.cache_path):
+      return
+    try:
+      with open(self.cache_path, encoding='utf-8') as cache_file:
+        cached_token = json.load(cache_file).get(self.cache_key)
+    except (OSError, ValueError, AttributeError) as err:
+      self.logger.warning(f"Ignoring unreadable access token cache {self.cache_path}: {err}")
+      return
+    if cached_token:
+      self.access_token = cached_token["access_token"]
+      self.expires_at = float(cached_token["expires_at"])
+
+  def _save_cached_token(self) -> None:
+    if not self.cache_path:
+      return
+    try:
+      cached_tokens = {}
+      if os.path.exists(self.cache_path):
+        with open(self.cache_path, encoding='utf-8') as cache_file:
+          cached_tokens = json.load(cache_file)
+      cached_tokens[self.cache_key] = {"access_token": self.access_token, "expires_at": self.expires_at}
+      # The file holds live access tokens, keep it private to the current user
+      file_descriptor = os.open(self.cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+      with os.fdopen(file_descriptor, 'w', encoding='utf-8') as cache_file:
+        json.dump(cached_tokens, cache_file)
+    except (OSError, ValueError) as err:
+      self.logger.warning(f"Could not save access token cache {self.cache_path}: {err}")
+
+
+class YahooAdsAuthenticator(TokenAuthenticator):
+  """
+  TokenAuthenticator that always sends the current access token of the shared token manager,
+  so stream downloads keep working when a long sync outlives the first token.
+  """
+
+  def __init__(self, token_manager: YahooAdsTokenManager) -> None:
+    super().__init__(token=token_manager.access_token or "")
+    self.token_manager = token_manager
+
+  def get_auth_header(self) -> Mapping[str, Any]:
+    return {self.auth_header: f"{self.auth_method} {self.token_manager.get_access_token()}"}
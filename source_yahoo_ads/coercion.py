@@ -0,0 +1,63 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+from typing import Any, Callable, Mapping, Optional, Union
+
+# Values Yahoo writes into numeric report columns when there is nothing to report
+NULL_MARKERS = frozenset(('', '--', None))
+
+
+def to_integer(value: str) -> Union[int, str]:
+  try:
+    return int(value)
+  except ValueError:
+    pass
+  try:
+    # e.g. '1,234' or '12.0', a fraction such as '12.75' would lose its fractional part
+    number = float(value.replace(',', ''))
+  except ValueError:
+    number = None
+  if number is not None and number.is_integer():
+    return int(number)
+  # Keep what Yahoo sent rather than failing the whole sync on one odd cell
+  return value
+
+
+def to_number(value: str) -> Union[float, str]:
+  try:
+    return float(value)
+  except ValueError:
+    pass
+  try:
+    # e.g. '1,234.5' or '12.3%'
+    return float(value.replace(',', '').rstrip('%'))
+  except ValueError:
+    return value
+
+
+CONVERTERS = {
+    'integer': to_integer,
+    'number': to_number,
+}
+
+
+def _get_converter(property_schema: Mapping[str, Any]) -> Optional[Callable[[str], Any]]:
+  types = property_schema.get('type', [])
+  if isinstance(types, str):
+    types = [types]
+  for property_type in types:
+    if property_type in CONVERTERS:
+      return CONVERTERS[property_type]
+  return None
+
+
+def compile_coercion_plan(json_schema: Mapping[str, Any]) -> Mapping[str, Callable[[str], Any]]:
+  # Column name -> converter, only for the columns that are not plain strings
+  plan = {}
+  for column, property_schema in json_schema.get('properties', {}).items():
+    converter = _get_converter(property_schema)
+    if converter:
+      plan[column] = converter
+  return plan
@@ -0,0 +1,85 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import functools
+import hashlib
+from datetime import datetime
+from typing import Any, List, Mapping, MutableMapping, Optional, Set, Tuple
+
+from .utils import (ACCOUNT_ID_COLUMN, DAY_COLUMN, REPORT_DATE_FORMAT,
+                    normalize_report_date)
+
+# 8-byte fingerprints, a collision within a single period of one account is practically impossible
+FINGERPRINT_SIZE = 8
+KEY_SEPARATOR = '\x1f'
+# Days per period, to express the window in periods of the stream's granularity
+PERIOD_DAYS = {'DAY': 1, 'WEEK': 7, 'MONTH': 30}
+
+
+class PrimaryKeyDeduplicator:
+  """
+  Drops rows whose primary key was already emitted in this sync, e.g. by overlapping date windows.
+  Remembers a fixed-width fingerprint per row instead of the key values, in one set per account and period
+  (day, week or month of time_column), and forgets the periods more than window_days before the latest period
+  seen of the account. Rows of a forgotten period are let through.
+  """
+
+  def __init__(self, primary_key: List[str], window_days: int, time_column: str = DAY_COLUMN,
+               time_unit: str = 'DAY') -> None:
+    self.primary_key = primary_key
+    self.window_days = window_days
+    self.time_column = time_column
+    self.time_unit = time_unit
+    # The window in periods, a window shorter than a period still keeps the previous one
+    self.window_periods = -(-window_days // PERIOD_DAYS[time_unit])
+    # (account_id, period) -> fingerprints
+    self.fingerprints: MutableMapping[Tuple[str, str], Set[int]] = {}
+    # account_id -> latest period seen, as a period ordinal
+    self.latest_periods: MutableMapping[str, int] = {}
+    self.duplicate_count = 0
+
+  def fingerprint(self, record: Mapping[str, Any]) -> int:
+    key = KEY_SEPARATOR.join(str(record.get(field)) for field in self.primary_key)
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=FINGERPRINT_SIZE).digest(), 'big')
+
+  def is_duplicate(self, record: Mapping[str, Any]) -> bool:
+    account_id = str(record.get(ACCOUNT_ID_COLUMN) or '')
+    period = normalize_report_date(record.get(self.time_column))
+    period_ordinal = _period_ordinal(period, self.time_unit)
+    if period_ordinal is not None:
+      latest_period = self.latest_periods.get(account_id)
+      if latest_period is None or period_ordinal > latest_period:
+        self.latest_periods[account_id] = period_ordinal
+        self._evict(account_id, period_ordinal - self.window_periods)
+      elif period_ordinal < latest_period - self.window_periods:
+        return False
+
+    fingerprints = self.fingerprints.setdefault((account_id, period or ''), set())
+    fingerprint = self.fingerprint(record)
+    if fingerprint in fingerprints:
+      self.duplicate_count += 1
+      return True
+    fingerprints.add(fingerprint)
+    return False
+
+  def _evict(self, account_id: str, oldest_period_ordinal: int) -> None:
+    for key in [key for key in self.fingerprints if key[0] == account_id]:
+      period_ordinal = _period_ordinal(key[1], self.time_unit)
+      if period_ordinal is not None and period_ordinal < oldest_period_ordinal:
+        del self.fingerprints[key]
+
+
+@functools.lru_cache(maxsize=4096)
+def _period_ordinal(day: Optional[str], time_unit: str = 'DAY') -> Optional[int]:
+  # '20230101' -> number of the day, week or month it falls in, cheap to compare and subtract
+  if not day:
+    return None
+  date = datetime.strptime(day, REPORT_DATE_FORMAT)
+  if time_unit == 'WEEK':
+    # Weeks start on Monday, the ordinal of day 1 (0001-01-01) is a Monday
+    return (date.toordinal() - 1) // 7
+  if time_unit == 'MONTH':
+    return date.year * 12 + date.month - 1
+  return date.toordinal()
@@ -25,6 +25,30 @@ class TypeYahooAdsException(YahooAdsException):
   """
 
 
+class ReportPreparationTimeout(YahooAdsException):
+  """
+  We use this exception when a report job is not ready before the poll deadline.
+  """
+
+
+class ReportJobFailed(YahooAdsException):
+  """
+  We use this exception when a report job finished without being COMPLETED.
+  """
+
+
+class ReportDecompressionError(YahooAdsException):
+  """
+  We use this exception when a compressed report download can't be decompressed.
+  """
+
+
+class ReportCacheError(YahooAdsException):
+  """
+  We use this exception when cached report rows can't be read back.
+  """
+
+
 class TmpFileIOError(Error):
   def __init__(self, msg: str, err: str = None):
     self.logger.fatal(f"{msg}. Error: {err}")
@@ -0,0 +1,132 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Iterable, Iterator, List, Mapping, MutableMapping, Tuple
+
+# Metrics collected during a sync, per stream and report job where it applies:
+#   login_seconds/_count                     OAuth token requests
+#   add_report_seconds/_count                ReportDefinitionService/add
+#   poll_requests, poll_wait_seconds         ReportDefinitionService/get calls and the time slept between them
+#   report_polls, report_prepare_seconds     get calls that covered a job and the time until it finished
+#   download_request_seconds/_count          time until the download response headers arrived
+#   download_bytes                           bytes of the report body
+#   download_seconds                         time spent receiving and parsing the report,
+#                                            both overlap as rows are parsed while the body is downloading
+#   report_wait_seconds                      time a stream waited for its next report to be COMPLETED
+#   rows, emit_seconds                       records read and the time the CDK spent emitting them
+#   duplicate_rows                           rows dropped because their primary key was already emitted
+#   remove_reports_seconds/_count            batched ReportDefinitionService/remove calls per ads type
+#   removed_reports                          report jobs they removed
+#   remove_report_seconds/_count, cleanup_seconds
+METRIC_PREFIX = 'yahoo_ads_'
+
+
+def stream_name(ads_type: str, stream: str) -> str:
+  # ('YSS', 'AD_CONVERSION') -> 'yss_ad_conversion', the name of the Airbyte stream
+  return f"{ads_type}_{stream}".lower()
+
+
+class SyncMetrics:
+  """
+  Thread-safe collection of per-phase timings and volumes of a sync, reported as Airbyte log messages
+  and optionally written as a Prometheus text file at the end of the sync.
+  """
+  logger = logging.getLogger("airbyte")
+
+  def __init__(self) -> None:
+    # (metric, stream, report_job_id) -> value
+    self.values: MutableMapping[Tuple[str, str, str], float] = defaultdict(float)
+    self._lock = threading.Lock()
+
+  def add(self, metric: str, value: float = 1, stream: str = '', report_job_id: str = '') -> None:
+    with self._lock:
+      self.values[(metric, stream, str(report_job_id or ''))] += value
+
+  def get(self, metric: str, stream: str = '', report_job_id: str = '') -> float:
+    return self.values.get((metric, stream, str(report_job_id or '')), 0)
+
+  @contextlib.contextmanager
+  def timer(self, phase: str, stream: str = '', report_job_id: str = '') -> Iterator[None]:
+    started_at = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(f"{phase}_seconds", time.perf_counter() - started_at, stream, report_job_id)
+      self.add(f"{phase}_count", 1, stream, report_job_id)
+
+  def timed_records(self, records: Iterable[Mapping[str, Any]], stream: str = '',
+                    report_job_id: str = '') -> Iterator[Mapping[str, Any]]:
+    # Time spent producing the records (download and parse) vs. suspended at the yield (emitting them)
+    download_seconds = emit_seconds = 0.0
+    rows = 0
+    resumed_at = time.perf_counter()
+    try:
+      for record in records:
+        suspended_at = time.perf_counter()
+        download_seconds += suspended_at - resumed_at
+        yield record
+        resumed_at = time.perf_counter()
+        emit_seconds += resumed_at - suspended_at
+        rows += 1
+      download_seconds += time.perf_counter() - resumed_at
+    finally:
+      self.add('download_seconds', download_seconds, stream, report_job_id)
+      self.add('emit_seconds', emit_seconds, stream, report_job_id)
+      self.add('rows', rows, stream, report_job_id)
+
+  def summary(self) -> List[Mapping[str, Any]]:
+    # One entry per stream and report job, plus one for the sync-wide metrics
+    with self._lock:
+      values = dict(self.values)
+    entries: MutableMapping[Tuple[str, str], MutableMapping[str, Any]] = {}
+    for (metric, stream, report_job_id), value in sorted(values.items()):
+      entry = entries.setdefault((stream, report_job_id), {'stream': stream or None, 'report_job_id': report_job_id or None})
+      entry[metric] = round(value, 3) if isinstance(value, float) and not value.is_integer() else int(value)
+    for entry in entries.values():
+      if entry.get('rows') and entry.get('download_seconds'):
+        entry['rows_per_second'] = round(entry['rows'] / entry['download_seconds'], 1)
+    return list(entries.values())
+
+  def log(self, logger: logging.Logger = None) -> None:
+    logger = logger or self.logger
+    for entry in self.summary():
+      logger.info(f"Sync metrics: {json.dumps(entry, ensure_ascii=False)}")
+
+  def to_prometheus(self) -> str:
+    # Per-stream totals, report job ids would make every sync a new series
+    with self._lock:
+      values = dict(self.values)
+    totals: MutableMapping[str, MutableMapping[str, float]] = defaultdict(lambda: defaultdict(float))
+    for (metric, stream, _), value in values.items():
+      totals[metric][stream] += value
+    lines = []
+    for metric in sorted(totals):
+      name = f"{METRIC_PREFIX}{metric}"
+      lines.append(f"# TYPE {name} gauge")
+      for stream, value in sorted(totals[metric].items()):
+        labels = f'{{stream="{_escape_label(stream)}"}}' if stream else ''
+        lines.append(f"{name}{labels} {int(value) if float(value).is_integer() else value}")
+    return '\n'.join(lines) + '\n'
+
+  def write_prometheus(self, path: str) -> None:
+    # Write next to the target and rename, so a textfile collector never reads a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+      with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+        metrics_file.write(self.to_prometheus())
+      os.replace(temp_path, path)
+    except OSError as err:
+      self.logger.warning(f"Could not write sync metrics to {path}: {err}")
+
+
+def _escape_label(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
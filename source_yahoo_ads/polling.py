@@ -0,0 +1,387 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import (Any, Iterable, Iterator, List, Mapping, MutableMapping,
+                    Optional, Set, Tuple)
+
+from .exceptions import ReportPreparationTimeout, YahooAdsException
+from .metrics import SyncMetrics, stream_name
+
+# Report job statuses returned by ReportDefinitionService/get
+# WAIT -- Please wait for report request to complete.
+# COMPLETED -- Report request completed successfully.
+# IN_PROGRESS -- Report is in creating process.
+# FAILED -- Report request failed.
+# UNKNOWN -- Unknown Value
+PENDING_REPORT_JOB_STATUSES = ('WAIT', 'IN_PROGRESS')
+
+DEFAULT_PREPARE_TIME_HISTORY_PATH = os.path.join(
+    tempfile.gettempdir(), 'yahoo_ads_report_prepare_times.json')
+
+
+class PollPolicy:
+  """
+  Exponential poll schedule capped at max_interval, with jitter and a total deadline per report job.
+  """
+
+  def __init__(
+      self,
+      initial_interval: float = 5,
+      max_interval: float = 15,
+      multiplier: float = 2,
+      jitter: float = 0.1,
+      timeout: float = 3600,
+  ) -> None:
+    self.initial_interval = initial_interval
+    self.max_interval = max(max_interval, initial_interval)
+    self.multiplier = multiplier
+    self.jitter = jitter
+    self.timeout = timeout
+    self.random = random.Random()
+
+  def interval(self, attempt: int) -> float:
+    interval = min(self.initial_interval * self.multiplier ** attempt, self.max_interval)
+    if self.jitter:
+      interval *= self.random.uniform(1 - self.jitter, 1 + self.jitter)
+    return interval
+
+
+class PrepareTimeHistory:
+  """
+  Remembers how long Yahoo took to prepare the reports of each stream and account across runs,
+  so the first poll of a new job can be scheduled right before the report is usually ready.
+  """
+  logger = logging.getLogger("airbyte")
+  # Weight of the newest sample in the moving average
+  SMOOTHING = 0.3
+  # Poll a bit before the typical preparation time to not overshoot it
+  EARLY_RATIO = 0.9
+
+  def __init__(self, path: Optional[str] = DEFAULT_PREPARE_TIME_HISTORY_PATH) -> None:
+    self.path = path
+    self.prepare_times: MutableMapping[str, float] = {}
+    if self.path and os.path.exists(self.path):
+      try:
+        with open(self.path, encoding='utf-8') as history_file:
+          self.prepare_times = {key: float(value) for key, value in json.load(history_file).items()}
+      except (OSError, ValueError, TypeError, AttributeError) as err:
+        self.logger.warning(f"Ignoring unreadable report prepare time history {self.path}: {err}")
+
+  @staticmethod
+  def key(report_job: dict[str, str]) -> str:
+    return f"{report_job['ads_type']}_{report_job['stream']}_{report_job['account_id']}"
+
+  def first_poll_delay(self, report_job: dict[str, str]) -> float:
+    return self.prepare_times.get(self.key(report_job), 0) * self.EARLY_RATIO
+
+  def record(self, report_job: dict[str, str], prepare_time: float) -> None:
+    key = self.key(report_job)
+    previous = self.prepare_times.get(key)
+    self.prepare_times[key] = prepare_time if previous is None else (
+        self.SMOOTHING * prepare_time + (1 - self.SMOOTHING) * previous)
+
+  def save(self) -> None:
+    if not self.path:
+      return
+    # Write next to the target and rename, so concurrent syncs and crashes never leave a partial file behind
+    temp_path = f"{self.path}.{os.getpid()}.tmp"
+    try:
+      with open(temp_path, 'w', encoding='utf-8') as history_file:
+        json.dump(self.prepare_times, history_file)
+      os.replace(temp_path, self.path)
+    except OSError as err:
+      self.logger.warning(f"Could not save report prepare time history {self.path}: {err}")
+
+
+class ReportJobPoller:
+  """
+  Tracks every pending report job and checks all jobs of the same account
+  with a single ReportDefinitionService/get call per poll cycle.
+  """
+  logger = logging.getLogger("airbyte")
+
+  def __init__(self, yahoo_ads: Any, poll_policy: PollPolicy = None, prepare_time_history: PrepareTimeHistory = None,
+               metrics: SyncMetrics = None) -> None:
+    self.yahoo_ads = yahoo_ads
+    self.poll_policy = poll_policy or PollPolicy()
+    self.prepare_time_history = prepare_time_history or PrepareTimeHistory(path=None)
+    self.metrics = metrics or SyncMetrics()
+    # (ads_type, account_id) -> {report_job_id: report_job}
+    self.pending_jobs: MutableMapping[Tuple[str, str], MutableMapping[str, dict]] = {}
+    # report_job_id -> {'started_at', 'next_poll_at', 'attempt', 'polls'}
+    self.schedules: MutableMapping[str, MutableMapping[str, float]] = {}
+    self.get_request_count = 0
+
+  def track(self, report_job: dict[str, str]) -> None:
+    key = (report_job['ads_type'], report_job['account_id'])
+    self.pending_jobs.setdefault(key, {})[report_job['report_job_id']] = report_job
+    now = time.monotonic()
+    self.schedules[report_job['report_job_id']] = {
+        'started_at': now,
+        'next_poll_at': now + self.prepare_time_history.first_poll_delay(report_job),
+        'attempt': 0,
+        'polls': 0,
+    }
+
+  @property
+  def pending_count(self) -> int:
+    return sum(len(jobs) for jobs in self.pending_jobs.values())
+
+  def poll(self) -> Iterator[dict[str, str]]:
+    # Yield each report job as soon as it is COMPLETED or FAILED,
+    # updating its 'report_job_status' in place
+    while self.pending_count:
+      sleep_duration = self.seconds_until_next_poll()
+      if sleep_duration > 0:
+        time.sleep(sleep_duration)
+        self.metrics.add('poll_wait_seconds', sleep_duration)
+      yield from self.poll_once()
+
+  def seconds_until_next_poll(self) -> float:
+    # 0 without pending jobs, there is nothing to wait for
+    if not self.schedules:
+      return 0
+    next_poll_at = min(schedule['next_poll_at'] for schedule in self.schedules.values())
+    return next_poll_at - time.monotonic()
+
+  def poll_once(self) -> Iterator[dict[str, str]]:
+    for ads_type, account_id, report_job_ids in self.due_polls():
+      report_definitions = self.yahoo_ads.get_reports(ads_type, account_id, report_job_ids)
+      yield from self.apply_report_definitions(ads_type, account_id, report_definitions)
+
+  def due_polls(self) -> List[Tuple[str, str, List[str]]]:
+    # Only hit the API for accounts with a due job, but then check all of their jobs at once
+    now = time.monotonic()
+    return [
+        (ads_type, account_id, list(jobs)) for (ads_type, account_id), jobs in self.pending_jobs.items()
+        if any(self.schedules[job_id]['next_poll_at'] <= now for job_id in jobs)
+    ]
+
+  def apply_report_definitions(self, ads_type: str, account_id: str,
+                               report_definitions: List[Mapping[str, Any]]) -> List[dict[str, str]]:
+    # Update the jobs of an account from a ReportDefinitionService/get response, return the ones that finished
+    jobs = self.pending_jobs.get((ads_type, account_id), {})
+    self.get_request_count += 1
+    self.metrics.add('poll_requests')
+    polled_at = time.monotonic()
+    finished_jobs = []
+    for job_id in jobs:
+      self.schedules[job_id]['polls'] += 1
+    for report_definition in report_definitions:
+      report_job = jobs.get(str(report_definition['reportJobId']))
+      if report_job is None:
+        continue
+      report_job['report_job_status'] = str(report_definition['reportJobStatus'])
+      if report_job['report_job_status'] not in PENDING_REPORT_JOB_STATUSES:
+        schedule = self.schedules.pop(report_job['report_job_id'])
+        if report_job['report_job_status'] == 'COMPLETED':
+          self.prepare_time_history.record(report_job, polled_at - schedule['started_at'])
+        metric_stream = stream_name(report_job['ads_type'], report_job['stream'])
+        self.metrics.add('report_prepare_seconds', polled_at - schedule['started_at'], metric_stream, report_job['report_job_id'])
+        self.metrics.add('report_polls', schedule['polls'], metric_stream, report_job['report_job_id'])
+        del jobs[report_job['report_job_id']]
+        finished_jobs.append(report_job)
+    for report_job in jobs.values():
+      self._reschedule(report_job, polled_at)
+    if not jobs:
+      self.pending_jobs.pop((ads_type, account_id), None)
+    return finished_jobs
+
+  def _reschedule(self, report_job: dict[str, str], polled_at: float) -> None:
+    schedule = self.schedules[report_job['report_job_id']]
+    if polled_at - schedule['started_at'] >= self.poll_policy.timeout:
+      raise ReportPreparationTimeout(
+          f"Report job {report_job['report_job_id']} for {report_job['ads_type']} {report_job['stream']} "
+          f"was not ready after {self.poll_policy.timeout} seconds")
+    if schedule['next_poll_at'] > polled_at:
+      # Not due yet, this job only rode along with another job of the same account
+      return
+    interval = self.poll_policy.interval(int(schedule['attempt']))
+    schedule['attempt'] += 1
+    # Never sleep past the deadline, poll one last time right at it
+    schedule['next_poll_at'] = min(polled_at + interval, schedule['started_at'] + self.poll_policy.timeout)
+
+
+class ReportJobPrefetcher:
+  """
+  Creates the report jobs in the order the streams read them and polls them in a background thread,
+  so Yahoo prepares the next reports while the current one is downloading.
+  At most max_concurrent_report_jobs jobs are preparing at once and at most max_ready_reports
+  more are kept ready ahead of the reader.
+  """
+  logger = logging.getLogger("airbyte")
+
+  def __init__(
+      self,
+      yahoo_ads: Any,
+      report_requests: Iterable[Mapping[str, str]],
+      max_concurrent_report_jobs: int = 4,
+      max_ready_reports: int = 2,
+      poll_policy: PollPolicy = None,
+      prepare_time_history: PrepareTimeHistory = None,
+      metrics: SyncMetrics = None,
+  ) -> None:
+    self.yahoo_ads = yahoo_ads
+    self.report_requests = list(report_requests)
+    self.max_concurrent_report_jobs = max_concurrent_report_jobs
+    self.max_ready_reports = max_ready_reports
+    self.metrics = metrics or SyncMetrics()
+    self.poller = ReportJobPoller(yahoo_ads, poll_policy, prepare_time_history, self.metrics)
+    # Index in report_requests -> created report job
+    self.report_jobs: MutableMapping[int, dict[str, str]] = {}
+    self.report_job_indices: MutableMapping[str, int] = {}
+    self.next_index = 0
+    # Finished jobs nobody has taken yet
+    self.ready: Set[int] = set()
+    # Jobs handed to a reader, or given up because no reader will ask for them anymore
+    self.taken: Set[int] = set()
+    self.read_position = 0
+    self.error: Optional[BaseException] = None
+    self._stopped = False
+    self._condition = threading.Condition()
+    self._thread = threading.Thread(target=self._run, name='yahoo-ads-report-prefetcher', daemon=True)
+
+  def start(self) -> "ReportJobPrefetcher":
+    self._thread.start()
+    return self
+
+  def close(self) -> None:
+    with self._condition:
+      self._stopped = True
+      self._condition.notify_all()
+    if self._thread.is_alive():
+      self._thread.join()
+
+  @property
+  def created_report_jobs(self) -> List[dict[str, str]]:
+    with self._condition:
+      return [self.report_jobs[index] for index in sorted(self.report_jobs)]
+
+  def get(self, index: int) -> dict[str, str]:
+    # Block until the report job of report_requests[index] is COMPLETED or FAILED
+    waiting_since = time.monotonic()
+    with self._condition:
+      # Readers go through the reports in order, a report they skipped will never be read
+      self._give_up(range(self.read_position, index))
+      self.read_position = max(self.read_position, index + 1)
+      while index not in self.ready:
+        if self.error:
+          raise self.error
+        if self._stopped or not self._thread.is_alive():
+          raise YahooAdsException(f"Report job {index} was not prepared before the prefetcher stopped")
+        self._condition.wait()
+      self.ready.discard(index)
+      self.taken.add(index)
+      # A free slot for the next report job
+      self._condition.notify_all()
+      report_job = self.report_jobs[index]
+    self.metrics.add('report_wait_seconds', time.monotonic() - waiting_since,
+                     stream_name(report_job['ads_type'], report_job['stream']), report_job['report_job_id'])
+    return report_job
+
+  def release(self, indices: Iterable[int]) -> None:
+    # The reader stopped early, e.g. after a failed slice
+    with self._condition:
+      self._give_up(indices)
+      self._condition.notify_all()
+
+  def _give_up(self, indices: Iterable[int]) -> None:
+    for index in indices:
+      if index not in self.taken:
+        self.taken.add(index)
+        self.ready.discard(index)
+
+  def _next_batch(self) -> List[int]:
+    # Called with the lock held, only by the prefetcher thread
+    preparing = self.poller.pending_count
+    free_slots = min(
+        self.max_concurrent_report_jobs - preparing,
+        self.max_concurrent_report_jobs + self.max_ready_reports - preparing - len(self.ready),
+    )
+    batch = []
+    while free_slots > len(batch) and self.next_index < len(self.report_requests):
+      if self.next_index not in self.taken:
+        batch.append(self.next_index)
+      self.next_index += 1
+    return batch
+
+  def _create(self, batch: List[int]) -> None:
+    def create(index: int) -> dict[str, str]:
+      report_request = self.report_requests[index]
+      if report_request.get('report_job_id') is not None:
+        # Created by an earlier attempt of this sync and still on Yahoo's side, see resume_report_jobs
+        return dict(report_request)
+      return self.yahoo_ads.create_report(
+          ads_type=report_request['ads_type'],
+          stream=report_request['stream'],
+          start_date=report_request['start_date'],
+          end_date=report_request.get('end_date'),
+          account_id=report_request.get('account_id'),
+          fields=report_request.get('fields'),
+      )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(batch)) as executor:
+      report_jobs = list(executor.map(create, batch))
+    with self._condition:
+      for index, report_job in zip(batch, report_jobs):
+        # Keep what else the request carries, e.g. the report cache partition
+        report_job.update({key: value for key, value in self.report_requests[index].items() if key not in report_job})
+        self.report_jobs[index] = report_job
+        self.report_job_indices[report_job['report_job_id']] = index
+        if report_job['report_job_status'] not in PENDING_REPORT_JOB_STATUSES and index not in self.taken:
+          self.ready.add(index)
+      self._condition.notify_all()
+    for report_job in report_jobs:
+      if report_job['report_job_status'] in PENDING_REPORT_JOB_STATUSES:
+        self.poller.track(report_job)
+
+  def _run(self) -> None:
+    try:
+      while True:
+        with self._condition:
+          if self._stopped:
+            return
+          batch = self._next_batch()
+          if not batch and not self.poller.pending_count:
+            if self.next_index >= len(self.report_requests):
+              return
+            # Everything is ready, wait until the reader takes a report
+            self._condition.wait()
+            continue
+        if batch:
+          self._create(batch)
+        with self._condition:
+          if not self.poller.pending_count:
+            # The batch only held resumed jobs which are ready already
+            continue
+          delay = self.poller.seconds_until_next_poll()
+          if delay > 0 and not self._stopped:
+            # Woken up early when the reader takes a report, to create the next job right away
+            waiting_since = time.monotonic()
+            self._condition.wait(delay)
+            self.metrics.add('poll_wait_seconds', time.monotonic() - waiting_since)
+            continue
+        finished_jobs = list(self.poller.poll_once())
+        with self._condition:
+          for report_job in finished_jobs:
+            index = self.report_job_indices[report_job['report_job_id']]
+            if index not in self.taken:
+              self.ready.add(index)
+          self._condition.notify_all()
+    except Exception as err:
+      with self._condition:
+        self.error = err
+    finally:
+      self.poller.prepare_time_history.save()
+      with self._condition:
+        self._condition.notify_all()
@@ -4,6 +4,10 @@
 
 
 import sys
+import threading
+import time
+from typing import Any, Mapping, Optional
+from urllib.parse import urlparse
 
 import backoff
 from airbyte_cdk.logger import AirbyteLogger
@@ -20,6 +24,19 @@ TRANSIENT_EXCEPTIONS = (
 
 logger = AirbyteLogger()
 
+REQUEST_LIMIT_EXCEEDED = "REQUEST_LIMIT_EXCEEDED"
+
+
+def is_request_limit_exceeded(response) -> bool:
+    # YahooAds reports an exhausted quota with a 403 and this error code instead of a 429
+    if response is None or response.status_code != codes.forbidden:
+        return False
+    try:
+        error_data = response.json()[0]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return False
+    return isinstance(error_data, Mapping) and error_data.get("errorCode", "") == REQUEST_LIMIT_EXCEEDED
+
 
 def default_backoff_handler(max_tries: int, factor: int, **kwargs):
     def log_retry_attempt(details):
@@ -32,10 +49,9 @@ def default_backoff_handler(max_tries: int, factor: int, **kwargs):
         give_up = exc.response is not None and exc.response.status_code != codes.too_many_requests and 400 <= exc.response.status_code < 500
 
         # YahooAds can return an error with a limit using a 403 code error.
-        if exc.response is not None and exc.response.status_code == codes.forbidden:
-            error_data = exc.response.json()[0]
-            if error_data.get("errorCode", "") == "REQUEST_LIMIT_EXCEEDED":
-                give_up = True
+        # The rate limiter already waited for the quota window before it let this error through.
+        if is_request_limit_exceeded(exc.response):
+            give_up = True
 
         if give_up:
             logger.info(
@@ -52,3 +68,129 @@ def default_backoff_handler(max_tries: int, factor: int, **kwargs):
         factor=factor,
         **kwargs,
     )
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled with `rate` tokens per second up to `capacity` tokens.
+    The rate drops when the API reports an exhausted quota and slowly recovers afterwards.
+    """
+
+    # Multiply the rate by this when the limit is hit
+    DECREASE_FACTOR = 0.5
+    # Share of the configured rate given back after every successful request
+    INCREASE_STEP = 0.05
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate * 0.1
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        # Tokens are refilled from this point in time, it lies in the future while the bucket is paused
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Take a token, possibly on credit, and return how long to wait before it may be used.
+        # Waiting callers queue up behind each other instead of racing for the next token.
+        with self._lock:
+            now = time.monotonic()
+            if now > self.updated_at:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+            self.tokens -= 1
+            wait = self.updated_at - now
+            if self.tokens < 0:
+                wait += -self.tokens / self.rate
+            return max(wait, 0.0)
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        # Hand out no tokens until the quota window is over, then let one request through and continue slower
+        with self._lock:
+            self.rate = max(self.rate * self.DECREASE_FACTOR, self.min_rate)
+            self.tokens = min(self.tokens, 1)
+            self.updated_at = max(self.updated_at, time.monotonic() + seconds)
+
+    def recover(self) -> None:
+        with self._lock:
+            self.rate = min(self.rate + self.max_rate * self.INCREASE_STEP, self.max_rate)
+
+
+class YahooAdsRateLimiter:
+    """
+    Client-side request budget for the YahooAds API, one token bucket per host and endpoint
+    (e.g. ReportDefinitionService add, get, download and remove of YSS and YDN).
+    Downloads only fetch reports that are already prepared, so they are not throttled
+    unless a rate is configured for them or Yahoo reports an exhausted quota for them.
+    """
+
+    DEFAULT_REQUESTS_PER_SECOND = 5
+    UNTHROTTLED_ENDPOINTS = ("download",)
+    # How long to wait after REQUEST_LIMIT_EXCEEDED when the response has no Retry-After header
+    LIMIT_EXCEEDED_WAIT = 60
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        endpoint_requests_per_second: Optional[Mapping[str, float]] = None,
+    ) -> None:
+        self.requests_per_second = requests_per_second or self.DEFAULT_REQUESTS_PER_SECOND
+        # Endpoint name, e.g. 'download' -> its own budget
+        self.endpoint_requests_per_second = dict(endpoint_requests_per_second or {})
+        self.buckets = {}
+        self.limit_exceeded_count = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(url: str) -> str:
+        return urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+    def bucket(self, url: str) -> Optional[TokenBucket]:
+        # None for an endpoint that is not throttled
+        endpoint = self.endpoint(url)
+        key = f"{urlparse(url).netloc}/{endpoint}"
+        with self._lock:
+            if key not in self.buckets:
+                if endpoint in self.UNTHROTTLED_ENDPOINTS and endpoint not in self.endpoint_requests_per_second:
+                    return None
+                rate = self.endpoint_requests_per_second.get(endpoint, self.requests_per_second)
+                self.buckets[key] = TokenBucket(rate)
+            return self.buckets[key]
+
+    def acquire(self, url: str) -> float:
+        bucket = self.bucket(url)
+        return bucket.acquire() if bucket else 0.0
+
+    def reserve(self, url: str) -> float:
+        # Take a token without sleeping, the caller waits the returned seconds itself (e.g. with asyncio.sleep)
+        bucket = self.bucket(url)
+        return bucket.reserve() if bucket else 0.0
+
+    def on_success(self, url: str) -> None:
+        bucket = self.bucket(url)
+        if bucket:
+            bucket.recover()
+
+    def on_limit_exceeded(self, url: str, response: Any = None) -> float:
+        wait = self.LIMIT_EXCEEDED_WAIT
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                pass
+        self.limit_exceeded_count += 1
+        bucket = self.bucket(url)
+        if bucket is None:
+            # Yahoo limits this endpoint after all, budget it from now on
+            with self._lock:
+                bucket = self.buckets[f"{urlparse(url).netloc}/{self.endpoint(url)}"] = TokenBucket(self.requests_per_second)
+        bucket.pause(wait)
+        return wait
@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import IO, Any, Iterator, List, Mapping, MutableMapping, Optional
+
+from .exceptions import ReportCacheError
+from .utils import DAY_COLUMN, REPORT_DATE_FORMAT, normalize_report_date
+
+DEFAULT_ATTRIBUTION_DAYS = 30
+
+
+def iter_days(start_date: str, end_date: str) -> Iterator[str]:
+  day = datetime.strptime(start_date, REPORT_DATE_FORMAT)
+  last_day = datetime.strptime(end_date, REPORT_DATE_FORMAT)
+  while day <= last_day:
+    yield day.strftime(REPORT_DATE_FORMAT)
+    day += timedelta(days=1)
+
+
+class ReportCache:
+  """
+  On-disk cache of the report rows of finalized days, one JSON lines file per
+  ads type, stream, account, field set and day:
+
+      {path}/{ads_type}/{stream}/{account_id}/{fields_key}/{day}.jsonl
+
+  A day is finalized once it is older than the attribution window, Yahoo does not change its numbers anymore.
+  Only complete downloads are written, so a cached day always holds every row of that day.
+  """
+  logger = logging.getLogger("airbyte")
+
+  def __init__(self, path: str, attribution_days: int = DEFAULT_ATTRIBUTION_DAYS, end_date: str = None) -> None:
+    self.path = path
+    self.attribution_days = attribution_days
+    end_date = datetime.strptime(end_date, REPORT_DATE_FORMAT) if end_date else datetime.now() - timedelta(days=1)
+    # The latest day that can be cached
+    self.finalized_until = (end_date - timedelta(days=attribution_days)).strftime(REPORT_DATE_FORMAT)
+
+  @staticmethod
+  def partition(ads_type: str, stream: str, account_id: str, fields: List[str]) -> str:
+    # A different field set is a different report, its rows can't be served for this one
+    fields_key = hashlib.sha1(','.join(fields).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(ads_type, stream, str(account_id), fields_key)
+
+  def day_path(self, partition: str, day: str) -> str:
+    return os.path.join(self.path, partition, f"{day}.jsonl")
+
+  def finalized_days(self, start_date: str, end_date: str) -> List[str]:
+    last_day = min(end_date, self.finalized_until)
+    return list(iter_days(start_date, last_day)) if start_date <= last_day else []
+
+  def cached_until(self, partition: str, start_date: str, end_date: str) -> Optional[str]:
+    # The last day of the cached run of days from start_date, None if start_date itself is not cached
+    cached_until = None
+    for day in self.finalized_days(start_date, end_date):
+      if not os.path.exists(self.day_path(partition, day)):
+        break
+      cached_until = day
+    return cached_until
+
+  def read(self, partition: str, start_date: str, end_date: str) -> Iterator[Mapping[str, Any]]:
+    for day in iter_days(start_date, end_date):
+      day_path = self.day_path(partition, day)
+      try:
+        with open(day_path, encoding='utf-8') as day_file:
+          for line in day_file:
+            yield json.loads(line)
+      except (OSError, ValueError) as err:
+        raise ReportCacheError(f"Could not read the cached report rows of {day_path}: {err}") from err
+
+  def writer(self, partition: str, start_date: str, end_date: str) -> "ReportCacheWriter":
+    return ReportCacheWriter(self, partition, self.finalized_days(start_date, end_date))
+
+
+class ReportCacheWriter:
+  """
+  Collects the rows of the finalized days of one report download in temporary files,
+  which become cached days only once the whole report was read.
+  """
+  logger = logging.getLogger("airbyte")
+
+  def __init__(self, cache: ReportCache, partition: str, days: List[str]) -> None:
+    self.cache = cache
+    self.partition = partition
+    self.days = set(days)
+    self.suffix = f".{os.getpid()}.tmp"
+    self.files: MutableMapping[str, IO[str]] = {}
+    self.failed = False
+
+  def write(self, record: Mapping[str, Any]) -> None:
+    if self.failed or not self.days:
+      return
+    day = normalize_report_date(record.get(DAY_COLUMN))
+    if day not in self.days:
+      return
+    try:
+      day_file = self.files.get(day)
+      if day_file is None:
+        day_file = self.files[day] = self._open(day)
+      day_file.write(json.dumps(record, ensure_ascii=False))
+      day_file.write('\n')
+    except OSError as err:
+      self._give_up(err)
+
+  def commit(self) -> None:
+    if self.failed:
+      return
+    try:
+      # Days without any row are cached as empty files
+      for day in self.days - self.files.keys():
+        self.files[day] = self._open(day)
+      for day, day_file in self.files.items():
+        day_file.close()
+        day_path = self.cache.day_path(self.partition, day)
+        os.replace(day_path + self.suffix, day_path)
+      self.files = {}
+    except OSError as err:
+      self._give_up(err)
+
+  def close(self) -> None:
+    # Drop the temporary files of a report that was not read to the end
+    for day, day_file in self.files.items():
+      day_file.close()
+      try:
+        os.remove(self.cache.day_path(self.partition, day) + self.suffix)
+      except OSError:
+        pass
+    self.files = {}
+
+  def _open(self, day: str) -> IO[str]:
+    day_path = self.cache.day_path(self.partition, day)
+    os.makedirs(os.path.dirname(day_path), exist_ok=True)
+    return open(day_path + self.suffix, 'w', encoding='utf-8')
+
+  def _give_up(self, err: OSError) -> None:
+    # The cache only saves requests, a full disk must not fail the sync
+    self.logger.warning(f"Could not cache the report rows of {self.partition}: {err}")
+    self.failed = True
+    self.close()
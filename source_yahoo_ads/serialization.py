@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import json
+import time
+from typing import Any, Mapping, NamedTuple, Optional
+
+from airbyte_cdk.models import Type
+
+# Same separators as AirbyteMessage.json(), but Japanese keys and values are written as UTF-8 instead of \uXXXX escapes
+_encode_data = json.JSONEncoder(ensure_ascii=False, check_circular=False).encode
+
+
+class SerializedRecord(NamedTuple):
+  stream: str
+  data: Mapping[str, Any]
+  emitted_at: int
+  namespace: Optional[str] = None
+
+
+class SerializedRecordMessage:
+  """
+  Stands in for an AirbyteMessage of type RECORD without building the pydantic models.
+  The entrypoint serializes it through json(), which fills the precomputed envelope of its stream.
+  """
+  __slots__ = ('record', 'encoder')
+  type = Type.RECORD
+
+  def __init__(self, record: SerializedRecord, encoder: "RecordMessageEncoder") -> None:
+    self.record = record
+    self.encoder = encoder
+
+  def json(self, **kwargs: Any) -> str:
+    return self.encoder.encode(self.record)
+
+
+class RecordMessageEncoder:
+  """
+  Serializes the record messages of one stream the way AirbyteMessage.json(exclude_unset=True) does,
+  with the envelope around the record data built once per stream.
+  """
+
+  def __init__(self, stream_name: str, namespace: Optional[str] = None) -> None:
+    self.stream_name = stream_name
+    self.namespace = namespace
+    # The namespace comes first, in the field order of AirbyteRecordMessage
+    namespace_field = '' if namespace is None else f'"namespace": {json.dumps(namespace, ensure_ascii=False)}, '
+    self.prefix = f'{{"type": "RECORD", "record": {{{namespace_field}"stream": {json.dumps(stream_name, ensure_ascii=False)}, "data": '
+
+  def message(self, data: Mapping[str, Any]) -> SerializedRecordMessage:
+    return SerializedRecordMessage(
+        SerializedRecord(self.stream_name, data, int(time.time() * 1000), self.namespace), self)
+
+  def encode(self, record: SerializedRecord) -> str:
+    return f'{self.prefix}{_encode_data(record.data)}, "emitted_at": {record.emitted_at}}}}}'
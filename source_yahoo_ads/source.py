@@ -1,40 +1,33 @@
 import logging
-from typing import Any, Iterator, List, Mapping, MutableMapping, Tuple, Union
+from datetime import datetime, timedelta
+from typing import (Any, Iterator, List, Mapping, MutableMapping, Optional,
+                    Tuple, Union)
 
 import requests
 from airbyte_cdk import AirbyteLogger
 from airbyte_cdk.models import (AirbyteMessage, AirbyteStateMessage,
-                                ConfiguredAirbyteCatalog)
+                                AirbyteStateType, ConfiguredAirbyteCatalog,
+                                SyncMode, Type)
 from airbyte_cdk.sources import AbstractSource
 from airbyte_cdk.sources.streams import Stream
-from airbyte_cdk.sources.streams.http.auth import TokenAuthenticator
+from airbyte_cdk.sources.utils.transform import TransformConfig
 from airbyte_cdk.utils.traced_exception import AirbyteTracedException
 
 from source_yahoo_ads.api import YahooAds
-from source_yahoo_ads.streams import YdnAd, YssAd, YssAdConversion, YssKeywords
+from source_yahoo_ads.auth import YahooAdsAuthenticator
+from source_yahoo_ads.metrics import stream_name
+from source_yahoo_ads.polling import PENDING_REPORT_JOB_STATUSES
+from source_yahoo_ads.serialization import RecordMessageEncoder
+from source_yahoo_ads.streams import (YahooAdsStream, YdnAd, YssAd,
+                                      YssAdConversion, YssKeywords)
+from source_yahoo_ads.utils import (REPORT_DATE_FORMAT, get_period_start,
+                                    split_date_range)
 
 
 class AirbyteStopSync(AirbyteTracedException):
   pass
 
 
-YSS_AND_YDN_INDEX = {
-    'YSS_AD': 0,
-    'YSS_AD_CONVERSION': 1,
-    'YSS_KEYWORDS': 2,
-    'YDN_AD': 3,
-}
-
-YSS_INDEX = {
-    'YSS_AD': 0,
-    'YSS_AD_CONVERSION': 1,
-    'YSS_KEYWORDS': 2,
-}
-
-YDN_INDEX = {
-    'YDN_AD': 0,
-}
-
 DESIRED_STREAMS = {
     'YSS_AND_YDN': [
         {'ads_type': 'YSS', 'stream': 'AD'},
@@ -50,23 +43,51 @@ DESIRED_STREAMS = {
     'YDN': [{'ads_type': 'YDN', 'stream': 'AD'}],
 }
 
+DEFAULT_LOOKBACK_WINDOW_DAYS = 7
+
+STREAM_CLASSES = {
+    ('YSS', 'AD'): YssAd,
+    ('YSS', 'AD_CONVERSION'): YssAdConversion,
+    ('YSS', 'KEYWORDS'): YssKeywords,
+    ('YDN', 'AD'): YdnAd,
+}
+
 
 class SourceYahooAds(AbstractSource):
+  logger = logging.getLogger("airbyte")
+
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
     self.catalog = None
     self.config = None
     self.report_jobs = []
+    self.yahoo_ads_object = None
+    # (DESIRED_STREAMS item, stream) of the last streams() call
+    self.desired_streams = []
+    # Creates the report jobs in the background once the first stream starts reading
+    self.report_job_prefetcher = None
+    # Stream name -> indices of its report requests in the prefetcher
+    self.report_job_indices = {}
+    # Stream name -> pseudo report jobs of the days served from the report cache
+    self.cached_report_jobs = {}
+    # Stream name -> state of the incremental streams in the configured catalog
+    self.stream_states = {}
+    # Stream name -> report jobs in the last state message emitted for the stream, see resume_report_jobs
+    self.checkpointed_report_jobs = {}
+    # Stream name -> encoder of its record messages, None emits records through the CDK models
+    self.record_encoders = None
 
-  @staticmethod
-  def _get_yahoo_ads_object(config: Mapping[str, Any]) -> YahooAds:
-    yahoo_ads = YahooAds(**config)
-    yahoo_ads.login()
-    return yahoo_ads
+  def _get_yahoo_ads_object(self, config: Mapping[str, Any]) -> YahooAds:
+    # Keep one client per run, so streams() and read() share the same cached access token.
+    # Creating it makes no API calls, the access token is fetched on first use.
+    if self.yahoo_ads_object is None:
+      self.yahoo_ads_object = YahooAds(**config)
+    return self.yahoo_ads_object
 
   def check_connection(self, logger: AirbyteLogger, config) -> Tuple[bool, any]:
     try:
       yahoo_ads_object = self._get_yahoo_ads_object(config)
+      yahoo_ads_object.login()
       if hasattr(yahoo_ads_object, 'access_token'):
         logger.info('Authentication successful')
         return True, None
@@ -80,50 +101,220 @@ class SourceYahooAds(AbstractSource):
         return False, "API Call limit is exceeded"
 
   def streams(self, config: Mapping[str, Any]) -> List[Stream]:
+    # No API calls here, discover only needs the schemas.
+    # Report jobs are created once a stream starts reading, see _get_report_jobs().
+    self.config = config
     yahoo_ads_object = self._get_yahoo_ads_object(config)
-    authenticator = TokenAuthenticator(token=yahoo_ads_object.access_token)
+    authenticator = YahooAdsAuthenticator(yahoo_ads_object.token_manager)
 
-    # Create a list of report jobs for all selected services
     syncing_services = config['sync_option']['option']
+    spool_threshold_mb = config.get('download_spool_threshold_mb')
+    spool_threshold_bytes = None if spool_threshold_mb is None else int(spool_threshold_mb * 1024 * 1024)
+    # Per stream time unit and whether to split by device, the default is one row per day and device
+    report_granularity = {item['stream']: item for item in config.get('report_granularity') or []}
+    streams = []
     for item in DESIRED_STREAMS[syncing_services]:
-      report_job = yahoo_ads_object.add_report(
-          ads_type=item['ads_type'],
-          stream=item['stream'],
-          start_date=config['start_date'],
-      )
-      self.report_jobs.append(report_job)
-
-    # Append created report jobs to corresponding streams
-    stream_args = []
-    for report_job in self.report_jobs:
-      stream_args.append({
-          "authenticator": authenticator,
-          "account_id": report_job["account_id"],
-          "report_job_id": report_job['report_job_id']
-      })
-
-    print('================Current sync report jobs================')
-    print('report_job_ids: ', self.report_jobs)
-    print('========================================================')
-
-    # TODO: Need refactor this later
-    if syncing_services == 'YSS_AND_YDN':
-      return [
-          YssAd(**stream_args[YSS_AND_YDN_INDEX['YSS_AD']]),
-          YssAdConversion(
-              **stream_args[YSS_AND_YDN_INDEX['YSS_AD_CONVERSION']]),
-          YssKeywords(**stream_args[YSS_AND_YDN_INDEX['YSS_KEYWORDS']]),
-          YdnAd(**stream_args[YSS_AND_YDN_INDEX['YDN_AD']])
-      ]
-    elif syncing_services == 'YSS':
-      return [
-          YssAd(**stream_args[YSS_INDEX['YSS_AD']]),
-          YssAdConversion(
-              **stream_args[YSS_INDEX['YSS_AD_CONVERSION']]),
-          YssKeywords(**stream_args[YSS_INDEX['YSS_KEYWORDS']])
-      ]
-    elif syncing_services == 'YDN':
-      return [YdnAd(**stream_args[YDN_INDEX['YDN_AD']])]
+      granularity = report_granularity.get(stream_name(item['ads_type'], item['stream']), {})
+      streams.append(STREAM_CLASSES[(item['ads_type'], item['stream'])](
+          authenticator=authenticator,
+          spool_threshold_bytes=spool_threshold_bytes,
+          rate_limiter=yahoo_ads_object.rate_limiter,
+          metrics=yahoo_ads_object.metrics,
+          report_jobs_provider=self._get_report_jobs,
+          download_queue_size=config.get('download_queue_size'),
+          report_cache=yahoo_ads_object.report_cache,
+          dedup_window_days=config.get('dedup_window_days'),
+          time_unit=granularity.get('time_unit', 'DAY'),
+          include_device=granularity.get('include_device', True),
+          in_flight_report_jobs_provider=self._get_in_flight_report_jobs if config.get('resume_report_jobs') else None,
+      ))
+    self.desired_streams = list(zip(DESIRED_STREAMS[syncing_services], streams))
+    return streams
+
+  def _get_report_jobs(self, stream: Stream) -> Iterator[dict[str, str]]:
+    # The first stream that starts reading starts the prefetcher for every stream in the configured catalog,
+    # which prepares the reports in the order the streams read them. Deselected streams never get a report job.
+    if self.report_job_prefetcher is None:
+      self._start_report_job_prefetcher()
+    indices = self.report_job_indices.get(stream.name, [])
+    # Finalized days found in the report cache come first, they are the oldest ones
+    yield from self.cached_report_jobs.get(stream.name, [])
+    try:
+      for index in indices:
+        report_job = self.report_job_prefetcher.get(index)
+        self.logger.info(
+            f"Report job {report_job['report_job_id']} of {report_job['ads_type']} {report_job['stream']} "
+            f"for account {report_job['account_id']} ({report_job['start_date']}-{report_job['end_date']}): "
+            f"{report_job['report_job_status']}")
+        yield report_job
+    finally:
+      # Reports this stream did not get to are not created anymore
+      self.report_job_prefetcher.release(indices)
+
+  def _start_report_job_prefetcher(self) -> None:
+    config = self.config
+    yahoo_ads_object = self._get_yahoo_ads_object(config)
+    desired_streams = {stream.name: (item, stream) for item, stream in self.desired_streams}
+    # Prepare the reports in the order of the configured catalog, which is the order the streams are read in
+    selected_streams = list(desired_streams.values()) if self.catalog is None else [
+        desired_streams[configured_stream.stream.name] for configured_stream in self.catalog.streams
+        if configured_stream.stream.name in desired_streams]
+
+    # Fan out over every account of each stream and split its sync period into date windows,
+    # each account and window gets its own report job.
+    # Incremental streams only ask for the days since their state minus the lookback window.
+    end_date = yahoo_ads_object.get_report_end_date()
+    lookback_window_days = config.get('lookback_window_days', DEFAULT_LOOKBACK_WINDOW_DAYS)
+    # Finalized days already in the report cache are read from disk instead.
+    report_cache = yahoo_ads_object.report_cache
+    # Report jobs an earlier attempt left in the state are reused instead of created again.
+    resumable_report_jobs = self._get_resumable_report_jobs(yahoo_ads_object, selected_streams)
+    report_requests = []
+    self.report_job_indices = {}
+    self.cached_report_jobs = {}
+    for item, stream in selected_streams:
+      indices = self.report_job_indices.setdefault(stream.name, [])
+      # Only the columns selected in the catalog are requested, the wide name columns are often left out
+      fields = yahoo_ads_object.get_report_fields(
+          item['ads_type'], item['stream'], self._get_selected_columns(stream.name),
+          [*stream.primary_key, stream.cursor_field], stream.time_unit, stream.include_device)
+      for account_id in yahoo_ads_object.get_account_ids(item['ads_type']):
+        # Weeks and months are always reported from their first day, so no row holds a partial total
+        start_date = get_period_start(stream.get_report_start_date(
+            config['start_date'], self.stream_states.get(stream.name), lookback_window_days, account_id), stream.time_unit)
+        report_request = {**item, 'account_id': account_id, 'fields': fields}
+        # The cache keeps the rows per day, coarser reports are always downloaded
+        if report_cache and stream.time_unit == 'DAY':
+          report_request['cache_partition'] = yahoo_ads_object.get_report_cache_partition(
+              item['ads_type'], item['stream'], account_id, fields)
+          cached_until = report_cache.cached_until(report_request['cache_partition'], start_date, end_date)
+          if cached_until:
+            self.cached_report_jobs.setdefault(stream.name, []).append({
+                **report_request, 'report_job_id': None, 'report_job_status': 'CACHED',
+                'start_date': start_date, 'end_date': cached_until})
+            start_date = (datetime.strptime(cached_until, REPORT_DATE_FORMAT) + timedelta(days=1)).strftime(REPORT_DATE_FORMAT)
+            if start_date > end_date:
+              continue
+        resumed_report_jobs = [
+            report_job for report_job in resumable_report_jobs.get(stream.name, [])
+            if report_job['account_id'] == account_id and report_job.get('fields') == fields]
+        for window in self._plan_report_windows(
+                start_date, end_date, config.get('report_window_days'), stream.time_unit, resumed_report_jobs):
+          indices.append(len(report_requests))
+          report_requests.append({**report_request, **window})
+
+    cached_report_job_count = sum(len(report_jobs) for report_jobs in self.cached_report_jobs.values())
+    if cached_report_job_count:
+      self.logger.info(f"Reading the finalized days of {cached_report_job_count} stream accounts from the report cache")
+    self.logger.info(f"Preparing {len(report_requests)} report jobs for this sync")
+    self.report_job_prefetcher = yahoo_ads_object.prefetch_report_jobs(report_requests)
+
+  @staticmethod
+  def _plan_report_windows(start_date: str, end_date: str, window_days: Optional[int], time_unit: str,
+                           resumed_report_jobs: List[Mapping[str, Any]]) -> List[dict[str, str]]:
+    # The date windows from start_date to end_date. Resumed report jobs within the period keep their own window,
+    # the days around them are split as usual.
+    windows = []
+    window_start = start_date
+    for report_job in sorted(resumed_report_jobs, key=lambda report_job: report_job['start_date']):
+      if report_job['start_date'] < window_start or report_job['end_date'] > end_date:
+        continue
+      day_before = (datetime.strptime(report_job['start_date'], REPORT_DATE_FORMAT) - timedelta(days=1)).strftime(REPORT_DATE_FORMAT)
+      windows.extend({'start_date': gap_start, 'end_date': gap_end}
+                     for gap_start, gap_end in split_date_range(window_start, day_before, window_days, time_unit))
+      windows.append({key: report_job[key] for key in ('start_date', 'end_date', 'report_job_id', 'report_job_status')})
+      window_start = (datetime.strptime(report_job['end_date'], REPORT_DATE_FORMAT) + timedelta(days=1)).strftime(REPORT_DATE_FORMAT)
+    windows.extend({'start_date': gap_start, 'end_date': gap_end}
+                   for gap_start, gap_end in split_date_range(window_start, end_date, window_days, time_unit))
+    return windows
+
+  def _get_resumable_report_jobs(self, yahoo_ads_object: YahooAds,
+                                 selected_streams: List[Tuple[Mapping[str, str], Stream]]) -> Mapping[str, List[dict[str, Any]]]:
+    # The report jobs in the state of a failed attempt that Yahoo still has and that did not fail, per stream
+    resumable_report_jobs = {}
+    if not self.config.get('resume_report_jobs'):
+      return resumable_report_jobs
+    for item, stream in selected_streams:
+      stored_report_jobs = (self.stream_states.get(stream.name) or {}).get('report_jobs') or []
+      for account_id in dict.fromkeys(str(report_job['account_id']) for report_job in stored_report_jobs):
+        report_jobs = [report_job for report_job in stored_report_jobs if str(report_job['account_id']) == account_id]
+        try:
+          report_definitions = yahoo_ads_object.get_reports(
+              item['ads_type'], account_id, [report_job['report_job_id'] for report_job in report_jobs])
+        except requests.exceptions.RequestException as err:
+          self.logger.warning(f"Could not check the report jobs of the previous attempt of {stream.name}: {err}")
+          continue
+        statuses = {str(report_definition['reportJobId']): str(report_definition['reportJobStatus'])
+                    for report_definition in report_definitions}
+        for report_job in report_jobs:
+          report_job_status = statuses.get(str(report_job['report_job_id']))
+          if report_job_status == 'COMPLETED' or report_job_status in PENDING_REPORT_JOB_STATUSES:
+            resumable_report_jobs.setdefault(stream.name, []).append(
+                {**report_job, 'account_id': account_id, 'report_job_status': report_job_status})
+    resumable_report_job_count = sum(len(report_jobs) for report_jobs in resumable_report_jobs.values())
+    if resumable_report_job_count:
+      self.logger.info(f"Reusing {resumable_report_job_count} report jobs of the previous attempt")
+    return resumable_report_jobs
+
+  def _get_in_flight_report_jobs(self, stream: YahooAdsStream) -> List[Mapping[str, Any]]:
+    # The report jobs of the stream created so far and not read to the end, see _get_resumable_report_jobs()
+    if self.report_job_prefetcher is None:
+      return []
+    return [
+        {key: report_job.get(key) for key in ('account_id', 'start_date', 'end_date', 'report_job_id', 'report_job_status', 'fields')}
+        for report_job in self.report_job_prefetcher.created_report_jobs
+        if stream_name(report_job['ads_type'], report_job['stream']) == stream.name
+        and str(report_job['report_job_id']) not in stream.read_report_job_ids
+        and report_job['report_job_status'] != 'FAILED'
+    ]
+
+  def _get_selected_columns(self, stream_name: str) -> Optional[List[str]]:
+    # The properties left in the configured stream's schema, None reads every column
+    for configured_stream in (self.catalog.streams if self.catalog else []):
+      if configured_stream.stream.name == stream_name:
+        properties = (configured_stream.stream.json_schema or {}).get('properties')
+        return list(properties) if properties else None
+    return None
+
+  def _sweep_stale_reports(self, yahoo_ads_object: YahooAds, older_than_hours: float) -> None:
+    # Reports left behind by earlier syncs slow down listing and polling the reports of an account
+    report_job_ids = [report_job['report_job_id'] for report_job in self.report_jobs]
+    for ads_type in dict.fromkeys(item['ads_type'] for item, _ in self.desired_streams):
+      for account_id in yahoo_ads_object.get_account_ids(ads_type):
+        yahoo_ads_object.sweep_stale_reports(ads_type, account_id, older_than_hours, report_job_ids)
+
+  def _get_message(self, record_data_or_message: Any, stream: Stream) -> AirbyteMessage:
+    # Rows of the Yahoo streams skip the pydantic models when fast_record_serialization is on
+    if (self.record_encoders is not None and isinstance(record_data_or_message, Mapping)
+            and isinstance(stream, YahooAdsStream) and stream.transformer._config == TransformConfig.NoTransform):
+      encoder = self.record_encoders.get(stream.name)
+      if encoder is None:
+        encoder = self.record_encoders[stream.name] = RecordMessageEncoder(stream.name, stream.namespace)
+      return encoder.message(record_data_or_message)
+    return super()._get_message(record_data_or_message, stream)
+
+  @staticmethod
+  def _get_stream_states(
+      catalog: ConfiguredAirbyteCatalog,
+      state: Union[List[AirbyteStateMessage], MutableMapping[str, Any]] = None,
+  ) -> MutableMapping[str, Mapping[str, Any]]:
+    stream_states = {}
+    if isinstance(state, MutableMapping):
+      # Legacy state: {stream_name: stream_state}
+      stream_states.update(state)
+    else:
+      for state_message in state or []:
+        if state_message.type == AirbyteStateType.STREAM and state_message.stream.stream_state:
+          stream_states[state_message.stream.stream_descriptor.name] = state_message.stream.stream_state.dict()
+        elif state_message.data:
+          stream_states.update(state_message.data)
+
+    # Full refresh streams always start over from start_date
+    incremental_stream_names = {
+        configured_stream.stream.name for configured_stream in catalog.streams
+        if configured_stream.sync_mode == SyncMode.incremental
+    }
+    return {name: stream_state for name, stream_state in stream_states.items() if name in incremental_stream_names}
 
   def read(
       self,
@@ -133,19 +324,41 @@ class SourceYahooAds(AbstractSource):
       state: Union[List[AirbyteStateMessage], MutableMapping[str, Any]] = None,
   ) -> Iterator[AirbyteMessage]:
     yahoo_ads_object = self._get_yahoo_ads_object(config)
+    self.catalog = catalog
+    self.stream_states = self._get_stream_states(catalog, state)
+    self.checkpointed_report_jobs = {}
+    self.record_encoders = {} if config.get('fast_record_serialization') else None
+    succeeded = False
     try:
-      yield from super().read(logger, config, catalog, state)
+      for message in super().read(logger, config, catalog, state):
+        if message.type == Type.STATE:
+          for name, stream_state in self._get_stream_states(catalog, [message.state]).items():
+            self.checkpointed_report_jobs[name] = (stream_state or {}).get('report_jobs') or []
+        yield message
+      succeeded = True
       logger.info(f"Finished syncing {self.name} successfully")
     except AirbyteStopSync:
       logger.info(f"Finished syncing {self.name} with error")
     finally:
-      removed_report_count = 0
-      for report_job in self.report_jobs:
-        if report_job['report_job_status'] == 'COMPLETED':
-          removed_report_count += 1
-          yahoo_ads_object.remove_report(
-              ads_type=report_job['ads_type'],
-              report_job_id=report_job['report_job_id']
-          )
-      logger.info(
-          f"Removed {removed_report_count}/{len(self.report_jobs)} reports successfully after syncing")
+      if self.report_job_prefetcher is not None:
+        self.report_job_prefetcher.close()
+        self.report_jobs.extend(self.report_job_prefetcher.created_report_jobs)
+      report_jobs = self.report_jobs
+      if config.get('resume_report_jobs') and not succeeded:
+        # Keep only the jobs a retry can find in the last state message of their stream
+        checkpointed_report_job_ids = {
+            str(report_job['report_job_id'])
+            for report_jobs in self.checkpointed_report_jobs.values() for report_job in report_jobs}
+        report_jobs = [report_job for report_job in self.report_jobs
+                       if str(report_job['report_job_id']) not in checkpointed_report_job_ids]
+      with yahoo_ads_object.metrics.timer('cleanup'):
+        # Failed and unfinished jobs are removed as well, they would pile up in the account otherwise
+        removed_report_count = yahoo_ads_object.remove_reports(report_jobs)
+        logger.info(
+            f"Removed {removed_report_count}/{len(report_jobs)} reports successfully after syncing")
+        if config.get('stale_report_sweep_hours'):
+          self._sweep_stale_reports(yahoo_ads_object, config['stale_report_sweep_hours'])
+      yahoo_ads_object.close()
+      yahoo_ads_object.metrics.log(logger)
+      if config.get('metrics_prometheus_path'):
+        yahoo_ads_object.metrics.write_prometheus(config['metrics_prometheus_path'])
@@ -1,19 +1,202 @@
 from abc import ABC
-from typing import Any, Iterable, List, Mapping, MutableMapping, Optional
+from datetime import datetime, timedelta
+from typing import (Any, Callable, Iterable, List, Mapping, MutableMapping,
+                    Optional, Set)
 
 import requests
+from airbyte_cdk.models import SyncMode
+from airbyte_cdk.sources.streams.availability_strategy import \
+    AvailabilityStrategy
 from airbyte_cdk.sources.streams.http import HttpStream
 
 from source_yahoo_ads.api import YAHOO_ADS_DISPLAY, YAHOO_ADS_SEARCH
 
-from .utils import generate_temp_download
+from .coercion import compile_coercion_plan
+from .dedup import PrimaryKeyDeduplicator
+from .exceptions import ReportJobFailed
+from .metrics import SyncMetrics
+from .rate_limiting import YahooAdsRateLimiter, is_request_limit_exceeded
+from .report_cache import ReportCache
+from .utils import (ACCOUNT_ID_COLUMN, DAY_COLUMN, DEVICE_COLUMN,
+                    REPORT_DATE_FORMAT, TIME_UNIT_COLUMNS,
+                    generate_temp_download, get_updated_cursor_state,
+                    iter_in_background, merge_cursor_states,
+                    normalize_report_date)
 
 
 class YahooAdsStream(HttpStream, ABC):
-  def __init__(self, account_id: str, report_job_id: str, ** kwargs):
+  def __init__(self, report_jobs: List[dict[str, str]] = None, spool_threshold_bytes: Optional[int] = None,
+               rate_limiter: Optional[YahooAdsRateLimiter] = None, metrics: Optional[SyncMetrics] = None,
+               report_jobs_provider: Optional[Callable[["YahooAdsStream"], Iterable[dict[str, str]]]] = None,
+               download_queue_size: Optional[int] = None, report_cache: Optional[ReportCache] = None,
+               dedup_window_days: Optional[int] = None, time_unit: str = 'DAY', include_device: bool = True,
+               in_flight_report_jobs_provider: Optional[Callable[["YahooAdsStream"], List[Mapping[str, Any]]]] = None,
+               ** kwargs):
     super().__init__(**kwargs)
-    self.account_id = account_id
-    self.report_job_id = report_job_id
+    # Creates the report jobs when the stream starts reading, unless report_jobs are given up front
+    self.report_jobs_provider = report_jobs_provider
+    # Timings and volumes of the downloads, shared with the YahooAds client
+    self.metrics = metrics or SyncMetrics()
+    # Request budget shared with the YahooAds client, None sends downloads unthrottled
+    self.rate_limiter = rate_limiter
+    # One prepared report job per account and date window
+    self.report_jobs = report_jobs
+    # Reports at least this large are spooled to disk before parsing, None disables spooling
+    self.spool_threshold_bytes = spool_threshold_bytes
+    # Rows a worker thread may download and parse ahead of the emitted records, None or 0 parses inline
+    self.download_queue_size = download_queue_size
+    # Serves the finalized days of CACHED slices and keeps those of the downloaded reports, None disables caching
+    self.report_cache = report_cache
+    # Days per account within which rows with an already emitted primary key are dropped, rounded up to whole
+    # weeks or months at those granularities. None keeps every row
+    self.dedup_window_days = dedup_window_days
+    # Granularity of the rows, Yahoo aggregates by WEEK or MONTH instead of DAY and over all devices without DEVICE
+    self.time_unit = time_unit
+    self.include_device = include_device
+    if time_unit != 'DAY' or not include_device:
+      self.primary_key = [self._get_column(column) for column in self.primary_key if self._get_column(column)]
+      if self.cursor_field:
+        self.cursor_field = self._get_column(self.cursor_field)
+    # Report jobs of this stream not read to the end yet, kept in the state so a retry can reuse them.
+    # None leaves them out of the state, as does an empty list once the stream read all of its jobs.
+    self.in_flight_report_jobs_provider = in_flight_report_jobs_provider
+    self._in_flight_report_jobs = None
+    # Report jobs whose slice was read to the end
+    self.read_report_job_ids: Set[str] = set()
+    self._deduplicator = None
+    self._coercion_plan = None
+    self._json_schema = None
+    # Running cursor state of this sync, see get_updated_state
+    self._cursor_state = {}
+
+  @property
+  def coercion_plan(self) -> Mapping[str, Callable[[str], Any]]:
+    # Compiled once per stream from its JSON schema, then applied to every row
+    if self._coercion_plan is None:
+      self._coercion_plan = compile_coercion_plan(self.get_json_schema())
+    return self._coercion_plan
+
+  def _get_column(self, column: str) -> Optional[str]:
+    # The column of the report at this stream's granularity, None if it is aggregated away
+    if column == DAY_COLUMN:
+      return TIME_UNIT_COLUMNS[self.time_unit]
+    if column == DEVICE_COLUMN and not self.include_device:
+      return None
+    return column
+
+  def get_json_schema(self) -> Mapping[str, Any]:
+    # Built once per stream, the CDK asks for the schema of every record it transforms
+    if self._json_schema is None:
+      self._json_schema = self._build_json_schema()
+    return self._json_schema
+
+  def _build_json_schema(self) -> Mapping[str, Any]:
+    schema = super().get_json_schema()
+    if self.time_unit == 'DAY' and self.include_device:
+      return schema
+    properties = {}
+    for column, property_schema in schema['properties'].items():
+      if column == DAY_COLUMN:
+        # The week or month is a plain string, e.g. the first day of the week or '2023-01'
+        properties[self._get_column(column)] = {"type": ["string", "null"], "airbyte_type": "string"}
+      elif self._get_column(column):
+        properties[column] = property_schema
+    return {**schema, 'properties': properties}
+
+  @property
+  def availability_strategy(self) -> Optional[AvailabilityStrategy]:
+    # HttpAvailabilityStrategy would create the report jobs and download the first slice just to check the stream
+    return None
+
+  def get_report_start_date(self, start_date: str, stream_state: Mapping[str, Any] = None, lookback_window_days: int = 0,
+                            account_id: str = None) -> str:
+    # Restart from the latest synced day minus the lookback, which picks up late conversion attribution
+    if not self.cursor_field or not stream_state:
+      return start_date
+    if account_id and 'accounts' in stream_state:
+      cursor_value = normalize_report_date(stream_state['accounts'].get(str(account_id)))
+    else:
+      cursor_value = normalize_report_date(stream_state.get(self.cursor_field))
+    if not cursor_value:
+      return start_date
+    lookback_start_date = datetime.strptime(cursor_value, REPORT_DATE_FORMAT) - timedelta(days=lookback_window_days)
+    return max(start_date, lookback_start_date.strftime(REPORT_DATE_FORMAT))
+
+  def stream_slices(
+      self, sync_mode: SyncMode, cursor_field: List[str] = None, stream_state: Mapping[str, Any] = None
+  ) -> Iterable[Optional[Mapping[str, Any]]]:
+    report_jobs = self.report_jobs
+    if report_jobs is None:
+      # Yields each report job once it is ready to download
+      report_jobs = self.report_jobs_provider(self) if self.report_jobs_provider else []
+    for report_job in report_jobs:
+      stream_slice = {
+          "account_id": report_job['account_id'],
+          "report_job_id": report_job['report_job_id'],
+          "report_job_status": report_job['report_job_status'],
+          "start_date": report_job['start_date'],
+          "end_date": report_job['end_date'],
+      }
+      if report_job.get('cache_partition'):
+        stream_slice["cache_partition"] = report_job['cache_partition']
+      yield stream_slice
+
+  def read_records(
+      self,
+      sync_mode: SyncMode,
+      cursor_field: List[str] = None,
+      stream_slice: Mapping[str, Any] = None,
+      stream_state: Mapping[str, Any] = None,
+  ) -> Iterable[Mapping[str, Any]]:
+    if stream_slice['report_job_status'] == 'CACHED':
+      records = self.report_cache.read(stream_slice['cache_partition'], stream_slice['start_date'], stream_slice['end_date'])
+      report_job_id = 'cache'
+    # Windows fail independently on Yahoo's side, only the failed one can't be downloaded
+    elif stream_slice['report_job_status'] != 'COMPLETED':
+      raise ReportJobFailed(
+          f"Report job {stream_slice['report_job_id']} of {self.name} for "
+          f"{stream_slice['start_date']}-{stream_slice['end_date']} ended with status {stream_slice['report_job_status']}")
+    else:
+      records = super().read_records(sync_mode, cursor_field, stream_slice, stream_state)
+      report_job_id = stream_slice['report_job_id']
+    if self.dedup_window_days is not None:
+      records = self._drop_duplicates(records, report_job_id)
+    records = self.metrics.timed_records(records, self.name, report_job_id)
+    if stream_slice['report_job_id'] is None:
+      yield from records
+    else:
+      yield from self._mark_read(records, str(stream_slice['report_job_id']))
+
+  def _mark_read(self, records: Iterable[Mapping[str, Any]], report_job_id: str) -> Iterable[Mapping[str, Any]]:
+    # The report job counts as read right before the last record of its slice is emitted, so the state
+    # the CDK checkpoints at the end of the slice already lists the report jobs in flight after it
+    last_record = None
+    for record in records:
+      if last_record is not None:
+        yield last_record
+      last_record = record
+    self.read_report_job_ids.add(report_job_id)
+    if self.in_flight_report_jobs_provider:
+      self._in_flight_report_jobs = self.in_flight_report_jobs_provider(self)
+    if last_record is not None:
+      yield last_record
+
+  def _get_checkpoint(self) -> Mapping[str, Any]:
+    # The running cursor state, with the report jobs a retry can reuse while there are any
+    if not self._in_flight_report_jobs:
+      return self._cursor_state
+    return {**self._cursor_state, 'report_jobs': self._in_flight_report_jobs}
+
+  def _drop_duplicates(self, records: Iterable[Mapping[str, Any]], report_job_id: str) -> Iterable[Mapping[str, Any]]:
+    # One deduplicator across the slices of this sync, so overlapping windows are caught
+    if self._deduplicator is None:
+      self._deduplicator = PrimaryKeyDeduplicator(
+          self.primary_key, self.dedup_window_days, TIME_UNIT_COLUMNS[self.time_unit], self.time_unit)
+    for record in records:
+      if self._deduplicator.is_duplicate(record):
+        self.metrics.add('duplicate_rows', 1, self.name, report_job_id)
+        continue
+      yield record
 
   def next_page_token(self, response: requests.Response) -> Optional[Mapping[str, Any]]:
     return None
@@ -30,22 +213,69 @@ class YahooAdsStream(HttpStream, ABC):
       next_page_token: Mapping[str, Any] = None,
   ) -> Optional[Mapping]:
     body = {
-        "accountId": self.account_id,
-        "reportJobId": self.report_job_id
+        "accountId": stream_slice["account_id"],
+        "reportJobId": stream_slice["report_job_id"]
     }
     return body
 
   def request_headers(self, *args, **kvargs) -> MutableMapping[str, Any]:
-    return {"Content-Type": "application/json"}
+    # The CSV shrinks a lot with gzip, requests inflates it while streaming
+    return {"Content-Type": "application/json", "Accept-Encoding": "gzip, deflate"}
 
-  def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
-    # Use the generator function to iterate over the rows of data
-    csv_rows_generator = generate_temp_download(response)
+  def should_retry(self, response: requests.Response) -> bool:
+    return is_request_limit_exceeded(response) or super().should_retry(response)
 
-    # Convert the generator to a list
-    report_response = list(csv_rows_generator)
+  def backoff_time(self, response: requests.Response) -> Optional[float]:
+    # Wait until the quota window resets, the shared limiter slows down the other requests meanwhile
+    if self.rate_limiter and is_request_limit_exceeded(response):
+      return self.rate_limiter.on_limit_exceeded(response.request.url, response)
+    return None
 
-    yield from report_response
+  def _send(self, request: requests.PreparedRequest, request_kwargs: Mapping[str, Any]) -> requests.Response:
+    if self.rate_limiter:
+      self.rate_limiter.acquire(request.url)
+    with self.metrics.timer('download_request', self.name):
+      response = super()._send(request, request_kwargs)
+    if self.rate_limiter:
+      self.rate_limiter.on_success(request.url)
+    return response
+
+  def request_kwargs(self, *args, **kwargs) -> Mapping[str, Any]:
+    # Do not load the whole report into memory before parsing it
+    return {"stream": True}
+
+  def parse_response(self, response: requests.Response, stream_slice: Mapping[str, Any] = None, **kwargs) -> Iterable[Mapping]:
+    # Emit each row as soon as it is parsed from the downloading report,
+    # tagged with the account it belongs to
+    account_id = (stream_slice or {}).get("account_id")
+    report_job_id = (stream_slice or {}).get("report_job_id")
+
+    cache_partition = (stream_slice or {}).get("cache_partition")
+
+    def parse_records() -> Iterable[Mapping]:
+      # Rows of finalized days are also written to the report cache, which keeps them once the whole report is read
+      cache_writer = self.report_cache.writer(cache_partition, stream_slice['start_date'], stream_slice['end_date']) \
+          if self.report_cache and cache_partition else None
+      try:
+        for record in generate_temp_download(
+                response, spool_threshold_bytes=self.spool_threshold_bytes, converters=self.coercion_plan,
+                on_chunk=lambda size: self.metrics.add('download_bytes', size, self.name, report_job_id)):
+          if account_id and not record.get(ACCOUNT_ID_COLUMN):
+            record[ACCOUNT_ID_COLUMN] = account_id
+          if cache_writer:
+            cache_writer.write(record)
+          yield record
+        if cache_writer:
+          cache_writer.commit()
+      finally:
+        if cache_writer:
+          cache_writer.close()
+
+    records = parse_records()
+    if self.download_queue_size:
+      # Download and parse on a worker thread while this thread serializes and emits the records
+      records = iter_in_background(records, self.download_queue_size, f"yahoo-ads-{self.name}-download")
+    yield from records
 
 
 class YahooSearchAdsStream(YahooAdsStream, ABC):
@@ -64,7 +294,7 @@ class YahooDisplayAdsStream(YahooAdsStream, ABC):
     return "download"
 
 
-class IncrementalYahooSearchAdsStream(YahooSearchAdsStream, ABC):
+class IncrementalYahooAdsStream(YahooAdsStream, ABC):
   state_checkpoint_interval = None
 
   @property
@@ -72,18 +302,19 @@ class IncrementalYahooSearchAdsStream(YahooSearchAdsStream, ABC):
     return []
 
   def get_updated_state(self, current_stream_state: MutableMapping[str, Any], latest_record: Mapping[str, Any]) -> Mapping[str, Any]:
-    return {}
+    # The CDK passes the state the sync started with for every record,
+    # so accounts synced in earlier slices would drop out without the running state
+    updated_state = get_updated_cursor_state(self.cursor_field, current_stream_state, latest_record)
+    self._cursor_state = merge_cursor_states(self.cursor_field, self._cursor_state, updated_state)
+    return self._get_checkpoint()
 
 
-class IncrementalYahooDisplayAdsStream(YahooDisplayAdsStream, ABC):
-  state_checkpoint_interval = None
+class IncrementalYahooSearchAdsStream(IncrementalYahooAdsStream, YahooSearchAdsStream, ABC):
+  pass
 
-  @property
-  def cursor_field(self) -> str:
-    return []
 
-  def get_updated_state(self, current_stream_state: MutableMapping[str, Any], latest_record: Mapping[str, Any]) -> Mapping[str, Any]:
-    return {}
+class IncrementalYahooDisplayAdsStream(IncrementalYahooAdsStream, YahooDisplayAdsStream, ABC):
+  pass
 
 
 class YssAd(IncrementalYahooSearchAdsStream):
@@ -93,7 +324,8 @@ class YssAd(IncrementalYahooSearchAdsStream):
 
 class YssAdConversion(IncrementalYahooSearchAdsStream):
   cursor_field = "日"
-  primary_key = ["広告ID", "日", "デバイス"]
+  # One row per conversion name of each ad, day and device
+  primary_key = ["広告ID", "コンバージョン名", "日", "デバイス"]
 
 
 class YssKeywords(IncrementalYahooSearchAdsStream):
@@ -1,30 +1,400 @@
+import codecs
 import csv
-import io
+import itertools
+import mmap
+import queue
+import struct
+import tempfile
+import threading
+import zipfile
+import zlib
+from datetime import datetime, timedelta
+from typing import (IO, Any, Callable, Iterable, Iterator, List, Mapping,
+                    Optional, Tuple)
 
 import requests
 
+from .coercion import NULL_MARKERS
+from .exceptions import ReportDecompressionError, TmpFileIOError
 
-def generate_temp_download(response: requests.models.Response):
-  # Create a buffer for the response data
-  buffer = io.BytesIO()
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+REPORT_DATE_FORMAT = '%Y%m%d'
+ACCOUNT_ID_COLUMN = 'アカウントID'
+DAY_COLUMN = '日'
+DEVICE_COLUMN = 'デバイス'
+# Time dimension of a report -> its column, reports of a coarser unit than DAY have no 日 column
+TIME_UNIT_COLUMNS = {'DAY': DAY_COLUMN, 'WEEK': '週', 'MONTH': '月'}
+ZIP_LOCAL_FILE_SIGNATURE = b'PK\x03\x04'
+# signature, version, flags, method, time, date, crc32, compressed size, size, name length, extra length
+ZIP_LOCAL_FILE_HEADER = struct.Struct('<4sHHHHHIIIHH')
+# General purpose flag: crc32 and sizes follow the data instead of being in the header
+ZIP_DATA_DESCRIPTOR_FLAG = 0x08
+# Rows handed over to the emitting thread at once, so the threads synchronize per batch instead of per row
+BACKGROUND_BATCH_SIZE = 500
+_END_OF_ROWS = object()
 
-  # Write the response data to the buffer
-  for chunk in response.iter_content(chunk_size=None):
-    buffer.write(chunk)
 
-  # Reset the buffer position to the beginning
-  buffer.seek(0)
+def normalize_report_date(value: Optional[str]) -> Optional[str]:
+  # Reports write days as e.g. '2023-01-01', the API and the state use '20230101'.
+  # A month such as '2023-01' stands for its first day.
+  digits = ''.join(char for char in value if char.isdigit()) if value else ''
+  if len(digits) == 6:
+    return digits + '01'
+  return digits if len(digits) == 8 else None
 
-  # Parse the CSV data using csv.DictReader()
-  reader = csv.DictReader(io.TextIOWrapper(buffer, encoding='utf-8'),
-                          delimiter=',',
-                          quotechar='"',
-                          quoting=csv.QUOTE_MINIMAL,
-                          skipinitialspace=True,
-                          escapechar='\\',
-                          doublequote=True,
-                          strict=True)
+
+def get_updated_cursor_state(cursor_field: str, current_stream_state: Optional[Mapping[str, Any]],
+                             latest_record: Mapping[str, Any]) -> Mapping[str, Any]:
+  # Keep the latest reported day seen so far, overall and per account
+  current_stream_state = current_stream_state or {}
+  latest_value = normalize_report_date(latest_record.get(cursor_field))
+  cursor_values = [
+      normalize_report_date(current_stream_state.get(cursor_field)),
+      latest_value,
+  ]
+  cursor_values = [value for value in cursor_values if value]
+  if not cursor_values:
+    return {}
+  updated_state = {cursor_field: max(cursor_values)}
+
+  # A newly added account has no entry yet and is synced from start_date
+  account_states = dict(current_stream_state.get('accounts') or {})
+  account_id = latest_record.get(ACCOUNT_ID_COLUMN)
+  if account_id and latest_value and latest_value > account_states.get(str(account_id), ''):
+    account_states[str(account_id)] = latest_value
+  if account_states:
+    updated_state['accounts'] = account_states
+  return updated_state
+
+
+def merge_cursor_states(cursor_field: str, *stream_states: Optional[Mapping[str, Any]]) -> Mapping[str, Any]:
+  # Latest day of the given states, overall and per account
+  merged_state = {}
+  for stream_state in stream_states:
+    if not stream_state:
+      continue
+    cursor_value = normalize_report_date(stream_state.get(cursor_field))
+    if cursor_value and cursor_value > merged_state.get(cursor_field, ''):
+      merged_state[cursor_field] = cursor_value
+    for account_id, account_value in (stream_state.get('accounts') or {}).items():
+      account_states = merged_state.setdefault('accounts', {})
+      if account_value > account_states.get(account_id, ''):
+        account_states[account_id] = account_value
+  return merged_state
+
+
+def get_period_start(day: str, time_unit: str = 'DAY') -> str:
+  # First day of the week (starting on Monday) or month of the YYYYMMDD day
+  date = datetime.strptime(day, REPORT_DATE_FORMAT)
+  if time_unit == 'WEEK':
+    date -= timedelta(days=date.weekday())
+  elif time_unit == 'MONTH':
+    date = date.replace(day=1)
+  return date.strftime(REPORT_DATE_FORMAT)
+
+
+def split_date_range(start_date: str, end_date: str, window_days: Optional[int] = None,
+                     time_unit: str = 'DAY') -> List[Tuple[str, str]]:
+  # Split the inclusive YYYYMMDD range into consecutive windows of at most window_days days
+  if start_date > end_date:
+    return []
+  if time_unit != 'DAY':
+    return _split_date_range_by_period(start_date, end_date, window_days, time_unit)
+  if not window_days:
+    return [(start_date, end_date)]
+  window_start = datetime.strptime(start_date, REPORT_DATE_FORMAT)
+  last_day = datetime.strptime(end_date, REPORT_DATE_FORMAT)
+  windows = []
+  while window_start <= last_day:
+    window_end = min(window_start + timedelta(days=window_days - 1), last_day)
+    windows.append((window_start.strftime(REPORT_DATE_FORMAT), window_end.strftime(REPORT_DATE_FORMAT)))
+    window_start = window_end + timedelta(days=1)
+  return windows
+
+
+def _split_date_range_by_period(start_date: str, end_date: str, window_days: Optional[int],
+                                time_unit: str) -> List[Tuple[str, str]]:
+  # Whole weeks or months per window, even if one is longer than window_days:
+  # a period split over two reports would be reported twice with partial totals
+  last_day = datetime.strptime(end_date, REPORT_DATE_FORMAT)
+  period_start = datetime.strptime(start_date, REPORT_DATE_FORMAT)
+  windows = []
+  while period_start <= last_day:
+    if time_unit == 'WEEK':
+      next_period_start = period_start + timedelta(days=7 - period_start.weekday())
+    else:
+      next_period_start = (period_start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    period_end = min(next_period_start - timedelta(days=1), last_day)
+    if windows and (not window_days or (period_end - windows[-1][0]).days < window_days):
+      windows[-1] = (windows[-1][0], period_end)
+    else:
+      windows.append((period_start, period_end))
+    period_start = next_period_start
+  return [(window_start.strftime(REPORT_DATE_FORMAT), window_end.strftime(REPORT_DATE_FORMAT))
+          for window_start, window_end in windows]
+
+
+def iter_text_lines(chunks: Iterable[bytes], encoding: str = 'utf-8') -> Iterator[str]:
+  # Decode the byte chunks as they arrive and cut them into lines, keeping the line endings
+  # so csv can still rebuild quoted fields that span several lines.
+  # Only split on '\n': str.splitlines() would also split on characters like '\u2028' inside a field.
+  decoder = codecs.getincrementaldecoder(encoding)()
+  remainder = ''
+  for chunk in chunks:
+    text = remainder + decoder.decode(chunk)
+    lines = text.split('\n')
+    remainder = lines.pop()
+    for line in lines:
+      yield line + '\n'
+  remainder += decoder.decode(b'', final=True)
+  if remainder:
+    yield remainder
+
+
+def read_csv_rows(lines: Iterable[str],
+                  converters: Optional[Mapping[str, Callable[[str], Any]]] = None) -> Iterator[Mapping[str, Any]]:
+  # Parse the CSV data using csv.reader() and build the records from the header,
+  # converting the typed columns found in the coercion plan
+  reader = csv.reader(lines,
+                      delimiter=',',
+                      quotechar='"',
+                      quoting=csv.QUOTE_MINIMAL,
+                      skipinitialspace=True,
+                      escapechar='\\',
+                      doublequote=True,
+                      strict=True)
+  header = next(reader, None)
+  if header is None:
+    return
+
+  # Resolve the plan against the header once: (column index, column name, converter)
+  converters = converters or {}
+  typed_columns = [(index, column, converters[column]) for index, column in enumerate(header) if column in converters]
+  width = len(header)
 
   # Yield each row from the CSV data
   for row in reader:
-    yield row
+    if not row:
+      continue
+    if len(row) < width:
+      row += [None] * (width - len(row))
+    record = dict(zip(header, row))
+    for index, column, convert in typed_columns:
+      value = row[index]
+      record[column] = None if value in NULL_MARKERS else convert(value)
+    yield record
+
+
+def iter_download_chunks(response: requests.models.Response,
+                         on_chunk: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+  # on_chunk gets the size of every received chunk, e.g. to count the downloaded bytes
+  for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+    if on_chunk:
+      on_chunk(len(chunk))
+    yield chunk
+
+
+def _read_exactly(buffer: bytes, chunks: Iterator[bytes], size: int) -> bytes:
+  while len(buffer) < size:
+    chunk = next(chunks, None)
+    if chunk is None:
+      raise ReportDecompressionError("The ZIP report download ended unexpectedly")
+    buffer += chunk
+  return buffer
+
+
+def iter_unzipped_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+  # Inflate the report, the first member of the ZIP archive, while the archive is still downloading.
+  # zipfile needs a seekable file, but the local file header in front of the data is all a single member needs.
+  chunks = iter(chunks)
+  buffer = _read_exactly(b'', chunks, ZIP_LOCAL_FILE_HEADER.size)
+  (signature, _, flags, method, _, _, expected_crc, compressed_size, _,
+   name_length, extra_length) = ZIP_LOCAL_FILE_HEADER.unpack_from(buffer)
+  if signature != ZIP_LOCAL_FILE_SIGNATURE:
+    raise ReportDecompressionError("The report download is not a ZIP archive")
+  data_offset = ZIP_LOCAL_FILE_HEADER.size + name_length + extra_length
+  buffer = _read_exactly(buffer, chunks, data_offset)[data_offset:]
+  data = itertools.chain([buffer], chunks)
+
+  crc = 0
+  if method == zipfile.ZIP_DEFLATED:
+    # A raw deflate stream knows where it ends, even when the sizes are only in the data descriptor
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    for chunk in data:
+      try:
+        inflated = decompressor.decompress(chunk)
+      except zlib.error as err:
+        raise ReportDecompressionError(f"Could not inflate the ZIP report download: {err}") from err
+      if inflated:
+        crc = zlib.crc32(inflated, crc)
+        yield inflated
+      if decompressor.eof:
+        break
+    if not decompressor.eof:
+      raise ReportDecompressionError("The ZIP report download ended unexpectedly")
+  elif method == zipfile.ZIP_STORED and not flags & ZIP_DATA_DESCRIPTOR_FLAG:
+    remaining = compressed_size
+    for chunk in data:
+      chunk = chunk[:remaining]
+      remaining -= len(chunk)
+      if chunk:
+        crc = zlib.crc32(chunk, crc)
+        yield chunk
+      if not remaining:
+        break
+    if remaining:
+      raise ReportDecompressionError("The ZIP report download ended unexpectedly")
+  else:
+    raise ReportDecompressionError(f"Unsupported ZIP compression method {method} in the report download")
+
+  if not flags & ZIP_DATA_DESCRIPTOR_FLAG and crc != expected_crc:
+    raise ReportDecompressionError("The ZIP report download is corrupted, its CRC-32 does not match")
+
+
+def iter_report_chunks(response: requests.models.Response,
+                       on_chunk: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+  # Plain CSV bytes of the report. gzip transfer encoding is undone by requests,
+  # ZIP reports are recognized by their signature and inflated on the fly.
+  return decode_report_chunks(iter_download_chunks(response, on_chunk))
+
+
+def decode_report_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+  chunks = iter(chunks)
+  first_chunk = next(chunks, b'')
+  chunks = itertools.chain([first_chunk], chunks)
+  if first_chunk.startswith(ZIP_LOCAL_FILE_SIGNATURE):
+    return iter_unzipped_chunks(chunks)
+  return chunks
+
+
+def generate_spooled_download(response: requests.models.Response,
+                              converters: Optional[Mapping[str, Callable[[str], Any]]] = None,
+                              on_chunk: Optional[Callable[[int], None]] = None,
+                              max_memory_bytes: int = 0) -> Iterator[Mapping[str, Any]]:
+  # Like SpooledTemporaryFile: keep the report in memory until max_memory_bytes of it were received,
+  # then move it to an anonymous temporary file. The decision counts the decoded report bytes, so it works
+  # for chunked responses without Content-Length and for compressed downloads.
+  # Either way the connection is released before parsing. A spooled report is parsed through a memory-mapped
+  # view so the page cache, not the heap, holds the data. The file has no name on disk, so it is gone
+  # as soon as it is closed, even if the sync crashes.
+  chunks = iter_report_chunks(response, on_chunk)
+  buffered_chunks = []
+  buffered_size = 0
+  spooled = False
+  try:
+    for chunk in chunks:
+      buffered_chunks.append(chunk)
+      buffered_size += len(chunk)
+      if buffered_size >= max_memory_bytes:
+        spooled = True
+        break
+  finally:
+    if not spooled:
+      response.close()
+  if not spooled:
+    yield from read_csv_rows(iter_text_lines(buffered_chunks, encoding='utf-8'), converters)
+    return
+
+  try:
+    spool_file = tempfile.TemporaryFile(prefix='yahoo_ads_report_')
+  except OSError as err:
+    response.close()
+    raise TmpFileIOError("Could not create a temporary file for the report download", str(err)) from err
+
+  with spool_file:
+    try:
+      for chunk in itertools.chain(buffered_chunks, chunks):
+        spool_file.write(chunk)
+      spool_file.flush()
+    except OSError as err:
+      raise TmpFileIOError("Could not write the report download to a temporary file", str(err)) from err
+    finally:
+      response.close()
+
+    # mmap cannot map an empty file
+    if spool_file.tell() == 0:
+      return
+
+    try:
+      mapped_file = mmap.mmap(spool_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as err:
+      raise TmpFileIOError("Could not memory-map the spooled report download", str(err)) from err
+
+    with mapped_file:
+      # '\n' never appears inside a multi-byte UTF-8 character, so every line can be decoded on its own
+      lines = (line.decode('utf-8') for line in iter(mapped_file.readline, b''))
+      yield from read_csv_rows(lines, converters)
+
+
+def generate_temp_download(response: requests.models.Response, spool_threshold_bytes: Optional[int] = None,
+                           converters: Optional[Mapping[str, Callable[[str], Any]]] = None,
+                           on_chunk: Optional[Callable[[int], None]] = None):
+  # Reports of at least spool_threshold_bytes go through a temporary file when spooling is enabled
+  if spool_threshold_bytes is not None:
+    yield from generate_spooled_download(response, converters, on_chunk, spool_threshold_bytes)
+    return
+
+  # Otherwise parse the CSV rows while the response body is still downloading,
+  # so only the current chunk and row are held in memory
+  lines = iter_text_lines(iter_report_chunks(response, on_chunk), encoding='utf-8')
+  yield from read_csv_rows(lines, converters)
+
+
+def iter_in_background(rows: Iterable[Any], max_queued_rows: int, name: str = 'yahoo-ads-download') -> Iterator[Any]:
+  # Produce the rows on a worker thread while the caller consumes them.
+  # The worker blocks once max_queued_rows are waiting, so memory stays bounded when the caller is slower.
+  # Errors of the worker are raised to the caller, closing this generator stops the worker.
+  # Queue a few batches, so the worker keeps going while the caller emits the current one
+  batch_size = max(1, min(BACKGROUND_BATCH_SIZE, max_queued_rows // 4))
+  batches = queue.Queue(maxsize=max(1, max_queued_rows // batch_size))
+  stopped = threading.Event()
+
+  def put(item: Any) -> bool:
+    while not stopped.is_set():
+      try:
+        batches.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce() -> None:
+    iterator = iter(rows)
+    try:
+      batch = []
+      for row in iterator:
+        batch.append(row)
+        if len(batch) >= batch_size:
+          if not put(batch):
+            return
+          batch = []
+      if batch and not put(batch):
+        return
+      put(_END_OF_ROWS)
+    except Exception as err:
+      put(err)
+    finally:
+      if hasattr(iterator, 'close'):
+        iterator.close()
+
+  worker = threading.Thread(target=produce, name=name, daemon=True)
+  worker.start()
+  try:
+    while True:
+      item = batches.get()
+      if item is _END_OF_ROWS:
+        return
+      if isinstance(item, Exception):
+        raise item
+      yield from item
+  finally:
+    stopped.set()
+    worker.join()
+
+
+def read_report_file(report_file: IO[bytes],
+                     converters: Optional[Mapping[str, Callable[[str], Any]]] = None) -> Iterator[Mapping[str, Any]]:
+  # Rows of a report downloaded to a file, e.g. by the async engine
+  report_file.seek(0)
+  chunks = iter(lambda: report_file.read(DOWNLOAD_CHUNK_SIZE), b'')
+  yield from read_csv_rows(iter_text_lines(decode_report_chunks(chunks), encoding='utf-8'), converters)
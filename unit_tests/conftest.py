@@ -0,0 +1,23 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import pytest
+from integration_tests.mock_server import MockYahooAdsServer
+
+from .helpers import FakeClock
+
+
+@pytest.fixture
+def clock(mocker):
+    # Time as seen by the poll schedule and the rate limiter, sleeping advances it instantly
+    fake_clock = FakeClock()
+    mocker.patch("source_yahoo_ads.polling.time", fake_clock)
+    mocker.patch("source_yahoo_ads.rate_limiting.time", fake_clock)
+    return fake_clock
+
+
+@pytest.fixture
+def mock_server():
+    with MockYahooAdsServer(rows_per_report=50) as server:
+        yield server
@@ -0,0 +1,35 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_response(status_code=200, json_body=None, headers=None, chunks=()):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = json_body
+    response.headers = headers or {}
+    response.text = str(json_body)
+    response.iter_content.return_value = iter(chunks)
+    return response
+
+
+def make_report_requests(count):
+    # One single-day YSS AD report request per day from 2023-01-01
+    days = [(datetime(2023, 1, 1) + timedelta(days=offset)).strftime("%Y%m%d") for offset in range(count)]
+    return [{"ads_type": "YSS", "stream": "AD", "account_id": "1000", "start_date": day, "end_date": day} for day in days]
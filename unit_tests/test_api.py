@@ -0,0 +1,86 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from datetime import datetime, timedelta, timezone
+
+from source_yahoo_ads.api import YAHOO_ADS_SEARCH, YahooAds
+
+
+def make_yahoo_ads(**kwargs):
+    return YahooAds(sync_option={"yss_account_id": "1000", "ydn_account_id": "2000"}, start_date="20230101", report_prepare_time_history_path=None, **kwargs)
+
+
+def test_max_concurrent_report_jobs_is_bounded_by_pool_size():
+    assert make_yahoo_ads().max_concurrent_report_jobs == YahooAds.MAX_CONCURRENT_REPORT_JOBS
+    assert make_yahoo_ads(max_concurrent_report_jobs=1000).max_concurrent_report_jobs == YahooAds.parallel_tasks_size
+
+
+def test_account_ids_merge_single_and_additional_accounts():
+    yahoo_ads = YahooAds(
+        sync_option={"yss_account_id": "1000", "yss_account_ids": ["1001", "1000", "1002"], "ydn_account_id": "2000"},
+        report_prepare_time_history_path=None,
+    )
+    assert yahoo_ads.get_account_ids("YSS") == ["1000", "1001", "1002"]
+    assert yahoo_ads.get_account_ids("YDN") == ["2000"]
+
+
+def test_remove_reports_batches_jobs_per_account(mocker):
+    yahoo_ads = make_yahoo_ads()
+    mocker.patch.object(YahooAds, "REMOVE_BATCH_SIZE", 2)
+    remove_report_batch = mocker.patch.object(
+        yahoo_ads, "_remove_report_batch", side_effect=lambda ads_type, account_id, report_job_ids: len(report_job_ids))
+    report_jobs = [
+        {"ads_type": "YSS", "account_id": "1000", "report_job_id": report_job_id, "report_job_status": report_job_status}
+        for report_job_id, report_job_status in [("1", "COMPLETED"), ("2", "FAILED"), ("3", "WAIT")]
+    ] + [
+        {"ads_type": "YDN", "account_id": "2000", "report_job_id": "4", "report_job_status": "COMPLETED"},
+        {"ads_type": "YDN", "account_id": "2000", "report_job_id": None, "report_job_status": "CACHED"},
+    ]
+    assert yahoo_ads.remove_reports(report_jobs) == 4
+    assert sorted(call.args for call in remove_report_batch.call_args_list) == [
+        ("YDN", "2000", ["4"]), ("YSS", "1000", ["1", "2"]), ("YSS", "1000", ["3"])]
+
+
+def test_sweep_stale_reports_only_removes_old_connector_reports(mocker):
+    yahoo_ads = make_yahoo_ads()
+    mocker.patch.object(yahoo_ads, "list_report_definitions", return_value=[
+        {"reportJobId": 1, "reportName": "YahooReport_YSS_AD_20230101_x", "requestTime": "2023-01-01 10:00:00"},
+        {"reportJobId": 2, "reportName": "YahooReport_YSS_AD_20230101_y", "requestTime": "2999-01-01 10:00:00"},
+        {"reportJobId": 3, "reportName": "Monthly report", "requestTime": "2023-01-01 10:00:00"},
+        {"reportJobId": 4, "reportName": "YahooReport_YSS_AD_20230101_z"},
+        {"reportJobId": 5, "reportName": "YahooReport_YSS_AD_20230101_w", "requestTime": "2023-01-01T10:00:00+09:00"},
+        {"reportJobId": 6, "reportName": "YahooReport_YSS_AD_20230101_v", "requestTime": "2023-01-01 10:00:00"},
+    ])
+    remove_reports = mocker.patch.object(yahoo_ads, "remove_reports", side_effect=lambda report_jobs: len(report_jobs))
+    assert yahoo_ads.sweep_stale_reports("YSS", "1000", 24, keep_report_job_ids=["6"]) == 2
+    assert [report_job["report_job_id"] for report_job in remove_reports.call_args.args[0]] == [1, 5]
+
+
+def test_report_request_time_is_read_in_japan_standard_time():
+    jst = timezone(timedelta(hours=9))
+    assert YahooAds._get_report_request_time({"requestTime": "2023-01-01 10:00:00"}) == datetime(2023, 1, 1, 10, tzinfo=jst)
+    assert YahooAds._get_report_request_time({"requestTime": "2023-01-01T10:00:00+09:00"}) == datetime(2023, 1, 1, 1, tzinfo=timezone.utc)
+    assert YahooAds._get_report_request_time({"requestTime": "20230101100000"}) == datetime(2023, 1, 1, 10, tzinfo=jst)
+    assert YahooAds._get_report_request_time({"requestTime": "unknown"}) is None
+
+
+def test_sweep_stale_reports_compares_request_times_with_their_offset(mocker):
+    yahoo_ads = make_yahoo_ads()
+    # Two hours ago in Japan, which a naive comparison on a UTC host would read as seven hours in the future
+    requested_at = datetime.now(timezone(timedelta(hours=9))) - timedelta(hours=2)
+    mocker.patch.object(yahoo_ads, "list_report_definitions", return_value=[
+        {"reportJobId": 1, "reportName": "YahooReport_YSS_AD_20230101_x", "requestTime": requested_at.strftime("%Y-%m-%d %H:%M:%S")},
+        {"reportJobId": 2, "reportName": "YahooReport_YSS_AD_20230101_y", "requestTime": requested_at.isoformat()},
+    ])
+    remove_reports = mocker.patch.object(yahoo_ads, "remove_reports", side_effect=lambda report_jobs: len(report_jobs))
+    assert yahoo_ads.sweep_stale_reports("YSS", "1000", 1) == 2
+    assert yahoo_ads.sweep_stale_reports("YSS", "1000", 3) == 0
+    assert remove_reports.call_count == 1
+
+
+def test_report_fields_follow_the_selected_columns():
+    yahoo_ads = make_yahoo_ads()
+    assert yahoo_ads.get_report_fields("YSS", "AD") == [item["request_name"] for item in YAHOO_ADS_SEARCH["AD"]]
+    assert yahoo_ads.get_report_fields("YSS", "AD", ["コスト", "日", "unknown"], ["広告ID", "日", "デバイス"]) == [
+        "ACCOUNT_ID", "DAY", "DEVICE", "AD_ID", "COST"]
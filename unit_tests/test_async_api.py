@@ -0,0 +1,108 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import time
+from unittest import mock
+
+import pytest
+from integration_tests.benchmark import make_catalog, make_config, run_read
+from integration_tests.mock_server import MockYahooAdsServer, use_mock_server
+from source_yahoo_ads.api import YahooAds
+from source_yahoo_ads.async_api import AsyncYahooAdsRunner
+
+from .helpers import make_report_requests
+
+pytest.importorskip("httpx")
+
+
+@pytest.fixture
+def runner(mock_server):
+    with use_mock_server(mock_server.base_url), mock.patch.object(YahooAds, "REPORT_PREPARE_TIME", 0.01):
+        yahoo_ads = YahooAds(sync_option={"yss_account_id": "1000"}, report_prepare_time_history_path=None)
+        runner = AsyncYahooAdsRunner(yahoo_ads)
+        try:
+            yield runner
+        finally:
+            runner.close()
+
+
+def test_login_is_shared_with_the_sync_client(runner, mock_server):
+    access_token = runner.login()
+    assert access_token
+    assert runner.login() == access_token
+    assert runner.engine.yahoo_ads.token_manager.get_valid_access_token() == access_token
+    assert mock_server.mock_api.request_counts["token"] == 1
+
+
+def test_prefetched_jobs_of_an_account_are_polled_together(runner, mock_server):
+    report_requests = make_report_requests(5)
+    report_jobs = runner.prefetch_report_jobs(report_requests)
+    try:
+        prepared_jobs = [report_jobs.get(index) for index in range(5)]
+    finally:
+        report_jobs.close()
+    assert [report_job["start_date"] for report_job in prepared_jobs] == [request["start_date"] for request in report_requests]
+    assert all(report_job["report_job_status"] == "COMPLETED" for report_job in prepared_jobs)
+    assert mock_server.mock_api.request_counts["add"] == 5
+    # The jobs of one account are polled together
+    assert mock_server.mock_api.request_counts["get"] < 5 * 3
+
+
+def test_download_and_remove_report(runner, mock_server):
+    report_jobs = runner.prefetch_report_jobs([{"ads_type": "YSS", "stream": "AD", "start_date": "20230101", "end_date": "20230102"}])
+    try:
+        report_job = report_jobs.get(0)
+    finally:
+        report_jobs.close()
+    rows = list(runner.download_report_rows(report_job))
+    assert len(rows) == 50
+    assert "広告ID" in rows[0]
+    assert runner.remove_report("YSS", report_job["report_job_id"], report_job["account_id"], report_job["stream"])
+    assert not mock_server.mock_api.jobs
+
+
+def test_read_with_async_engine(mock_server):
+    config = make_config("YSS", days=3, report_window_days=2, async_engine=True)
+    result = run_read(mock_server.base_url, config, make_catalog("YSS"), report_prepare_time=0.01)
+    request_counts = mock_server.mock_api.request_counts
+    assert result["records"] == 3 * 2 * 50
+    assert request_counts["add"] == request_counts["download"] == 6
+    # All reports of the account are removed with one request
+    assert request_counts["remove"] == 1
+    assert not mock_server.mock_api.jobs
+
+
+def make_runner(**kwargs):
+    yahoo_ads = YahooAds(sync_option={"yss_account_id": "1000"}, report_prepare_time_history_path=None, **kwargs)
+    return AsyncYahooAdsRunner(yahoo_ads)
+
+
+def test_prefetched_jobs_are_bounded_until_taken(mock_server):
+    with use_mock_server(mock_server.base_url), mock.patch.object(YahooAds, "REPORT_PREPARE_TIME", 0.01):
+        runner = make_runner(max_concurrent_report_jobs=1, prefetch_reports=1)
+        try:
+            report_jobs = runner.prefetch_report_jobs(make_report_requests(5))
+            time.sleep(0.5)
+            assert mock_server.mock_api.request_counts["add"] == 2
+            assert [report_jobs.get(index)["start_date"] for index in range(5)] == [f"2023010{day}" for day in range(1, 6)]
+            report_jobs.close()
+            assert len(report_jobs.created_report_jobs) == 5
+        finally:
+            runner.close()
+
+
+def test_close_keeps_jobs_whose_add_request_was_sent():
+    with MockYahooAdsServer(rows_per_report=20, latency=0.3) as server, use_mock_server(server.base_url):
+        runner = make_runner()
+        try:
+            runner.login()
+            report_jobs = runner.prefetch_report_jobs(make_report_requests(1))
+            # The add request is waiting for its response
+            time.sleep(0.1)
+            report_jobs.close()
+            assert len(server.mock_api.jobs) == 1
+            assert [report_job["report_job_id"] for report_job in report_jobs.created_report_jobs] == [
+                str(report_job_id) for report_job_id in server.mock_api.jobs]
+        finally:
+            runner.close()
@@ -0,0 +1,46 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import os
+from unittest.mock import MagicMock
+
+from source_yahoo_ads.auth import YahooAdsAuthenticator, YahooAdsTokenManager
+
+
+def make_token_manager(cache_path=None):
+    fetch_token = MagicMock(side_effect=[{"access_token": "token-1", "expires_in": 3600}, {"access_token": "token-2", "expires_in": 3600}])
+    return YahooAdsTokenManager(fetch_token, client_id="client", refresh_token="refresh", cache_path=cache_path)
+
+
+def test_token_is_cached_until_it_is_about_to_expire(mocker):
+    clock = mocker.patch("source_yahoo_ads.auth.time.time", return_value=1000.0)
+    token_manager = make_token_manager()
+
+    assert token_manager.get_access_token() == "token-1"
+    clock.return_value = 1000.0 + 3600 - YahooAdsTokenManager.REFRESH_MARGIN - 1
+    assert token_manager.get_access_token() == "token-1"
+    assert token_manager.refresh_count == 1
+
+    clock.return_value = 1000.0 + 3600 - YahooAdsTokenManager.REFRESH_MARGIN
+    assert token_manager.get_access_token() == "token-2"
+    assert token_manager.refresh_count == 2
+
+
+def test_token_is_shared_through_the_disk_cache(tmp_path):
+    cache_path = str(tmp_path / "tokens.json")
+    assert make_token_manager(cache_path).get_access_token() == "token-1"
+
+    second_run = make_token_manager(cache_path)
+    assert second_run.get_access_token() == "token-1"
+    assert second_run.refresh_count == 0
+    assert "refresh" not in open(cache_path).read()
+    assert oct(os.stat(cache_path).st_mode & 0o777) == "0o600"
+
+
+def test_authenticator_uses_current_token():
+    token_manager = make_token_manager()
+    authenticator = YahooAdsAuthenticator(token_manager)
+    assert authenticator.get_auth_header() == {"Authorization": "Bearer token-1"}
+    token_manager.invalidate()
+    assert authenticator.get_auth_header() == {"Authorization": "Bearer token-2"}
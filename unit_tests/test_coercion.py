@@ -0,0 +1,48 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from source_yahoo_ads.coercion import compile_coercion_plan, to_integer, to_number
+from source_yahoo_ads.streams import YdnAd, YssAd
+from source_yahoo_ads.utils import read_csv_rows
+
+SCHEMA = {
+    "properties": {
+        "日": {"type": ["string", "null"]},
+        "広告ID": {"type": ["integer", "null"]},
+        "コスト": {"type": ["integer", "null"]},
+        "クリック率": {"type": ["number", "null"]},
+    }
+}
+
+
+def test_compile_coercion_plan_only_keeps_typed_columns():
+    assert compile_coercion_plan(SCHEMA) == {"広告ID": to_integer, "コスト": to_integer, "クリック率": to_number}
+
+
+def test_read_csv_rows_converts_typed_columns_and_null_markers():
+    lines = ["日,広告ID,コスト,クリック率\n", "2023-01-01,10,\"1,200\",0.5\n", "2023-01-02,11,--,\n"]
+    rows = list(read_csv_rows(lines, compile_coercion_plan(SCHEMA)))
+    assert rows == [
+        {"日": "2023-01-01", "広告ID": 10, "コスト": 1200, "クリック率": 0.5},
+        {"日": "2023-01-02", "広告ID": 11, "コスト": None, "クリック率": None},
+    ]
+
+
+def test_unparseable_values_are_kept_as_strings():
+    assert to_integer("n/a") == "n/a"
+    assert to_number("12.5%") == 12.5
+
+
+def test_fractional_values_of_integer_columns_are_not_truncated():
+    assert to_integer("1,234") == 1234
+    assert to_integer("12.0") == 12
+    assert to_integer("12.75") == "12.75"
+    assert YdnAd().coercion_plan["コンバージョン数"] is to_number
+
+
+def test_stream_coercion_plan_follows_its_schema():
+    plan = YssAd().coercion_plan
+    assert plan["キャンペーンID"] is to_integer
+    assert plan["コンバージョン率"] is to_number
+    assert "キャンペーン名" not in plan
@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from datetime import datetime, timedelta
+
+from airbyte_cdk.models import SyncMode
+from integration_tests.mock_server import MockYahooAdsServer, use_mock_server
+from source_yahoo_ads.api import YahooAds
+from source_yahoo_ads.auth import YahooAdsAuthenticator
+from source_yahoo_ads.dedup import PrimaryKeyDeduplicator
+from source_yahoo_ads.streams import YssAd
+
+PRIMARY_KEY = ["広告ID", "日", "デバイス"]
+
+
+def make_record(day, ad_id, device="PC", account_id="1000"):
+    return {"アカウントID": account_id, "日": day, "広告ID": ad_id, "デバイス": device, "コスト": 100}
+
+
+def test_drops_rows_with_an_emitted_primary_key():
+    deduplicator = PrimaryKeyDeduplicator(PRIMARY_KEY, window_days=7)
+    assert not deduplicator.is_duplicate(make_record("2023-01-01", 1))
+    assert not deduplicator.is_duplicate(make_record("2023-01-01", 1, device="SMARTPHONE"))
+    assert not deduplicator.is_duplicate(make_record("2023-01-02", 1))
+    assert not deduplicator.is_duplicate(make_record("2023-01-01", 1, account_id="2000"))
+    assert deduplicator.is_duplicate({**make_record("2023-01-01", 1), "コスト": 200})
+    assert deduplicator.duplicate_count == 1
+
+
+def test_forgets_days_outside_the_window():
+    deduplicator = PrimaryKeyDeduplicator(PRIMARY_KEY, window_days=2)
+    for day in range(1, 11):
+        for ad_id in range(100):
+            deduplicator.is_duplicate(make_record(f"2023-01-{day:02d}", ad_id))
+
+    # Only the latest day and the 2 before it are remembered
+    assert sorted(day for _, day in deduplicator.fingerprints) == ["20230108", "20230109", "20230110"]
+    assert sum(len(fingerprints) for fingerprints in deduplicator.fingerprints.values()) == 300
+    assert deduplicator.is_duplicate(make_record("2023-01-08", 1))
+    assert not deduplicator.is_duplicate(make_record("2023-01-07", 1))
+
+
+def test_weekly_and_monthly_rows_are_bucketed_and_forgotten_by_period():
+    start = datetime(2020, 1, 6)
+    deduplicator = PrimaryKeyDeduplicator(["広告ID", "週"], window_days=14, time_column="週", time_unit="WEEK")
+    for week in range(200):
+        day = (start + timedelta(weeks=week)).strftime("%Y-%m-%d")
+        for ad_id in range(10):
+            assert not deduplicator.is_duplicate({"アカウントID": "1000", "週": day, "広告ID": ad_id})
+    # The latest week and the two before it
+    assert len(deduplicator.fingerprints) == 3
+    latest_week = (start + timedelta(weeks=199)).strftime("%Y-%m-%d")
+    assert deduplicator.is_duplicate({"アカウントID": "1000", "週": latest_week, "広告ID": 1})
+
+    deduplicator = PrimaryKeyDeduplicator(["広告ID", "月"], window_days=7, time_column="月", time_unit="MONTH")
+    for year in range(2020, 2025):
+        for month in range(1, 13):
+            assert not deduplicator.is_duplicate({"アカウントID": "1000", "月": f"{year}-{month:02d}", "広告ID": 1})
+    assert sorted(period for _, period in deduplicator.fingerprints) == ["20241101", "20241201"]
+    assert deduplicator.is_duplicate({"アカウントID": "1000", "月": "2024-11", "広告ID": 1})
+    assert not deduplicator.is_duplicate({"アカウントID": "1000", "月": "2024-10", "広告ID": 1})
+
+
+def test_stream_drops_rows_of_overlapping_windows():
+    with MockYahooAdsServer(rows_per_report=30) as server, use_mock_server(server.base_url):
+        yahoo_ads = YahooAds(sync_option={"yss_account_id": "1000"}, report_prepare_time_history_path=None)
+        report_jobs = [
+            {**yahoo_ads.create_report("YSS", "AD", start_date, end_date), "report_job_status": "COMPLETED"}
+            for start_date, end_date in [("20230101", "20230102"), ("20230102", "20230103")]
+        ]
+        stream = YssAd(report_jobs=report_jobs, authenticator=YahooAdsAuthenticator(yahoo_ads.token_manager),
+                       dedup_window_days=7, metrics=yahoo_ads.metrics)
+        records = [
+            record
+            for stream_slice in stream.stream_slices(SyncMode.full_refresh)
+            for record in stream.read_records(SyncMode.full_refresh, stream_slice=stream_slice)
+        ]
+
+    # 15 rows per day, 2023-01-02 is in both reports
+    assert len(records) == 45
+    assert len({tuple(record[field] for field in PRIMARY_KEY) for record in records}) == 45
+    assert yahoo_ads.metrics.get("duplicate_rows", "yss_ad", report_jobs[1]["report_job_id"]) == 15
@@ -5,55 +5,89 @@
 
 from airbyte_cdk.models import SyncMode
 from pytest import fixture
-from source_yahoo_ads.source import IncrementalYahooAdsStream
+from source_yahoo_ads.streams import IncrementalYahooSearchAdsStream, YdnAd, YssAd
 
 
 @fixture
 def patch_incremental_base_class(mocker):
     # Mock abstract methods to enable instantiating abstract class
-    mocker.patch.object(IncrementalYahooAdsStream, "path", "v0/example_endpoint")
-    mocker.patch.object(IncrementalYahooAdsStream, "primary_key", "test_primary_key")
-    mocker.patch.object(IncrementalYahooAdsStream, "__abstractmethods__", set())
+    mocker.patch.object(IncrementalYahooSearchAdsStream, "primary_key", "test_primary_key")
+    mocker.patch.object(IncrementalYahooSearchAdsStream, "__abstractmethods__", set())
+
+
+def make_report_job(report_job_id, start_date, end_date):
+    return {
+        "ads_type": "YSS",
+        "stream": "AD",
+        "account_id": "1000",
+        "report_job_id": report_job_id,
+        "report_job_status": "COMPLETED",
+        "start_date": start_date,
+        "end_date": end_date,
+    }
 
 
 def test_cursor_field(patch_incremental_base_class):
-    stream = IncrementalYahooAdsStream()
-    # TODO: replace this with your expected cursor field
-    expected_cursor_field = []
-    assert stream.cursor_field == expected_cursor_field
+    assert IncrementalYahooSearchAdsStream().cursor_field == []
+    assert YssAd().cursor_field == "日"
+
+
+def test_get_updated_state():
+    stream = YssAd()
+    assert stream.get_updated_state(current_stream_state={}, latest_record={"日": "2023-01-05"}) == {"日": "20230105"}
+    assert stream.get_updated_state(current_stream_state={"日": "20230110"}, latest_record={"日": "2023-01-05"}) == {"日": "20230110"}
+    assert stream.get_updated_state(current_stream_state={"日": "20230110"}, latest_record={"日": "2023-01-12"}) == {"日": "20230112"}
+
+
+def test_get_report_start_date_applies_lookback():
+    stream = YdnAd()
+    assert stream.get_report_start_date("20230101", {}, lookback_window_days=7) == "20230101"
+    assert stream.get_report_start_date("20230101", {"日": "20230310"}, lookback_window_days=7) == "20230303"
+    # Never go back before the configured start date
+    assert stream.get_report_start_date("20230101", {"日": "20230103"}, lookback_window_days=7) == "20230101"
+
+
+def test_get_updated_state_tracks_each_account():
+    stream = YssAd()
+    state = stream.get_updated_state(current_stream_state={}, latest_record={"日": "2023-01-05", "アカウントID": "1000"})
+    state = stream.get_updated_state(current_stream_state=state, latest_record={"日": "2023-01-03", "アカウントID": "1001"})
+    assert state == {"日": "20230105", "accounts": {"1000": "20230105", "1001": "20230103"}}
+
+
+def test_get_updated_state_keeps_accounts_of_earlier_slices():
+    stream = YssAd()
+    # The CDK passes the initial state with every record
+    stream.get_updated_state(current_stream_state={}, latest_record={"日": "2023-01-05", "アカウントID": "1000"})
+    state = stream.get_updated_state(current_stream_state={}, latest_record={"日": "2023-01-03", "アカウントID": "1001"})
+    assert state == {"日": "20230105", "accounts": {"1000": "20230105", "1001": "20230103"}}
 
 
-def test_get_updated_state(patch_incremental_base_class):
-    stream = IncrementalYahooAdsStream()
-    # TODO: replace this with your input parameters
-    inputs = {"current_stream_state": None, "latest_record": None}
-    # TODO: replace this with your expected updated stream state
-    expected_state = {}
-    assert stream.get_updated_state(**inputs) == expected_state
+def test_get_report_start_date_per_account():
+    stream = YssAd()
+    state = {"日": "20230310", "accounts": {"1000": "20230310"}}
+    assert stream.get_report_start_date("20230101", state, lookback_window_days=7, account_id="1000") == "20230303"
+    # An account added after the last sync starts from the configured start date
+    assert stream.get_report_start_date("20230101", state, lookback_window_days=7, account_id="1001") == "20230101"
 
 
-def test_stream_slices(patch_incremental_base_class):
-    stream = IncrementalYahooAdsStream()
-    # TODO: replace this with your input parameters
-    inputs = {"sync_mode": SyncMode.incremental, "cursor_field": [], "stream_state": {}}
-    # TODO: replace this with your expected stream slices list
-    expected_stream_slice = [None]
-    assert stream.stream_slices(**inputs) == expected_stream_slice
+def test_stream_slices():
+    report_jobs = [make_report_job("1", "20230101", "20230107"), make_report_job("2", "20230108", "20230110")]
+    stream = YssAd(report_jobs=report_jobs)
+    inputs = {"sync_mode": SyncMode.incremental, "cursor_field": ["日"], "stream_state": {}}
+    expected_stream_slices = [
+        {"account_id": "1000", "report_job_id": "1", "report_job_status": "COMPLETED", "start_date": "20230101", "end_date": "20230107"},
+        {"account_id": "1000", "report_job_id": "2", "report_job_status": "COMPLETED", "start_date": "20230108", "end_date": "20230110"},
+    ]
+    assert list(stream.stream_slices(**inputs)) == expected_stream_slices
 
 
-def test_supports_incremental(patch_incremental_base_class, mocker):
-    mocker.patch.object(IncrementalYahooAdsStream, "cursor_field", "dummy_field")
-    stream = IncrementalYahooAdsStream()
-    assert stream.supports_incremental
+def test_supports_incremental():
+    assert YssAd().supports_incremental
 
 
-def test_source_defined_cursor(patch_incremental_base_class):
-    stream = IncrementalYahooAdsStream()
-    assert stream.source_defined_cursor
+def test_source_defined_cursor():
+    assert YssAd().source_defined_cursor
 
 
-def test_stream_checkpoint_interval(patch_incremental_base_class):
-    stream = IncrementalYahooAdsStream()
-    # TODO: replace this with your expected checkpoint interval
-    expected_checkpoint_interval = None
-    assert stream.state_checkpoint_interval == expected_checkpoint_interval
+def test_stream_checkpoint_interval():
+    assert YssAd().state_checkpoint_interval is None
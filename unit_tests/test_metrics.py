@@ -0,0 +1,54 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from source_yahoo_ads.metrics import SyncMetrics, stream_name
+
+
+def test_stream_name():
+    assert stream_name("YSS", "AD_CONVERSION") == "yss_ad_conversion"
+
+
+def test_timer_records_seconds_and_count():
+    metrics = SyncMetrics()
+    with metrics.timer("add_report", "yss_ad"):
+        pass
+    with metrics.timer("add_report", "yss_ad"):
+        pass
+    assert metrics.get("add_report_count", "yss_ad") == 2
+    assert metrics.get("add_report_seconds", "yss_ad") >= 0
+
+
+def test_timed_records_counts_rows_even_when_the_consumer_stops_early():
+    metrics = SyncMetrics()
+    records = metrics.timed_records(iter([{"a": 1}, {"a": 2}, {"a": 3}]), "yss_ad", "1")
+    assert next(records) == {"a": 1}
+    assert next(records) == {"a": 2}
+    records.close()
+    assert metrics.get("rows", "yss_ad", "1") == 1
+    assert metrics.get("download_seconds", "yss_ad", "1") >= 0
+
+
+def test_summary_groups_by_stream_and_report_job():
+    metrics = SyncMetrics()
+    metrics.add("login_count")
+    metrics.add("rows", 100, "yss_ad", "1")
+    metrics.add("download_seconds", 0.5, "yss_ad", "1")
+    summary = metrics.summary()
+    assert {"stream": None, "report_job_id": None, "login_count": 1} in summary
+    assert {"stream": "yss_ad", "report_job_id": "1", "rows": 100, "download_seconds": 0.5, "rows_per_second": 200.0} in summary
+
+
+def test_write_prometheus_totals_per_stream(tmp_path):
+    metrics = SyncMetrics()
+    metrics.add("download_bytes", 12345678, "yss_ad", "1")
+    metrics.add("download_bytes", 2, "yss_ad", "2")
+    metrics.add("poll_wait_seconds", 1.5)
+    path = tmp_path / "yahoo_ads.prom"
+    metrics.write_prometheus(str(path))
+    assert path.read_text().splitlines() == [
+        "# TYPE yahoo_ads_download_bytes gauge",
+        'yahoo_ads_download_bytes{stream="yss_ad"} 12345680',
+        "# TYPE yahoo_ads_poll_wait_seconds gauge",
+        "yahoo_ads_poll_wait_seconds 1.5",
+    ]
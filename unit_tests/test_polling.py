@@ -0,0 +1,205 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from source_yahoo_ads.exceptions import ReportPreparationTimeout
+from source_yahoo_ads.polling import PollPolicy, PrepareTimeHistory, ReportJobPoller, ReportJobPrefetcher
+
+from .helpers import make_report_requests
+
+
+def make_report_job(report_job_id, ads_type="YSS", account_id="1000", stream="AD"):
+    return {
+        "ads_type": ads_type,
+        "stream": stream,
+        "account_id": account_id,
+        "report_job_id": report_job_id,
+        "report_job_status": "WAIT",
+    }
+
+
+def fake_get_reports(statuses_per_cycle):
+    cycles = iter(statuses_per_cycle)
+
+    def get_reports(ads_type, account_id, report_job_ids):
+        statuses = next(cycles)
+        return [{"reportJobId": job_id, "reportJobStatus": statuses[job_id]} for job_id in report_job_ids]
+
+    return get_reports
+
+
+def test_poll_checks_all_jobs_of_an_account_in_one_request(clock):
+    yahoo_ads = MagicMock()
+    yahoo_ads.get_reports.side_effect = fake_get_reports(
+        [
+            {"1": "IN_PROGRESS", "2": "COMPLETED", "3": "WAIT"},
+            {"1": "COMPLETED", "3": "FAILED"},
+        ]
+    )
+    poller = ReportJobPoller(yahoo_ads, PollPolicy(jitter=0))
+    for report_job_id in ["1", "2", "3"]:
+        poller.track(make_report_job(report_job_id))
+
+    finished = [(job["report_job_id"], job["report_job_status"]) for job in poller.poll()]
+
+    assert finished == [("2", "COMPLETED"), ("1", "COMPLETED"), ("3", "FAILED")]
+    assert poller.get_request_count == 2
+    assert yahoo_ads.get_reports.call_args_list[1].args == ("YSS", "1000", ["1", "3"])
+
+
+def test_poll_groups_jobs_per_account(clock):
+    yahoo_ads = MagicMock()
+    yahoo_ads.get_reports.side_effect = lambda ads_type, account_id, report_job_ids: [
+        {"reportJobId": job_id, "reportJobStatus": "COMPLETED"} for job_id in report_job_ids
+    ]
+    poller = ReportJobPoller(yahoo_ads, PollPolicy(jitter=0))
+    poller.track(make_report_job("1"))
+    poller.track(make_report_job("2"))
+    poller.track(make_report_job("3", ads_type="YDN", account_id="2000"))
+
+    assert len(list(poller.poll())) == 3
+    assert poller.get_request_count == 2
+    assert poller.pending_count == 0
+
+
+def test_poll_interval_is_capped(clock):
+    yahoo_ads = MagicMock()
+    yahoo_ads.get_reports.side_effect = fake_get_reports([{"1": "WAIT"}] * 5 + [{"1": "COMPLETED"}])
+    poller = ReportJobPoller(yahoo_ads, PollPolicy(initial_interval=5, max_interval=15, jitter=0))
+    poller.track(make_report_job("1"))
+
+    list(poller.poll())
+
+    assert clock.sleeps == [5, 10, 15, 15, 15]
+
+
+def test_poll_raises_after_deadline(clock):
+    yahoo_ads = MagicMock()
+    yahoo_ads.get_reports.return_value = [{"reportJobId": "1", "reportJobStatus": "IN_PROGRESS"}]
+    poller = ReportJobPoller(yahoo_ads, PollPolicy(initial_interval=5, max_interval=15, jitter=0, timeout=40))
+    poller.track(make_report_job("1"))
+
+    with pytest.raises(ReportPreparationTimeout):
+        list(poller.poll())
+    assert clock.now == 40
+
+
+def test_first_poll_uses_learned_prepare_time(clock, tmp_path):
+    history_path = str(tmp_path / "history.json")
+    history = PrepareTimeHistory(history_path)
+    history.record(make_report_job("0"), 40)
+    history.save()
+
+    yahoo_ads = MagicMock()
+    yahoo_ads.get_reports.return_value = [{"reportJobId": "1", "reportJobStatus": "COMPLETED"}]
+    poller = ReportJobPoller(yahoo_ads, PollPolicy(jitter=0), PrepareTimeHistory(history_path))
+    poller.track(make_report_job("1"))
+    list(poller.poll())
+
+    assert clock.sleeps == [40 * PrepareTimeHistory.EARLY_RATIO]
+    assert poller.get_request_count == 1
+
+
+@pytest.mark.parametrize("content", ['{"YSS_AD_1000": 4', '{"YSS_AD_1000": null}', "[1, 2]"])
+def test_corrupt_prepare_time_history_is_ignored_and_replaced(tmp_path, content):
+    history_path = tmp_path / "history.json"
+    history_path.write_text(content)
+    history = PrepareTimeHistory(str(history_path))
+    assert history.prepare_times == {}
+
+    history.record(make_report_job("0"), 40)
+    history.save()
+    assert PrepareTimeHistory(str(history_path)).prepare_times == {"YSS_AD_1000": 40}
+    # Written through a temporary file that is renamed over the history
+    assert [path.name for path in tmp_path.iterdir()] == ["history.json"]
+
+
+def make_prefetcher_yahoo_ads(create_report=None):
+    yahoo_ads = MagicMock()
+    yahoo_ads.create_report.side_effect = create_report or (lambda **report_request: make_report_job(
+        report_request["start_date"], report_request["ads_type"], report_request["account_id"], report_request["stream"]))
+    yahoo_ads.get_reports.side_effect = lambda ads_type, account_id, report_job_ids: [
+        {"reportJobId": job_id, "reportJobStatus": "COMPLETED"} for job_id in report_job_ids
+    ]
+    return yahoo_ads
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_prefetcher_keeps_a_bounded_number_of_reports_ahead():
+    yahoo_ads = make_prefetcher_yahoo_ads()
+    prefetcher = ReportJobPrefetcher(yahoo_ads, make_report_requests(6), max_concurrent_report_jobs=2, max_ready_reports=1,
+                                     poll_policy=PollPolicy(initial_interval=0.01, jitter=0))
+    prefetcher.start()
+    try:
+        wait_for(lambda: len(prefetcher.ready) == 3)
+        time.sleep(0.05)
+        # 2 preparing at once plus 1 kept ready
+        assert yahoo_ads.create_report.call_count == 3
+
+        report_jobs = [prefetcher.get(index) for index in range(6)]
+    finally:
+        prefetcher.close()
+
+    assert [report_job["report_job_id"] for report_job in report_jobs] == [f"2023010{day}" for day in range(1, 7)]
+    assert all(report_job["report_job_status"] == "COMPLETED" for report_job in report_jobs)
+    assert len(prefetcher.created_report_jobs) == 6
+
+
+def test_prefetcher_skips_released_reports():
+    yahoo_ads = make_prefetcher_yahoo_ads()
+    prefetcher = ReportJobPrefetcher(yahoo_ads, make_report_requests(6), max_concurrent_report_jobs=1, max_ready_reports=0,
+                                     poll_policy=PollPolicy(initial_interval=0.01, jitter=0))
+    prefetcher.start()
+    try:
+        prefetcher.get(0)
+        prefetcher.release(range(3))
+        assert prefetcher.get(4)["report_job_id"] == "20230105"
+    finally:
+        prefetcher.close()
+
+    # 1 and 2 were released and 3 was skipped by the reader before they were created
+    assert [report_job["report_job_id"] for report_job in prefetcher.created_report_jobs] in (
+        ["20230101", "20230105"], ["20230101", "20230102", "20230105"])
+
+
+def test_prefetcher_raises_errors_to_the_reader():
+    def create_report(**report_request):
+        raise RuntimeError("add failed")
+
+    prefetcher = ReportJobPrefetcher(make_prefetcher_yahoo_ads(create_report), make_report_requests(2)).start()
+    try:
+        with pytest.raises(RuntimeError, match="add failed"):
+            prefetcher.get(0)
+    finally:
+        prefetcher.close()
+
+
+def test_prefetcher_hands_out_resumed_jobs_without_polling_them():
+    yahoo_ads = make_prefetcher_yahoo_ads()
+    report_requests = make_report_requests(2)
+    report_requests[0].update({"report_job_id": "resumed", "report_job_status": "COMPLETED"})
+    prefetcher = ReportJobPrefetcher(yahoo_ads, report_requests, max_concurrent_report_jobs=1, max_ready_reports=0,
+                                     poll_policy=PollPolicy(initial_interval=0.01, jitter=0)).start()
+    try:
+        assert prefetcher.get(0)["report_job_id"] == "resumed"
+        assert prefetcher.get(1)["report_job_status"] == "COMPLETED"
+    finally:
+        prefetcher.close()
+
+    assert prefetcher.error is None
+    assert yahoo_ads.create_report.call_count == 1
+    assert all("resumed" not in call.args[2] for call in yahoo_ads.get_reports.call_args_list)
+
+
+def test_seconds_until_next_poll_without_pending_jobs(clock):
+    assert ReportJobPoller(MagicMock()).seconds_until_next_poll() == 0
@@ -0,0 +1,77 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from source_yahoo_ads.api import YahooAds
+from source_yahoo_ads.rate_limiting import TokenBucket, YahooAdsRateLimiter, is_request_limit_exceeded
+
+from .helpers import make_response
+
+ADD_URL = "https://ads-search.yahooapis.jp/api/v10/ReportDefinitionService/add"
+DOWNLOAD_URL = "https://ads-search.yahooapis.jp/api/v10/ReportDefinitionService/download"
+
+
+def limit_exceeded_response(headers=None):
+    return make_response(403, [{"errorCode": "REQUEST_LIMIT_EXCEEDED", "message": "limit"}], headers)
+
+
+def test_token_bucket_allows_a_burst_then_paces_requests(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+
+
+def test_token_bucket_pause_waits_for_the_window_and_slows_down(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.pause(60)
+    assert bucket.rate == 1
+    assert bucket.acquire() == 60
+    assert bucket.reserve() == 1
+    bucket.recover()
+    assert bucket.rate == 1.1
+
+
+def test_is_request_limit_exceeded():
+    assert is_request_limit_exceeded(limit_exceeded_response())
+    assert not is_request_limit_exceeded(make_response(403, [{"errorCode": "NO_PERMISSION"}]))
+    assert not is_request_limit_exceeded(make_response(500, [{"errorCode": "REQUEST_LIMIT_EXCEEDED"}]))
+    assert not is_request_limit_exceeded(None)
+
+
+def test_rate_limiter_keeps_a_budget_per_endpoint(clock):
+    rate_limiter = YahooAdsRateLimiter(requests_per_second=1, endpoint_requests_per_second={"download": 10})
+    assert rate_limiter.bucket(ADD_URL).rate == 1
+    assert rate_limiter.bucket(DOWNLOAD_URL).rate == 10
+    assert rate_limiter.bucket(ADD_URL) is not rate_limiter.bucket(ADD_URL.replace("ads-search", "ads-display"))
+
+
+def test_rate_limiter_does_not_throttle_downloads_by_default(clock):
+    rate_limiter = YahooAdsRateLimiter(requests_per_second=1)
+    assert [rate_limiter.reserve(DOWNLOAD_URL) for _ in range(28)] == [0.0] * 28
+    assert rate_limiter.bucket(DOWNLOAD_URL) is None
+    # Until Yahoo reports an exhausted quota for them
+    assert rate_limiter.on_limit_exceeded(DOWNLOAD_URL, limit_exceeded_response({"Retry-After": "12"})) == 12
+    assert rate_limiter.reserve(DOWNLOAD_URL) == 12
+
+
+def test_rate_limiter_uses_retry_after(clock):
+    rate_limiter = YahooAdsRateLimiter()
+    assert rate_limiter.on_limit_exceeded(ADD_URL, limit_exceeded_response({"Retry-After": "12"})) == 12
+    assert rate_limiter.on_limit_exceeded(ADD_URL, limit_exceeded_response()) == YahooAdsRateLimiter.LIMIT_EXCEEDED_WAIT
+
+
+def test_make_request_waits_out_request_limit_exceeded(clock):
+    yahoo_ads = YahooAds(sync_option={"yss_account_id": "1000"}, report_prepare_time_history_path=None)
+    limited = limit_exceeded_response({"Retry-After": "30"})
+    limited.raise_for_status.side_effect = requests.HTTPError(response=limited)
+    succeeded = make_response(200, {"rval": {}})
+    yahoo_ads.session = MagicMock()
+    yahoo_ads.session.post.side_effect = [limited, succeeded]
+
+    assert yahoo_ads._make_request(http_method="POST", url=ADD_URL, body="{}") is succeeded
+    assert yahoo_ads.session.post.call_count == 2
+    assert clock.sleeps == [30]
+    assert yahoo_ads.rate_limiter.limit_exceeded_count == 1
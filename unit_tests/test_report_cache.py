@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import logging
+import os
+
+from airbyte_cdk.models import Type
+from integration_tests.benchmark import make_catalog, make_config
+from integration_tests.mock_server import MockYahooAdsServer, use_mock_server
+from source_yahoo_ads.api import YahooAds
+from source_yahoo_ads.report_cache import ReportCache
+from source_yahoo_ads.source import SourceYahooAds
+
+PARTITION = ReportCache.partition("YSS", "AD", "1000", ["DAY", "AD_ID", "COST"])
+
+
+def make_record(day, ad_id):
+    return {"日": day, "広告ID": ad_id, "コスト": 1.5, "アカウントID": "1000"}
+
+
+def test_partition_depends_on_the_field_set():
+    assert PARTITION != ReportCache.partition("YSS", "AD", "1000", ["DAY", "AD_ID"])
+    assert PARTITION != ReportCache.partition("YSS", "AD", "2000", ["DAY", "AD_ID", "COST"])
+
+
+def test_writer_caches_finalized_days_once_committed(tmp_path):
+    cache = ReportCache(str(tmp_path), attribution_days=2, end_date="20230110")
+    assert cache.finalized_until == "20230108"
+
+    writer = cache.writer(PARTITION, "20230105", "20230110")
+    for record in [make_record("2023-01-05", 1), make_record("2023-01-05", 2), make_record("2023-01-07", 1), make_record("2023-01-09", 1)]:
+        writer.write(record)
+    assert cache.cached_until(PARTITION, "20230105", "20230110") is None
+    writer.commit()
+    writer.close()
+
+    # 2023-01-06 had no rows, 2023-01-09 and later are not finalized yet
+    assert cache.cached_until(PARTITION, "20230105", "20230110") == "20230108"
+    assert list(cache.read(PARTITION, "20230105", "20230108")) == [
+        make_record("2023-01-05", 1), make_record("2023-01-05", 2), make_record("2023-01-07", 1)]
+    assert not os.path.exists(cache.day_path(PARTITION, "20230109"))
+
+
+def test_writer_drops_reports_that_were_not_read_to_the_end(tmp_path):
+    cache = ReportCache(str(tmp_path), attribution_days=0, end_date="20230110")
+    writer = cache.writer(PARTITION, "20230101", "20230102")
+    writer.write(make_record("2023-01-01", 1))
+    writer.close()
+
+    assert cache.cached_until(PARTITION, "20230101", "20230102") is None
+    assert not any(files for _, _, files in os.walk(tmp_path))
+
+
+def test_cached_until_stops_at_the_first_missing_day(tmp_path):
+    cache = ReportCache(str(tmp_path), attribution_days=0, end_date="20230110")
+    for start_date, end_date in [("20230101", "20230102"), ("20230104", "20230105")]:
+        writer = cache.writer(PARTITION, start_date, end_date)
+        writer.commit()
+    assert cache.cached_until(PARTITION, "20230101", "20230110") == "20230102"
+    assert cache.cached_until(PARTITION, "20230103", "20230110") is None
+
+
+def read_records(base_url, config):
+    with use_mock_server(base_url):
+        return [
+            message.record for message in SourceYahooAds().read(logging.getLogger("airbyte"), config, make_catalog("YSS"), state=[])
+            if message.type == Type.RECORD
+        ]
+
+
+def test_read_serves_finalized_days_from_the_cache(tmp_path):
+    config = make_config("YSS", days=6, report_cache_path=str(tmp_path), report_cache_attribution_days=2)
+    finalized_until = ReportCache(str(tmp_path), 2, YahooAds.get_report_end_date()).finalized_until
+
+    def finalized_rows(records):
+        return sorted(
+            (record.stream, sorted(record.data.items(), key=str)) for record in records
+            if record.data["日"].replace("-", "") <= finalized_until
+        )
+
+    with MockYahooAdsServer(rows_per_report=60) as server:
+        first_records = read_records(server.base_url, config)
+        second_records = read_records(server.base_url, config)
+        add_requests = server.mock_api.request_counts["add"]
+
+    # Both reads created one report per stream, the second one only for the 2 days that are not finalized
+    assert add_requests == 2 * 3
+    assert len(first_records) == 3 * 60
+    assert len(second_records) == 3 * (40 + 60)
+    assert finalized_rows(second_records) == finalized_rows(first_records)
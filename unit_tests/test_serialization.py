@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import json
+import logging
+
+import pytest
+from airbyte_cdk.entrypoint import AirbyteEntrypoint
+from airbyte_cdk.models import AirbyteMessage, AirbyteRecordMessage, Type
+from airbyte_cdk.sources.connector_state_manager import HashableStreamDescriptor
+from airbyte_cdk.utils import message_utils
+from integration_tests.benchmark import make_catalog, make_config
+from integration_tests.mock_server import MockYahooAdsServer, use_mock_server
+from source_yahoo_ads.serialization import RecordMessageEncoder
+from source_yahoo_ads.source import SourceYahooAds
+
+DATA = {"日": "2023-01-01", "広告名": "春の\"セール\"\n", "広告ID": 123, "コスト": 1.5, "デバイス": None}
+
+
+def cdk_message_json(data, namespace=None):
+    record = AirbyteRecordMessage(stream="yss_ad", data=data, emitted_at=1672531200000)
+    if namespace is not None:
+        record.namespace = namespace
+    return AirbyteMessage(type=Type.RECORD, record=record).json(exclude_unset=True)
+
+
+@pytest.mark.parametrize("namespace", [None, "広告"])
+def test_encoded_record_matches_cdk_serialization_without_escaping(namespace):
+    message = RecordMessageEncoder("yss_ad", namespace).message(DATA)
+    message.record = message.record._replace(emitted_at=1672531200000)
+
+    serialized = AirbyteEntrypoint.airbyte_message_to_string(message)
+
+    # Byte for byte what the CDK writes, only without escaping the Japanese text
+    assert serialized == json.dumps(json.loads(cdk_message_json(DATA, namespace)), ensure_ascii=False)
+    assert "広告名" in serialized
+
+
+def test_encoded_record_is_counted_like_a_record_message():
+    message = RecordMessageEncoder("yss_ad").message(DATA)
+    assert message.type == Type.RECORD
+    assert message_utils.get_stream_descriptor(message) == HashableStreamDescriptor(name="yss_ad", namespace=None)
+
+
+def test_read_emits_fast_serialized_records():
+    config = make_config("YSS", days=2, fast_record_serialization=True)
+    with MockYahooAdsServer(rows_per_report=20) as server, use_mock_server(server.base_url):
+        messages = [
+            message for message in SourceYahooAds().read(logging.getLogger("airbyte"), config, make_catalog("YSS"), state=[])
+            if message.type == Type.RECORD
+        ]
+    assert len(messages) == 3 * 20
+    record = json.loads(AirbyteEntrypoint.airbyte_message_to_string(messages[0]))
+    assert record["type"] == "RECORD"
+    assert record["record"]["stream"] == "yss_ad"
+    assert record["record"]["data"]["アカウントID"] == "1000"
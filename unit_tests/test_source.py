@@ -2,21 +2,80 @@
 # Copyright (c) 2023 Airbyte, Inc., all rights reserved.
 #
 
-from unittest.mock import MagicMock
+import logging
 
+from airbyte_cdk.models import ConfiguredAirbyteCatalog, ConfiguredAirbyteStream, DestinationSyncMode, SyncMode, Type
+from source_yahoo_ads.api import YahooAds
 from source_yahoo_ads.source import SourceYahooAds
 
+CONFIG = {
+    "client_id": "client_id",
+    "client_secret": "client_secret",
+    "refresh_token": "refresh_token",
+    "start_date": "20230101",
+    "sync_option": {"option": "YSS_AND_YDN", "yss_account_id": "1000", "ydn_account_id": "2000"},
+    "report_prepare_time_history_path": None,
+}
+
+
+def make_catalog(source, stream_names):
+    streams = {stream.name: stream for stream in source.streams(CONFIG)}
+    return ConfiguredAirbyteCatalog(streams=[
+        ConfiguredAirbyteStream(
+            stream=streams[name].as_airbyte_stream(),
+            sync_mode=SyncMode.full_refresh,
+            destination_sync_mode=DestinationSyncMode.overwrite,
+        )
+        for name in stream_names
+    ])
+
 
 def test_check_connection(mocker):
+    mocker.patch.object(YahooAds, "_request_access_token", return_value={"access_token": "token", "expires_in": 3600})
+    source = SourceYahooAds()
+    logger_mock = mocker.MagicMock()
+    assert source.check_connection(logger_mock, CONFIG) == (True, None)
+
+
+def test_streams_and_discover_make_no_api_calls(mocker):
+    make_request = mocker.patch.object(YahooAds, "_make_request")
     source = SourceYahooAds()
-    logger_mock, config_mock = MagicMock(), MagicMock()
-    assert source.check_connection(logger_mock, config_mock) == (True, None)
+    streams = source.streams(CONFIG)
+    assert [stream.name for stream in streams] == ["yss_ad", "yss_ad_conversion", "yss_keywords", "ydn_ad"]
+    assert len(source.discover(logging.getLogger("airbyte"), CONFIG).streams) == 4
+    make_request.assert_not_called()
 
 
-def test_streams(mocker):
+def test_read_only_creates_report_jobs_for_configured_streams(mocker):
+    mocker.patch.object(YahooAds, "_request_access_token", return_value={"access_token": "token", "expires_in": 3600})
+    mocker.patch.object(YahooAds, "REPORT_PREPARE_TIME", 0.01)
+    create_report = mocker.patch.object(YahooAds, "create_report", side_effect=lambda **report_request: {
+        **report_request, "report_job_id": report_request["start_date"], "report_job_status": "WAIT"})
+    mocker.patch.object(YahooAds, "get_reports", side_effect=lambda ads_type, account_id, report_job_ids: [
+        {"reportJobId": report_job_id, "reportJobStatus": "COMPLETED"} for report_job_id in report_job_ids])
+    remove_reports = mocker.patch.object(YahooAds, "remove_reports", return_value=0)
+    mocker.patch("source_yahoo_ads.streams.YahooAdsStream.read_records", return_value=iter([]))
     source = SourceYahooAds()
-    config_mock = MagicMock()
-    streams = source.streams(config_mock)
-    # TODO: replace this with your streams number
-    expected_streams_number = 2
-    assert len(streams) == expected_streams_number
+    catalog = make_catalog(source, ["yss_keywords"])
+
+    messages = list(source.read(logging.getLogger("airbyte"), CONFIG, catalog, state=[]))
+
+    assert create_report.call_count >= 1
+    assert {(call.kwargs["ads_type"], call.kwargs["stream"]) for call in create_report.call_args_list} == {("YSS", "KEYWORDS")}
+    assert len(remove_reports.call_args.args[0]) == create_report.call_count
+    assert not [message for message in messages if message.type == Type.TRACE and message.trace.error]
+
+
+def test_plan_report_windows_reuses_resumed_jobs():
+    resumed_report_jobs = [
+        {"start_date": "20230105", "end_date": "20230106", "report_job_id": "7", "report_job_status": "COMPLETED"},
+        # Starts before the period of this attempt, its rows are requested again
+        {"start_date": "20221230", "end_date": "20230101", "report_job_id": "6", "report_job_status": "COMPLETED"},
+    ]
+    assert SourceYahooAds._plan_report_windows("20230101", "20230110", 3, "DAY", resumed_report_jobs) == [
+        {"start_date": "20230101", "end_date": "20230103"},
+        {"start_date": "20230104", "end_date": "20230104"},
+        {"start_date": "20230105", "end_date": "20230106", "report_job_id": "7", "report_job_status": "COMPLETED"},
+        {"start_date": "20230107", "end_date": "20230109"},
+        {"start_date": "20230110", "end_date": "20230110"},
+    ]
@@ -2,82 +2,208 @@
 # Copyright (c) 2023 Airbyte, Inc., all rights reserved.
 #
 
+import logging
 from http import HTTPStatus
+from unittest import mock
 from unittest.mock import MagicMock
 
 import pytest
-from source_yahoo_ads.source import YahooAdsStream
+from airbyte_cdk.models import SyncMode, Type
+from integration_tests.benchmark import make_catalog, make_config, run_read
+from integration_tests.mock_server import SyntheticReport, use_mock_server
+from source_yahoo_ads.api import YahooAds
+from source_yahoo_ads.auth import YahooAdsAuthenticator
+from source_yahoo_ads.source import SourceYahooAds
+from source_yahoo_ads.streams import YdnAd, YssAd
 
+STREAM_SLICE = {"account_id": "1000", "report_job_id": "42", "report_job_status": "COMPLETED", "start_date": "20230101", "end_date": "20230107"}
 
-@pytest.fixture
-def patch_base_class(mocker):
-    # Mock abstract methods to enable instantiating abstract class
-    mocker.patch.object(YahooAdsStream, "path", "v0/example_endpoint")
-    mocker.patch.object(YahooAdsStream, "primary_key", "test_primary_key")
-    mocker.patch.object(YahooAdsStream, "__abstractmethods__", set())
 
+def test_request_body_json():
+    stream = YssAd()
+    inputs = {"stream_slice": STREAM_SLICE, "stream_state": None, "next_page_token": None}
+    assert stream.request_body_json(**inputs) == {"accountId": "1000", "reportJobId": "42"}
 
-def test_request_params(patch_base_class):
-    stream = YahooAdsStream()
-    # TODO: replace this with your input parameters
-    inputs = {"stream_slice": None, "stream_state": None, "next_page_token": None}
-    # TODO: replace this with your expected request parameters
-    expected_params = {}
-    assert stream.request_params(**inputs) == expected_params
 
+def test_next_page_token():
+    assert YssAd().next_page_token(response=MagicMock()) is None
 
-def test_next_page_token(patch_base_class):
-    stream = YahooAdsStream()
-    # TODO: replace this with your input parameters
-    inputs = {"response": MagicMock()}
-    # TODO: replace this with your expected next page token
-    expected_token = None
-    assert stream.next_page_token(**inputs) == expected_token
 
+def test_request_headers():
+    assert YdnAd().request_headers(stream_slice=STREAM_SLICE, stream_state=None, next_page_token=None) == {
+        "Content-Type": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+    }
 
-def test_parse_response(patch_base_class):
-    stream = YahooAdsStream()
-    # TODO: replace this with your input parameters
-    inputs = {"response": MagicMock()}
-    # TODO: replace this with your expected parced object
-    expected_parsed_object = {}
-    assert next(stream.parse_response(**inputs)) == expected_parsed_object
 
-
-def test_request_headers(patch_base_class):
-    stream = YahooAdsStream()
-    # TODO: replace this with your input parameters
-    inputs = {"stream_slice": None, "stream_state": None, "next_page_token": None}
-    # TODO: replace this with your expected request headers
-    expected_headers = {}
-    assert stream.request_headers(**inputs) == expected_headers
-
-
-def test_http_method(patch_base_class):
-    stream = YahooAdsStream()
-    # TODO: replace this with your expected http request method
-    expected_method = "GET"
-    assert stream.http_method == expected_method
+def test_http_method():
+    assert YssAd().http_method == "POST"
+    assert YssAd().path() == "download"
 
 
 @pytest.mark.parametrize(
-    ("http_status", "should_retry"),
+    ("http_status", "body", "should_retry"),
     [
-        (HTTPStatus.OK, False),
-        (HTTPStatus.BAD_REQUEST, False),
-        (HTTPStatus.TOO_MANY_REQUESTS, True),
-        (HTTPStatus.INTERNAL_SERVER_ERROR, True),
+        (HTTPStatus.OK, None, False),
+        (HTTPStatus.BAD_REQUEST, None, False),
+        (HTTPStatus.FORBIDDEN, [{"errorCode": "NO_PERMISSION"}], False),
+        (HTTPStatus.FORBIDDEN, [{"errorCode": "REQUEST_LIMIT_EXCEEDED"}], True),
+        (HTTPStatus.TOO_MANY_REQUESTS, None, True),
+        (HTTPStatus.INTERNAL_SERVER_ERROR, None, True),
     ],
 )
-def test_should_retry(patch_base_class, http_status, should_retry):
+def test_should_retry(http_status, body, should_retry):
     response_mock = MagicMock()
     response_mock.status_code = http_status
-    stream = YahooAdsStream()
-    assert stream.should_retry(response_mock) == should_retry
+    response_mock.json.return_value = body
+    assert YssAd().should_retry(response_mock) == should_retry
 
 
-def test_backoff_time(patch_base_class):
+def test_backoff_time():
     response_mock = MagicMock()
-    stream = YahooAdsStream()
-    expected_backoff_time = None
-    assert stream.backoff_time(response_mock) == expected_backoff_time
+    response_mock.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+    assert YssAd().backoff_time(response_mock) is None
+
+
+def test_synthetic_report_has_japanese_headers_and_unique_keys():
+    report = SyntheticReport("YSS", "1000", ["DAY", "DEVICE", "AD_ID", "COST"], "20230101", "20230103", rows=30)
+    lines = list(report.lines())
+    assert lines[0] == "日,デバイス,広告ID,コスト\n"
+    assert len(lines) == 31
+    keys = [tuple(line.split(",")[:3]) for line in lines[1:]]
+    assert len(set(keys)) == len(keys)
+
+
+def test_parse_response_from_mock_server(mock_server):
+    with use_mock_server(mock_server.base_url):
+        yahoo_ads = YahooAds(sync_option={"yss_account_id": "1000"}, report_prepare_time_history_path=None)
+        yahoo_ads.login()
+        report_job = yahoo_ads.create_report("YSS", "AD", "20230101", "20230105")
+        stream = YssAd(report_jobs=[{**report_job, "report_job_status": "COMPLETED"}], authenticator=YahooAdsAuthenticator(yahoo_ads.token_manager))
+        records = list(stream.read_records(SyncMode.full_refresh, stream_slice=next(stream.stream_slices(SyncMode.full_refresh))))
+    assert len(records) == 50
+    assert records[0]["アカウントID"] == "1000"
+    assert isinstance(records[0]["広告ID"], int)
+
+
+@pytest.mark.parametrize(("report_compression", "download_queue_size"), [("NONE", None), ("ZIP", None), ("NONE", 20)])
+def test_read_from_mock_server(mock_server, report_compression, download_queue_size):
+    config = make_config("YSS", days=3, report_window_days=2, report_compression=report_compression,
+                         download_queue_size=download_queue_size)
+    result = run_read(mock_server.base_url, config, make_catalog("YSS"), report_prepare_time=0.01)
+    request_counts = mock_server.mock_api.request_counts
+    # 3 streams with 2 date windows each
+    assert result["records"] == 3 * 2 * 50
+    assert result["time_to_first_record"] is not None
+    assert request_counts["token"] == 1
+    # Every report is downloaded exactly once
+    assert request_counts["add"] == request_counts["download"] == 6
+    # All reports of the account are removed with one request
+    assert request_counts["remove"] == 1
+    assert not mock_server.mock_api.jobs
+
+
+def test_cleanup_and_sweep_on_mock_server(mock_server):
+    with use_mock_server(mock_server.base_url):
+        yahoo_ads = YahooAds(sync_option={"yss_account_id": "1000"}, report_prepare_time_history_path=None)
+        report_jobs = [yahoo_ads.create_report("YSS", "AD", "20230101", "20230101") for _ in range(3)]
+        stale_report_job = yahoo_ads.create_report("YSS", "AD", "20230101", "20230101")
+        mock_server.mock_api.jobs[int(stale_report_job["report_job_id"])]["request_time"] = "2023-01-01 00:00:00"
+        assert yahoo_ads.remove_reports(report_jobs) == 3
+        assert mock_server.mock_api.request_counts["remove"] == 1
+        assert yahoo_ads.sweep_stale_reports("YSS", "1000", 24) == 1
+    assert not mock_server.mock_api.jobs
+
+
+def test_read_only_requests_selected_columns(mock_server):
+    catalog = make_catalog("YSS")
+    for configured_stream in catalog.streams:
+        properties = configured_stream.stream.json_schema["properties"]
+        configured_stream.stream.json_schema["properties"] = {
+            column: schema for column, schema in properties.items() if column in ("日", "コスト", "コンバージョン数")}
+    messages = []
+    with mock.patch("integration_tests.benchmark.AirbyteEntrypoint.airbyte_message_to_string", side_effect=messages.append):
+        result = run_read(mock_server.base_url, make_config("YSS", days=1), catalog, report_prepare_time=0.01)
+    assert result["records"] == 3 * 50
+    columns = {message.record.stream: set(message.record.data) for message in messages if message.type == Type.RECORD}
+    assert columns["yss_ad"] == {"アカウントID", "日", "デバイス", "広告ID", "コスト", "コンバージョン数"}
+    assert columns["yss_ad_conversion"] == {"アカウントID", "日", "デバイス", "広告ID", "コンバージョン名", "コンバージョン数"}
+    assert "キーワード" not in columns["yss_keywords"]
+
+
+def test_weekly_stream_without_device_adapts_schema_and_keys():
+    stream = YssAd(time_unit="WEEK", include_device=False)
+    assert stream.primary_key == ["広告ID", "週"]
+    assert stream.cursor_field == "週"
+    properties = stream.get_json_schema()["properties"]
+    assert "週" in properties and "日" not in properties and "デバイス" not in properties
+    # Built once, not for every record the CDK transforms
+    assert stream.get_json_schema() is stream.get_json_schema()
+    assert YssAd().primary_key == ["広告ID", "日", "デバイス"]
+
+
+def test_read_weekly_reports_from_mock_server(mock_server):
+    config = make_config("YSS", days=14, report_granularity=[{"stream": "yss_ad", "time_unit": "WEEK", "include_device": False}])
+    messages = []
+    with mock.patch("integration_tests.benchmark.AirbyteEntrypoint.airbyte_message_to_string", side_effect=messages.append):
+        run_read(mock_server.base_url, config, make_catalog("YSS"), report_prepare_time=0.01)
+    records = [message.record.data for message in messages if message.type == Type.RECORD and message.record.stream == "yss_ad"]
+    assert records and all("週" in record and "日" not in record and "デバイス" not in record for record in records)
+    assert len({(record["広告ID"], record["週"]) for record in records}) == len(records)
+
+
+def make_resumable_catalog():
+    catalog = make_catalog("YSS")
+    catalog.streams = catalog.streams[:1]
+    catalog.streams[0].sync_mode = SyncMode.incremental
+    catalog.streams[0].cursor_field = ["日"]
+    return catalog
+
+
+@pytest.mark.parametrize("max_concurrent_report_jobs", [4, 1])
+def test_retry_reuses_report_jobs_of_the_failed_attempt(mock_server, max_concurrent_report_jobs):
+    # With a lookback window shorter than a report window, the retry only redoes the slices that were not read
+    config = make_config("YSS", days=6, report_window_days=2, lookback_window_days=0, resume_report_jobs=True,
+                         max_concurrent_report_jobs=max_concurrent_report_jobs)
+    catalog = make_resumable_catalog()
+    logger = logging.getLogger("airbyte")
+    with use_mock_server(mock_server.base_url), mock.patch.object(YahooAds, "REPORT_PREPARE_TIME", 0.01):
+        messages = SourceYahooAds().read(logger, config, catalog, state=[])
+        # The sync dies after the first slice was checkpointed
+        state_message = next(message for message in messages if message.type == Type.STATE)
+        messages.close()
+        stream_state = state_message.state.stream.stream_state.dict()
+        report_jobs = stream_state.get("report_jobs", [])
+        # The first report was read, the state lists the reports created for the later slices so far
+        assert len(report_jobs) <= 2
+        assert all(report_job["start_date"] > stream_state["日"] for report_job in report_jobs)
+        # Only those are kept for the retry
+        assert sorted(mock_server.mock_api.jobs) == sorted(int(report_job["report_job_id"]) for report_job in report_jobs)
+        add_count = mock_server.mock_api.request_counts["add"]
+
+        messages = list(SourceYahooAds().read(logger, config, catalog, state=[state_message.state]))
+    records = [message for message in messages if message.type == Type.RECORD]
+    state_messages = [message for message in messages if message.type == Type.STATE]
+    request_counts = mock_server.mock_api.request_counts
+    # The retry creates the reports of the later slices not in the state
+    # and one for the last day of the first slice, the state's cursor
+    assert request_counts["add"] == add_count + (2 - len(report_jobs)) + 1
+    assert len(records) == 3 * 50
+    # The finished stream leaves no report jobs in its state
+    assert "report_jobs" not in state_messages[-1].state.stream.stream_state.dict()
+    assert not mock_server.mock_api.jobs
+
+
+def test_failed_first_slice_removes_all_report_jobs(mock_server):
+    config = make_config("YSS", days=6, report_window_days=2, resume_report_jobs=True)
+    logger = logging.getLogger("airbyte")
+    with use_mock_server(mock_server.base_url), mock.patch.object(YahooAds, "REPORT_PREPARE_TIME", 0.01), \
+            mock.patch.object(YssAd, "parse_response", side_effect=RuntimeError("download failed")):
+        messages = []
+        with pytest.raises(Exception):
+            for message in SourceYahooAds().read(logger, config, make_resumable_catalog(), state=[]):
+                messages.append(message)
+    # Nothing was checkpointed, so a retry can't reuse any report
+    assert not [message for message in messages if message.type == Type.STATE]
+    assert mock_server.mock_api.request_counts["add"] >= 1
+    assert not mock_server.mock_api.jobs
@@ -0,0 +1,208 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import io
+import time
+import zipfile
+
+import pytest
+from source_yahoo_ads import utils
+from source_yahoo_ads.exceptions import ReportDecompressionError, TmpFileIOError
+from source_yahoo_ads.utils import (
+    generate_spooled_download,
+    generate_temp_download,
+    get_period_start,
+    iter_in_background,
+    iter_text_lines,
+    iter_unzipped_chunks,
+    normalize_report_date,
+    split_date_range,
+)
+
+from .helpers import make_response
+
+CSV_CONTENT = '日,広告名,コスト\n2023-01-01,"春の\nセール",100\n2023-01-02,夏,200\n'.encode("utf-8")
+
+
+def split_bytes(content, size):
+    return [content[i : i + size] for i in range(0, len(content), size)]
+
+
+class UnseekableFile(io.RawIOBase):
+    # Makes zipfile write a data descriptor like a streaming server would
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+
+def make_zip(content, compression=zipfile.ZIP_DEFLATED, seekable=True):
+    archive_file = io.BytesIO() if seekable else UnseekableFile()
+    with zipfile.ZipFile(archive_file, "w", compression=compression) as archive:
+        archive.writestr("report.csv", content)
+    return bytes(archive_file.getvalue() if seekable else archive_file.buffer)
+
+
+def test_iter_text_lines_handles_characters_split_across_chunks():
+    # 1-byte chunks cut every multi-byte character in the middle
+    lines = list(iter_text_lines(split_bytes(CSV_CONTENT, 1)))
+    assert "".join(lines) == CSV_CONTENT.decode("utf-8")
+    assert lines[0] == "日,広告名,コスト\n"
+
+
+def test_generate_temp_download_parses_quoted_multiline_fields():
+    rows = list(generate_temp_download(make_response(chunks=split_bytes(CSV_CONTENT, 7))))
+    assert rows == [
+        {"日": "2023-01-01", "広告名": "春の\nセール", "コスト": "100"},
+        {"日": "2023-01-02", "広告名": "夏", "コスト": "200"},
+    ]
+
+
+def test_generate_temp_download_yields_before_download_finishes():
+    consumed = []
+
+    def chunks():
+        for chunk in split_bytes(CSV_CONTENT, 16):
+            consumed.append(chunk)
+            yield chunk
+
+    rows = generate_temp_download(make_response(chunks=chunks()))
+    assert next(rows)["日"] == "2023-01-01"
+    assert len(consumed) < len(split_bytes(CSV_CONTENT, 16))
+
+
+def test_generate_temp_download_spools_large_reports(mocker):
+    temporary_file = mocker.spy(utils.tempfile, "TemporaryFile")
+    response = make_response(chunks=split_bytes(CSV_CONTENT, 5))
+    response.headers = {"Content-Length": str(len(CSV_CONTENT))}
+
+    rows = list(generate_temp_download(response, spool_threshold_bytes=len(CSV_CONTENT)))
+
+    assert temporary_file.call_count == 1
+    assert [row["広告名"] for row in rows] == ["春の\nセール", "夏"]
+    response.close.assert_called_once()
+
+
+def test_generate_temp_download_keeps_reports_below_threshold_in_memory(mocker):
+    temporary_file = mocker.spy(utils.tempfile, "TemporaryFile")
+    response = make_response(chunks=split_bytes(CSV_CONTENT, 5))
+    response.headers = {"Content-Length": str(len(CSV_CONTENT))}
+
+    assert len(list(generate_temp_download(response, spool_threshold_bytes=len(CSV_CONTENT) + 1))) == 2
+    assert temporary_file.call_count == 0
+    response.close.assert_called_once()
+
+
+def test_generate_temp_download_spools_chunked_and_compressed_reports_by_their_size(mocker):
+    temporary_file = mocker.spy(utils.tempfile, "TemporaryFile")
+    # A chunked response has no Content-Length, and the ZIP on the wire is smaller than the report
+    content = CSV_CONTENT + "2023-01-03,秋,300\n".encode("utf-8") * 200
+    archive = make_zip(content)
+    assert len(archive) < len(content) // 2
+    response = make_response(chunks=split_bytes(archive, 64))
+    response.headers = {}
+
+    rows = list(generate_temp_download(response, spool_threshold_bytes=len(content) // 2))
+
+    assert temporary_file.call_count == 1
+    assert len(rows) == 202
+    response.close.assert_called_once()
+
+
+def test_generate_spooled_download_reports_temp_file_errors(mocker):
+    mocker.patch("source_yahoo_ads.utils.tempfile.TemporaryFile", side_effect=OSError("disk full"))
+    with pytest.raises(TmpFileIOError):
+        list(generate_spooled_download(make_response(chunks=[CSV_CONTENT])))
+
+
+def test_split_date_range_into_windows():
+    assert split_date_range("20230125", "20230210", 7) == [
+        ("20230125", "20230131"),
+        ("20230201", "20230207"),
+        ("20230208", "20230210"),
+    ]
+
+
+def test_split_date_range_without_window_keeps_whole_range():
+    assert split_date_range("20230101", "20230210") == [("20230101", "20230210")]
+
+
+def test_split_date_range_keeps_weeks_and_months_whole():
+    assert split_date_range("20230102", "20230131", 14, "WEEK") == [
+        ("20230102", "20230115"),
+        ("20230116", "20230129"),
+        ("20230130", "20230131"),
+    ]
+    # A month longer than the window is not split
+    assert split_date_range("20230101", "20230315", 7, "MONTH") == [
+        ("20230101", "20230131"),
+        ("20230201", "20230228"),
+        ("20230301", "20230315"),
+    ]
+    assert split_date_range("20230101", "20230315", None, "MONTH") == [("20230101", "20230315")]
+
+
+def test_period_start_and_month_values():
+    assert get_period_start("20230105", "WEEK") == "20230102"
+    assert get_period_start("20230215", "MONTH") == "20230201"
+    assert get_period_start("20230215") == "20230215"
+    assert normalize_report_date("2023-02") == "20230201"
+
+
+@pytest.mark.parametrize(
+    ("compression", "seekable"),
+    [(zipfile.ZIP_DEFLATED, True), (zipfile.ZIP_DEFLATED, False), (zipfile.ZIP_STORED, True)],
+)
+def test_iter_unzipped_chunks_inflates_while_downloading(compression, seekable):
+    archive = make_zip(CSV_CONTENT, compression, seekable)
+    assert b"".join(iter_unzipped_chunks(split_bytes(archive, 5))) == CSV_CONTENT
+
+
+def test_iter_unzipped_chunks_rejects_corrupted_and_truncated_archives():
+    archive = make_zip(CSV_CONTENT)
+    with pytest.raises(ReportDecompressionError):
+        list(iter_unzipped_chunks([archive[: len(archive) // 2]]))
+    # Zero the CRC-32 of the local file header
+    corrupted = archive[:14] + b"\0\0\0\0" + archive[18:]
+    with pytest.raises(ReportDecompressionError, match="CRC-32"):
+        list(iter_unzipped_chunks([corrupted]))
+
+
+@pytest.mark.parametrize("spool_threshold_bytes", [None, 0])
+def test_generate_temp_download_detects_zip_reports(spool_threshold_bytes):
+    response = make_response(chunks=split_bytes(make_zip(CSV_CONTENT), 7))
+    response.headers = {}
+    rows = list(generate_temp_download(response, spool_threshold_bytes=spool_threshold_bytes))
+    assert [row["コスト"] for row in rows] == ["100", "200"]
+
+
+def test_iter_in_background_keeps_order_and_bounds_queued_rows():
+    produced = []
+
+    def rows():
+        for row in range(10000):
+            produced.append(row)
+            yield row
+
+    records = iter_in_background(rows(), max_queued_rows=100)
+    assert [next(records) for _ in range(10)] == list(range(10))
+    time.sleep(0.1)
+    # The queued rows plus the batch being consumed and the one the worker is filling
+    assert len(produced) <= 100 + 2 * 25
+    records.close()
+    assert list(iter_in_background(rows(), max_queued_rows=100)) == list(range(10000))
+
+
+def test_iter_in_background_raises_worker_errors():
+    def rows():
+        yield 1
+        raise RuntimeError("connection reset")
+
+    with pytest.raises(RuntimeError, match="connection reset"):
+        list(iter_in_background(rows(), max_queued_rows=10))